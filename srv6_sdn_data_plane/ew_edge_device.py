@@ -47,6 +47,12 @@ DEFAULT_CERTIFICATE = 'cert_server.pem'
 DEFAULT_KEY = 'key_server.pem'
 # Default southbound interface
 DEFAULT_SB_INTERFACE = 'gRPC'
+# Default backend used to program the dataplane
+DEFAULT_DATAPLANE_BACKEND = sb_grpc_server.DEFAULT_DATAPLANE_BACKEND
+# Default STAMP support setting
+DEFAULT_ENABLE_STAMP_SUPPORT = sb_grpc_server.DEFAULT_ENABLE_STAMP_SUPPORT
+# Default low memory mode setting
+DEFAULT_LOW_MEMORY = sb_grpc_server.DEFAULT_LOW_MEMORY
 
 # Default verbose mode
 # DEFAULT_VERBOSE = False
@@ -115,6 +121,9 @@ class EWEdgeDevice(object):
         incoming_sr_transparency=DEFAULT_INCOMING_SR_TRANSPARENCY,
         outgoing_sr_transparency=DEFAULT_OUTGOING_SR_TRANSPARENCY,
         allow_reboot=False,
+        dataplane_backend=DEFAULT_DATAPLANE_BACKEND,
+        enable_stamp_support=DEFAULT_ENABLE_STAMP_SUPPORT,
+        low_memory=DEFAULT_LOW_MEMORY,
         verbose=True,
         # verbose=DEFAULT_VERBOSE
     ):
@@ -188,6 +197,12 @@ class EWEdgeDevice(object):
         self.outgoing_sr_transparency = outgoing_sr_transparency
         # Is reboot allowed?
         self.allow_reboot = allow_reboot
+        # Backend used to program the dataplane
+        self.dataplane_backend = dataplane_backend
+        # Define whether to enable or not STAMP support
+        self.enable_stamp_support = enable_stamp_support
+        # Low memory mode
+        self.low_memory = low_memory
         
         
         
@@ -223,6 +238,11 @@ class EWEdgeDevice(object):
             print('*** Outgoing SR Transparency: %s' %
                   self.outgoing_sr_transparency)
             print('*** Allow reboot: %s' % self.allow_reboot)
+            print('*** Dataplane backend: %s' % self.dataplane_backend)
+            print('*** STAMP support: %s' % ('Enabled'
+                  if self.enable_stamp_support else 'Disabled'))
+            print('*** Low memory mode: %s' % ('Enabled'
+                  if self.low_memory else 'Disabled'))
             print()
 
     # Start registration client
@@ -314,7 +334,10 @@ class EWEdgeDevice(object):
             zebra_port=self.zebra_port,
             ospf6d_port=self.ospf6d_port,
             stop_event=stop_event,
-            reboot_required=reboot_required
+            reboot_required=reboot_required,
+            dataplane_backend=self.dataplane_backend,
+            enable_stamp_support=self.enable_stamp_support,
+            low_memory=self.low_memory
         )
 
 
@@ -555,6 +578,30 @@ def parseArguments():
         default=False,
         help='Is reboot allowed?'
     )
+    # Backend used to program the dataplane
+    parser.add_argument(
+        '--dataplane-backend',
+        dest='dataplane_backend',
+        action='store',
+        default=DEFAULT_DATAPLANE_BACKEND,
+        help='Backend used to program the dataplane'
+    )
+    # Define whether to enable or not STAMP support
+    parser.add_argument(
+        '--disable-stamp',
+        dest='enable_stamp_support',
+        action='store_false',
+        default=DEFAULT_ENABLE_STAMP_SUPPORT,
+        help='Disable STAMP support'
+    )
+    # Low memory mode
+    parser.add_argument(
+        '--low-memory',
+        dest='low_memory',
+        action='store_true',
+        default=DEFAULT_LOW_MEMORY,
+        help='Enable low memory mode'
+    )
     # Config file
     parser.add_argument(
         '-c',
@@ -601,6 +648,9 @@ def parse_config_file(config_file):
         incoming_sr_transparency = None
         outgoing_sr_transparency = None
         allow_reboot = None
+        dataplane_backend = None
+        enable_stamp_support = None
+        low_memory = None
 
     args = Args()
     # Get parser
@@ -699,6 +749,18 @@ def parse_config_file(config_file):
     )
     # Is reboot allowed?
     args.allow_reboot = config['DEFAULT'].getboolean('allow-reboot', False)
+    # Backend used to program the dataplane
+    args.dataplane_backend = config['DEFAULT'].get(
+        'dataplane_backend', DEFAULT_DATAPLANE_BACKEND
+    )
+    # Define whether to enable or not STAMP support
+    args.enable_stamp_support = config['DEFAULT'].getboolean(
+        'enable_stamp_support', DEFAULT_ENABLE_STAMP_SUPPORT
+    )
+    # Low memory mode
+    args.low_memory = config['DEFAULT'].getboolean(
+        'low_memory', DEFAULT_LOW_MEMORY
+    )
     # Interval between two consecutive keep alive messages
     args.token_file = config['DEFAULT'].get('token_file', DEFAULT_TOKEN_FILE)
     # Done, return
@@ -779,6 +841,12 @@ def _main():
     outgoing_sr_transparency = args.outgoing_sr_transparency
     # Is reboot allowed
     allow_reboot = args.allow_reboot
+    # Backend used to program the dataplane
+    dataplane_backend = args.dataplane_backend
+    # Define whether to enable or not STAMP support
+    enable_stamp_support = args.enable_stamp_support
+    # Low memory mode
+    low_memory = args.low_memory
     #
     # Check debug level
     SERVER_DEBUG = logger.getEffectiveLevel() == logging.DEBUG
@@ -843,6 +911,9 @@ def _main():
         incoming_sr_transparency=incoming_sr_transparency,
         outgoing_sr_transparency=outgoing_sr_transparency,
         allow_reboot=allow_reboot,
+        dataplane_backend=dataplane_backend,
+        enable_stamp_support=enable_stamp_support,
+        low_memory=low_memory,
         verbose=verbose
     )
 
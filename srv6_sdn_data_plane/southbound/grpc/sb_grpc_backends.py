@@ -0,0 +1,1565 @@
+#!/usr/bin/python
+
+# Dataplane backends for the SRv6 gRPC Southbound
+#
+# The SRv6Manager does not talk to the kernel directly: every operation
+# (routes, rules, links, neighbors, seg6local, tunnels, firewall, probes
+# and Quagga sessions) goes through a backend object. The backend is
+# selected by name when the server is started, so alternative
+# implementations (e.g. a batched netlink backend) can be plugged in
+# without touching the request handlers.
+#
+
+from __future__ import absolute_import, division, print_function
+
+# General imports
+import hashlib
+import json
+import logging
+import math
+import re
+import subprocess
+import threading
+from ipaddress import ip_network
+from socket import AF_INET, AF_INET6
+from pyroute2 import IPRoute
+from pyroute2.netlink import NLM_F_ACK, NLM_F_CREATE, NLM_F_EXCL
+from pyroute2.netlink import NLM_F_REPLACE, NLM_F_REQUEST
+from pyroute2.netlink.exceptions import NetlinkError
+from pyroute2.netlink.rtnl import RTM_NEWROUTE
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+from pyroute2.netlink.rtnl.req import IPLinkRequest
+
+from .sb_grpc_utils import InvalidFirewallRuleError, NftablesError
+from .sb_grpc_utils import InvalidLoadBalancerError
+from .sb_grpc_utils import LazyModule
+from .sb_grpc_netlink import AF_BRIDGE, NEIGH_OPS, NTF_SELF, NUD_NOARP
+from .sb_grpc_netlink import IFF_UP, LINK_CREATE_FLAGS, LINK_SET_FLAGS
+from .sb_grpc_netlink import NLMSG_HEADER, RTM_DELLINK, RTM_NEWLINK
+from .sb_grpc_netlink import NUD_PERMANENT, NetlinkPipeline, encode_neigh
+from .sb_grpc_netlink import encode_link, encode_vrf
+from .sb_grpc_seg6 import LWTUNNEL_ENCAP_SEG6, LWTUNNEL_ENCAP_SEG6_LOCAL
+from .sb_grpc_seg6 import SEG6_ENCAPS, get_seg6local_encoder
+from .sb_grpc_seg6 import multipath_route_message, route_message
+from .sb_grpc_seg6 import seg6_encap, seg6_multipath
+
+# python-iptables and telnetlib are loaded by the first request using them
+iptc = LazyModule('iptc')
+telnetlib = LazyModule('telnetlib')
+
+# Logger reference
+logger = logging.getLogger(__name__)
+
+# Default backend
+DEFAULT_DATAPLANE_BACKEND = 'pyroute2'
+
+# Netlink error codes raised by the in-memory backend
+NETLINK_ERROR_NO_SUCH_FILE = 2
+NETLINK_ERROR_NO_SUCH_PROCESS = 3
+NETLINK_ERROR_FILE_EXISTS = 17
+NETLINK_ERROR_NO_SUCH_DEVICE = 19
+
+# Route protocol and type reported by the in-memory backend
+RTPROT_STATIC = 4
+RTN_UNICAST = 1
+
+# Netlink flags of the route requests sent as precompiled messages
+ROUTE_ADD_FLAGS = NLM_F_REQUEST | NLM_F_ACK | NLM_F_CREATE | NLM_F_EXCL
+ROUTE_REPLACE_FLAGS = NLM_F_REQUEST | NLM_F_ACK | NLM_F_CREATE | NLM_F_REPLACE
+PRECOMPILED_ROUTE_FLAGS = {
+    'add': ROUTE_ADD_FLAGS,
+    'replace': ROUTE_REPLACE_FLAGS
+}
+
+
+class DataplaneBackend(object):
+    '''Base class for the dataplane backends'''
+
+    name = None
+
+    # Routes
+    def route(self, op, **kwargs):
+        raise NotImplementedError
+
+    # Routes in batch: routes is a sequence of (op, route() arguments);
+    # return, for each route, a tuple (result, exception)
+    def route_batch(self, routes):
+        return self.run_batch(
+            [('route', (op,), kwargs) for op, kwargs in routes]
+        )
+
+    def flush_routes(self, **kwargs):
+        raise NotImplementedError
+
+    def get_routes(self, **kwargs):
+        raise NotImplementedError
+
+    # Policy routing rules
+    def rule(self, op, **kwargs):
+        raise NotImplementedError
+
+    def get_rules(self, **kwargs):
+        raise NotImplementedError
+
+    # Links
+    def link(self, op, **kwargs):
+        raise NotImplementedError
+
+    def link_lookup(self, **kwargs):
+        raise NotImplementedError
+
+    def get_links(self, *argv, **kwargs):
+        raise NotImplementedError
+
+    # Addresses
+    def addr(self, op, **kwargs):
+        raise NotImplementedError
+
+    def get_addr(self, **kwargs):
+        raise NotImplementedError
+
+    # Neighbors and FDB entries
+    def neigh(self, op, **kwargs):
+        raise NotImplementedError
+
+    def get_neighbours(self, **kwargs):
+        raise NotImplementedError
+
+    def fdb(self, op, **kwargs):
+        raise NotImplementedError
+
+    def get_fdb(self, **kwargs):
+        raise NotImplementedError
+
+    # FDB entries in batch: entries is a sequence of fdb() arguments
+    # (ifindex, lladdr, dst); return, for each entry, a tuple
+    # (result, exception)
+    def fdb_batch(self, op, entries):
+        return self.run_batch([('fdb', (op,), entry) for entry in entries])
+
+    # Neighbors in batch: entries is a sequence of neigh() arguments
+    # (ifindex, dst, lladdr, family, state, flags); return, for each
+    # entry, a tuple (result, exception)
+    def neigh_batch(self, op, entries):
+        return self.run_batch([('neigh', (op,), entry) for entry in entries])
+
+    # SRv6 policies: routes with a seg6 encap (segs is a sequence)
+    def seg6_route(self, op, dst, mode, segs, table=None, oif=None):
+        return self.route(
+            op, dst=dst, oif=oif, table=table,
+            encap_type=LWTUNNEL_ENCAP_SEG6, encap=seg6_encap(mode, segs)
+        )
+
+    # Multipath SRv6 policies: nexthops is a sequence of
+    # (mode, segs, oif, weight)
+    def seg6_multipath_route(self, op, dst, nexthops, table=None):
+        if op == 'del':
+            # Remove all the nexthops of the route
+            return self.route(op, dst=dst, table=table)
+        return self.route(
+            op, dst=dst, table=table, multipath=seg6_multipath(nexthops)
+        )
+
+    # SRv6 local processing functions: value is the parameter of the
+    # behavior (table, nexthop, interface index or segment list)
+    def seg6local(self, op, dst, action=None, value=None, table=None,
+                  oif=None):
+        if op == 'del':
+            return self.route(op, family=AF_INET6, dst=dst, table=table)
+        encoder = get_seg6local_encoder(action)
+        return self.route(
+            op, family=AF_INET6, dst=dst, oif=oif, table=table,
+            encap_type=LWTUNNEL_ENCAP_SEG6_LOCAL, encap=encoder.encode(value)
+        )
+
+    # Tunnel interfaces: create the link and enable it
+    def tunnel(self, op, ifname, kind, **kwargs):
+        if op == 'del':
+            return self.link(op, ifname=ifname)
+        self.link(op, ifname=ifname, kind=kind, **kwargs)
+        ifindex = self.link_lookup(ifname=ifname)[0]
+        return self.link('set', index=ifindex, state='up')
+
+    # Tunnels in batch: tunnels is a sequence of (ifname, kind, params),
+    # where params are the link() arguments of the tunnel (e.g.
+    # gre_local). The tunnels are created up (or deleted, if op is
+    # 'del'); return, for each tunnel, a tuple (ifindex, exception)
+    def tunnel_batch(self, op, tunnels):
+        results = []
+        for ifname, kind, params in tunnels:
+            try:
+                self.tunnel(op, ifname, kind, **params)
+                results.append((
+                    self.link_lookup(ifname=ifname)[0] if op != 'del'
+                    else None, None
+                ))
+            except (NetlinkError, IndexError) as e:
+                results.append((None, e))
+        return results
+
+    # VRFs in batch: vrfs is a sequence of (name, table, interfaces).
+    # Each VRF is created up and its interfaces are enslaved; return, for
+    # each VRF, a tuple (vrfindex, exception). A VRF is not created if
+    # some of its interfaces do not exist, and it is deleted if they
+    # cannot be enslaved
+    def vrf_batch(self, vrfs):
+        results = []
+        for name, table, interfaces in vrfs:
+            try:
+                slaves = [
+                    self.link_lookup(ifname=interface)[0]
+                    for interface in interfaces
+                ]
+                self.link('add', ifname=name, kind='vrf', vrf_table=table)
+            except (NetlinkError, IndexError) as e:
+                results.append((None, e))
+                continue
+            try:
+                vrfindex = self.link_lookup(ifname=name)[0]
+                self.link('set', index=vrfindex, state='up')
+                for slave in slaves:
+                    self.link('set', index=slave, master=vrfindex)
+                results.append((vrfindex, None))
+            except (NetlinkError, IndexError) as e:
+                try:
+                    self.link('del', ifname=name)
+                except (NetlinkError, IndexError):
+                    logger.warning('Cannot delete the VRF %s', name)
+                results.append((None, e))
+        return results
+
+    # Firewall (iptables-like rules, see FirewallRule)
+    def firewall_rules(self, op, rules):
+        raise NotImplementedError
+
+    def firewall_stats(self, table, chain):
+        raise NotImplementedError
+
+    # Weighted load balancing across tunnels (see LoadBalancer): the
+    # default implementation installs a weighted multipath route
+    def load_balancer(self, op, lb):
+        if lb.mode != 'multipath':
+            raise InvalidLoadBalancerError(
+                'Unsupported load balancing mode %s' % lb.mode
+            )
+        if op == 'del':
+            return self.route(op, dst=lb.destination, table=lb.table)
+        multipath = [
+            {
+                'oif': self.link_lookup(ifname=interface)[0],
+                'hops': max(weight, 1) - 1
+            }
+            for interface, weight, _ in lb.members
+        ]
+        return self.route(
+            op, dst=lb.destination, table=lb.table, multipath=multipath
+        )
+
+    # Return the counters of the members of the load balancer. The kernel
+    # does not count the packets of each nexthop of a multipath route, so
+    # the counters of a member are the tx counters of its tunnel: they
+    # include the packets sent through the tunnel to any destination, not
+    # only the load balanced ones
+    def load_balancer_stats(self, lb):
+        links = {}
+        for msg in self.get_links():
+            links[msg.get_attr('IFLA_IFNAME')] = (
+                msg.get_attr('IFLA_STATS64') or {}
+            )
+        return [
+            {
+                'member': interface,
+                'packets': links.get(interface, {}).get('tx_packets', 0),
+                'bytes': links.get(interface, {}).get('tx_bytes', 0)
+            }
+            for interface, _, _ in lb.members
+        ]
+
+    # Probes: mean delay (in ms) of count echo requests; timeout (in
+    # seconds) bounds the wait for each reply
+    def probe_delay(self, out_interface, destination, count=1, timeout=None):
+        raise NotImplementedError
+
+    # Quagga VTY sessions
+    def quagga_session(self, port, password=None):
+        raise NotImplementedError
+
+    # Execute a list of (method, args, kwargs) calls and return, for each
+    # call, a tuple (result, exception); backends able to pipeline the
+    # requests towards the kernel should override this method
+    def run_batch(self, calls):
+        results = []
+        for method, args, kwargs in calls:
+            try:
+                results.append((getattr(self, method)(*args, **kwargs), None))
+            except (NetlinkError, IndexError, KeyError) as e:
+                results.append((None, e))
+        return results
+
+    def close(self):
+        pass
+
+
+class FirewallRule(object):
+    '''Backend independent description of an iptables rule'''
+
+    __slots__ = (
+        'table', 'chain', 'protocol', 'source_ip', 'destination_ip',
+        'source_port', 'destination_port', 'in_interface', 'out_interface',
+        'target_name', 'target_value', 'match_name', 'match_params'
+    )
+
+    def __init__(self, table, chain, target_name, target_value=None,
+                 protocol=None, source_ip=None, destination_ip=None,
+                 source_port=None, destination_port=None,
+                 in_interface=None, out_interface=None,
+                 match_name=None, match_params=None):
+        self.table = table
+        self.chain = chain
+        self.target_name = target_name
+        self.target_value = target_value
+        self.protocol = protocol
+        self.source_ip = source_ip
+        self.destination_ip = destination_ip
+        self.source_port = source_port
+        self.destination_port = destination_port
+        self.in_interface = in_interface
+        self.out_interface = out_interface
+        self.match_name = match_name
+        self.match_params = match_params if match_params is not None else {}
+
+    def key(self):
+        return tuple(getattr(self, attr) if attr != 'match_params'
+                     else tuple(sorted(self.match_params.items()))
+                     for attr in self.__slots__)
+
+    def __repr__(self):
+        return 'FirewallRule(%s)' % ', '.join(
+            '%s=%r' % (attr, getattr(self, attr))
+            for attr in self.__slots__
+            if getattr(self, attr) not in (None, {})
+        )
+
+
+class LoadBalancer(object):
+    '''Backend independent description of a weighted load balancer
+
+    members is a list of (interface, weight, mark). In 'multipath' mode
+    the traffic to destination is split by a weighted multipath route
+    through the interfaces, in 'numgen' mode the packets are marked
+    by a numgen map and each mark is routed through its interface by a
+    policy rule and a route in the table numbered as the mark.
+    '''
+
+    __slots__ = ('name', 'destination', 'members', 'table', 'mode')
+
+    def __init__(self, name, destination, members, table=None,
+                 mode='multipath'):
+        self.name = name
+        self.destination = destination
+        self.members = members
+        self.table = table
+        self.mode = mode
+
+    def slots(self):
+        # One slot for each unit of weight: slot -> member
+        slots = []
+        for member in self.members:
+            slots.extend([member] * max(member[1], 1))
+        return slots
+
+    def __repr__(self):
+        return 'LoadBalancer(%s)' % ', '.join(
+            '%s=%r' % (attr, getattr(self, attr))
+            for attr in self.__slots__
+        )
+
+
+class Pyroute2Backend(DataplaneBackend):
+    '''Kernel backend based on pyroute2 (netlink) and python-iptables'''
+
+    name = 'pyroute2'
+
+    def __init__(self):
+        self.ip_route = IPRoute()
+        # Socket of the pipelined bulk requests
+        self.pipeline = NetlinkPipeline()
+
+    def route(self, op, **kwargs):
+        return self.ip_route.route(op, **kwargs)
+
+    def seg6_route(self, op, dst, mode, segs, table=None, oif=None):
+        # Policies are added or replaced with a precompiled RTM_NEWROUTE
+        # message, using the interned encap of the segment list
+        flags = PRECOMPILED_ROUTE_FLAGS.get(op)
+        if flags is None:
+            return DataplaneBackend.seg6_route(
+                self, op, dst, mode, segs, table, oif
+            )
+        msg = route_message(dst, oif, table, SEG6_ENCAPS.get(mode, segs))
+        return tuple(self.ip_route.nlm_request(
+            msg, msg_type=RTM_NEWROUTE, msg_flags=flags
+        ))
+
+    def seg6_multipath_route(self, op, dst, nexthops, table=None):
+        flags = PRECOMPILED_ROUTE_FLAGS.get(op)
+        if flags is None:
+            return DataplaneBackend.seg6_multipath_route(
+                self, op, dst, nexthops, table
+            )
+        msg = multipath_route_message(dst, table, nexthops)
+        return tuple(self.ip_route.nlm_request(
+            msg, msg_type=RTM_NEWROUTE, msg_flags=flags
+        ))
+
+    def seg6local(self, op, dst, action=None, value=None, table=None,
+                  oif=None):
+        # SIDs are added or replaced with a precompiled RTM_NEWROUTE
+        # message
+        flags = PRECOMPILED_ROUTE_FLAGS.get(op)
+        if flags is None:
+            return DataplaneBackend.seg6local(
+                self, op, dst, action, value, table, oif
+            )
+        msg = get_seg6local_encoder(action).message(dst, oif, table, value)
+        return tuple(self.ip_route.nlm_request(
+            msg, msg_type=RTM_NEWROUTE, msg_flags=flags
+        ))
+
+    def flush_routes(self, **kwargs):
+        return self.ip_route.flush_routes(**kwargs)
+
+    def get_routes(self, **kwargs):
+        return self.ip_route.get_routes(**kwargs)
+
+    def rule(self, op, **kwargs):
+        return self.ip_route.rule(op, **kwargs)
+
+    def get_rules(self, **kwargs):
+        return self.ip_route.get_rules(**kwargs)
+
+    def link(self, op, **kwargs):
+        return self.ip_route.link(op, **kwargs)
+
+    def link_lookup(self, **kwargs):
+        return self.ip_route.link_lookup(**kwargs)
+
+    def get_links(self, *argv, **kwargs):
+        return self.ip_route.get_links(*argv, **kwargs)
+
+    def addr(self, op, **kwargs):
+        return self.ip_route.addr(op, **kwargs)
+
+    def get_addr(self, **kwargs):
+        return self.ip_route.get_addr(**kwargs)
+
+    def neigh(self, op, **kwargs):
+        return self.ip_route.neigh(op, **kwargs)
+
+    def get_neighbours(self, **kwargs):
+        return self.ip_route.get_neighbours(**kwargs)
+
+    def fdb(self, op, **kwargs):
+        return self.ip_route.fdb(op, **kwargs)
+
+    def get_fdb(self, **kwargs):
+        return self.ip_route.fdb('dump', **kwargs)
+
+    def neigh_batch(self, op, entries):
+        # The neighbors are sent in windows, without waiting for the ACK
+        # of each entry
+        return self._pipeline(op, [encode_neigh(**entry) for entry in entries])
+
+    def fdb_batch(self, op, entries):
+        # Static FDB entries of the device itself (e.g. the remote VTEPs
+        # of a VXLAN device), with the same defaults of fdb()
+        return self._pipeline(op, [
+            encode_neigh(
+                family=AF_BRIDGE, state=NUD_NOARP | NUD_PERMANENT,
+                flags=NTF_SELF, **entry
+            )
+            for entry in entries
+        ])
+
+    def tunnel_batch(self, op, tunnels):
+        # The tunnels are created with IFF_UP set in the create message
+        # and the requests are pipelined
+        if op == 'del':
+            messages = [
+                (RTM_DELLINK, LINK_SET_FLAGS, encode_link(ifname=ifname))
+                for ifname, _, _ in tunnels
+            ]
+        else:
+            messages = [
+                (RTM_NEWLINK, LINK_CREATE_FLAGS, self._link_message(
+                    ifname=ifname, kind=kind, **params
+                ))
+                for ifname, kind, params in tunnels
+            ]
+        codes = self.pipeline.request(messages)
+        # Resolve the new tunnels with a single dump
+        ifindexes = {}
+        if op != 'del' and 0 in codes:
+            ifindexes = dict(
+                (msg.get_attr('IFLA_IFNAME'), msg['index'])
+                for msg in self.get_links()
+            )
+        return [
+            (ifindexes.get(ifname), None) if code == 0
+            else (None, NetlinkError(code))
+            for (ifname, _, _), code in zip(tunnels, codes)
+        ]
+
+    # Return the body of a RTM_NEWLINK message creating a link up, with
+    # the link() arguments translated by pyroute2
+    @staticmethod
+    def _link_message(**kwargs):
+        msg = ifinfmsg()
+        msg['index'] = 0
+        msg['flags'] = IFF_UP
+        msg['change'] = IFF_UP
+        for name, value in IPLinkRequest(kwargs).items():
+            if value is not None:
+                msg['attrs'].append([ifinfmsg.name2nla(name), value])
+        msg.encode()
+        return bytes(msg.data[NLMSG_HEADER.size:msg['header']['length']])
+
+    def vrf_batch(self, vrfs):
+        # Resolve the interfaces with a single dump: the VRFs with missing
+        # interfaces are not created
+        ifindexes = dict(
+            (msg.get_attr('IFLA_IFNAME'), msg['index'])
+            for msg in self.get_links()
+        )
+        results = [None] * len(vrfs)
+        created = []
+        for i, (name, _, interfaces) in enumerate(vrfs):
+            missing = [
+                interface for interface in interfaces
+                if interface not in ifindexes
+            ]
+            if missing:
+                results[i] = (None, IndexError(
+                    'No such device: %s' % ', '.join(missing)
+                ))
+            else:
+                created.append(i)
+        # First pass: create all the VRFs already up
+        codes = self.pipeline.request([
+            (RTM_NEWLINK, LINK_CREATE_FLAGS, encode_vrf(*vrfs[i][:2]))
+            for i in created
+        ])
+        for i, code in zip(created, codes):
+            if code != 0:
+                results[i] = (None, NetlinkError(code))
+        created = [i for i in created if results[i] is None]
+        # Resolve the new VRFs
+        if created:
+            ifindexes = dict(
+                (msg.get_attr('IFLA_IFNAME'), msg['index'])
+                for msg in self.get_links()
+            )
+        # Second pass: enslave the interfaces
+        owners = []
+        messages = []
+        for i in created:
+            name, _, interfaces = vrfs[i]
+            if name not in ifindexes:
+                results[i] = (None, IndexError('No such device: %s' % name))
+                continue
+            results[i] = (ifindexes[name], None)
+            for interface in interfaces:
+                owners.append(i)
+                messages.append((RTM_NEWLINK, LINK_SET_FLAGS, encode_link(
+                    ifindexes[interface], master=ifindexes[name]
+                )))
+        for i, code in zip(owners, self.pipeline.request(messages)):
+            if code != 0 and results[i][1] is None:
+                results[i] = (None, NetlinkError(code))
+        # Delete the VRFs whose interfaces could not be enslaved
+        failed = [
+            i for i in created
+            if results[i][1] is not None and vrfs[i][0] in ifindexes
+        ]
+        for i, code in zip(failed, self.pipeline.request([
+            (RTM_DELLINK, LINK_SET_FLAGS, encode_link(ifindexes[vrfs[i][0]]))
+            for i in failed
+        ])):
+            if code != 0:
+                logger.warning('Cannot delete the VRF %s', vrfs[i][0])
+        return results
+
+    def _pipeline(self, op, bodies):
+        msg_type, flags = NEIGH_OPS[op]
+        codes = self.pipeline.request([
+            (msg_type, flags, body) for body in bodies
+        ])
+        return [
+            ((), None) if code == 0 else (None, NetlinkError(code))
+            for code in codes
+        ]
+
+    def _build_iptc_rule(self, rule):
+        # Initialize the iptables rule
+        iptables_rule = iptc.Rule()
+        if rule.source_ip is not None:
+            iptables_rule.src = rule.source_ip
+        if rule.destination_ip is not None:
+            iptables_rule.dst = rule.destination_ip
+        if rule.in_interface is not None:
+            iptables_rule.in_interface = rule.in_interface
+        if rule.out_interface is not None:
+            iptables_rule.out_interface = rule.out_interface
+        if rule.protocol is not None:
+            iptables_rule.protocol = rule.protocol
+            if (
+                rule.source_port is not None
+                or rule.destination_port is not None
+            ):
+                # Init the iptables Match if the source_port /
+                # destination_port is provided
+                iptables_match = iptc.Match(
+                    iptables_rule, iptables_rule.protocol
+                )
+                if rule.source_port is not None:
+                    iptables_match.sport = rule.source_port
+                if rule.destination_port is not None:
+                    iptables_match.dport = rule.destination_port
+                # Add the match to the rule
+                iptables_rule.add_match(iptables_match)
+        # Add the match (e.g. statistic or mark)
+        if rule.match_name is not None:
+            iptables_match = iptc.Match(iptables_rule, rule.match_name)
+            for name, value in rule.match_params.items():
+                setattr(iptables_match, name, value)
+            iptables_rule.add_match(iptables_match)
+        # Set the target
+        iptables_target = iptc.Target(iptables_rule, rule.target_name)
+        if rule.target_name == 'MARK':
+            iptables_target.set_mark = rule.target_value
+        elif rule.target_name == 'DNAT':
+            iptables_target.to_destination = rule.target_value
+        iptables_rule.target = iptables_target
+        return iptables_rule
+
+    def firewall_rules(self, op, rules):
+        for rule in rules:
+            iptables_table = iptc.Table(rule.table)
+            if not iptables_table.autocommit:
+                iptables_table.autocommit = True
+            iptables_chain = iptc.Chain(iptables_table, rule.chain)
+            iptables_rule = self._build_iptc_rule(rule)
+            if op == 'add':
+                iptables_chain.insert_rule(iptables_rule)
+                logging.debug('Added iptables rule: %s', iptables_rule)
+            elif op == 'del':
+                iptables_chain.delete_rule(iptables_rule)
+                logging.debug('Deleted iptables rule: %s', iptables_rule)
+
+    def firewall_stats(self, table, chain):
+        # Return the counters of the rules matching an output interface
+        iptables_table = iptc.Table(table)
+        iptables_chain = iptc.Chain(iptables_table, chain)
+        stats = []
+        iptables_table.refresh()
+        for rule in iptables_chain.rules:
+            out_interface = rule.out_interface
+            if out_interface is not None and out_interface != 'any':
+                (packets, bytess) = rule.get_counters()
+                stats.append({
+                    'packets': packets,
+                    'bytes': bytess,
+                    'out_interface': out_interface
+                })
+        return stats
+
+    def probe_delay(self, out_interface, destination, count=1, timeout=None):
+        ping_command = [
+            'ping', '-c', str(count), '-I', out_interface, destination
+        ]
+        if timeout is not None:
+            # ping takes the timeout in whole seconds
+            ping_command[1:1] = ['-W', str(max(int(math.ceil(timeout)), 1))]
+        ping_process = subprocess.Popen(ping_command, stdout=subprocess.PIPE)
+        mean_delay = 0
+        for line in ping_process.stdout:
+            # Convert bytes to string and remove leading/trailing spaces
+            line = line.decode().strip()
+            if 'time=' in line:
+                delay = re.search(r'time=(\d+\.?\d*)', line)
+                if delay:
+                    mean_delay += float(delay.group(1))
+        ping_process.wait()
+        return round((mean_delay / count), 2)
+
+    def quagga_session(self, port, password=None):
+        return telnetlib.Telnet('localhost', port)
+
+    def close(self):
+        self.pipeline.close()
+        self.ip_route.close()
+
+
+class NftablesBackend(Pyroute2Backend):
+    '''Kernel backend using nftables for the firewall rules
+
+    Netlink operations are inherited from the pyroute2 backend. Each
+    firewall request is applied as a single atomic nft transaction.
+    MARK rules selecting packets only by input interface, output
+    interface or destination address are stored as elements of named
+    maps (one lookup rule per chain), so thousands of classification
+    entries cost a single hash lookup instead of a linear chain walk.
+    All the other rules (statistic nth, mark match, DNAT, ...) are
+    installed in a regular chain jumped from the base chain after the map
+    lookups: they see the marks set by the maps (and can override them),
+    and their verdicts cannot skip the lookups.
+    '''
+
+    name = 'nftables'
+
+    # nft binary and table used for the rules (an inet table sees both the
+    # IPv4 and the IPv6 packets)
+    NFT_COMMAND = 'nft'
+    NFT_FAMILY = 'inet'
+    NFT_TABLE = 'srv6_sdn'
+    # Comment prefix used to identify the rules installed by the backend
+    NFT_COMMENT = 'srv6-sdn'
+    # Base chains mirroring the iptables (table, chain) couples
+    NFT_BASE_CHAINS = {
+        ('mangle', 'PREROUTING'): ('filter', 'prerouting', -150),
+        ('mangle', 'INPUT'): ('filter', 'input', -150),
+        ('mangle', 'FORWARD'): ('filter', 'forward', -150),
+        ('mangle', 'OUTPUT'): ('route', 'output', -150),
+        ('mangle', 'POSTROUTING'): ('filter', 'postrouting', -150),
+        ('nat', 'PREROUTING'): ('nat', 'prerouting', -100),
+        ('nat', 'OUTPUT'): ('nat', 'output', -100),
+        ('nat', 'POSTROUTING'): ('nat', 'postrouting', 100),
+        ('filter', 'INPUT'): ('filter', 'input', 0),
+        ('filter', 'FORWARD'): ('filter', 'forward', 0),
+        ('filter', 'OUTPUT'): ('filter', 'output', 0)
+    }
+    # Marking maps: name suffix, key type, flags and lookup expression;
+    # the IPv4 and IPv6 destinations have a map each
+    NFT_MARK_MAPS = (
+        ('iif', 'ifname', '', 'iifname'),
+        ('oif', 'ifname', '', 'oifname'),
+        ('daddr', 'ipv4_addr', 'flags interval; ', 'ip daddr'),
+        ('daddr6', 'ipv6_addr', 'flags interval; ', 'ip6 daddr')
+    )
+    # Base chain of the load balancing rules
+    NFT_LB_CHAIN = 'lb_prerouting'
+    # Priority of the policy rules routing the marks of the load balancers
+    NFT_LB_RULE_PRIORITY = 1000
+    # Routing tables which cannot be used to route the marks (unspec,
+    # default, main and local)
+    NFT_LB_RESERVED_TABLES = (0, 253, 254, 255)
+    NFT_VERDICTS = {
+        'ACCEPT': 'accept',
+        'DROP': 'drop',
+        'RETURN': 'return'
+    }
+
+    def __init__(self):
+        super(NftablesBackend, self).__init__()
+        # Base chains already initialized by this process
+        self.nft_chains = set()
+
+    def _nft(self, script=None, args=()):
+        cmd = [self.NFT_COMMAND] + list(args)
+        if script is not None:
+            cmd += ['-f', '-']
+        process = subprocess.run(
+            cmd,
+            input=script.encode() if script is not None else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        if process.returncode != 0:
+            raise NftablesError(process.stderr.decode().strip())
+        return process.stdout.decode()
+
+    def _chain_name(self, rule):
+        return '%s_%s' % (rule.table, rule.chain)
+
+    def _setup_chain(self, rule, script):
+        # Create (idempotently) table, base chain, rules chain and maps
+        chain = self._chain_name(rule)
+        if chain in self.nft_chains:
+            return
+        if (rule.table, rule.chain) not in self.NFT_BASE_CHAINS:
+            raise InvalidFirewallRuleError(
+                'Unsupported chain %s %s' % (rule.table, rule.chain)
+            )
+        type, hook, priority = self.NFT_BASE_CHAINS[(rule.table, rule.chain)]
+        prefix = '%s %s' % (self.NFT_FAMILY, self.NFT_TABLE)
+        script.append('add table %s' % prefix)
+        script.append(
+            'add chain %s %s { type %s hook %s priority %d; }'
+            % (prefix, chain, type, hook, priority)
+        )
+        script.append('add chain %s %s_rules' % (prefix, chain))
+        for suffix, key_type, flags, _ in self.NFT_MARK_MAPS:
+            script.append(
+                'add map %s %s_%s_mark { type %s : mark; %scounter; }'
+                % (prefix, chain, suffix, key_type, flags)
+            )
+        # The base chain only contains the map lookups and the jump to
+        # the rules chain, so it can be rebuilt at every start
+        script.append('flush chain %s %s' % (prefix, chain))
+        for suffix, _, _, expr in self.NFT_MARK_MAPS:
+            script.append(
+                'add rule %s %s meta mark set %s map @%s_%s_mark'
+                % (prefix, chain, expr, chain, suffix)
+            )
+        script.append('add rule %s %s jump %s_rules' % (prefix, chain, chain))
+        self.nft_chains.add(chain)
+
+    @staticmethod
+    def _mark_value(value):
+        # iptables marks can be expressed as value/mask
+        return str(value).split('/')[0]
+
+    def _map_element(self, rule):
+        # Return (map suffix, key) if the rule can be stored in a map
+        if rule.target_name != 'MARK' or rule.match_name is not None:
+            return None
+        if (
+            rule.protocol is not None or rule.source_ip is not None
+            or rule.source_port is not None
+            or rule.destination_port is not None
+        ):
+            return None
+        selectors = [
+            ('iif', rule.in_interface and '"%s"' % rule.in_interface),
+            ('oif', rule.out_interface and '"%s"' % rule.out_interface),
+            (
+                'daddr6' if ':' in (rule.destination_ip or '') else 'daddr',
+                rule.destination_ip
+            )
+        ]
+        selectors = [(name, key) for name, key in selectors if key]
+        if len(selectors) != 1:
+            return None
+        return selectors[0]
+
+    @staticmethod
+    def _map_key(key):
+        # Return the canonical form of a map key, as listed by nft (the
+        # interface names unquoted, the prefixes with the host bits
+        # cleared, the single addresses without prefix length)
+        if isinstance(key, dict):
+            if 'elem' in key:
+                return NftablesBackend._map_key(key['elem'].get('val'))
+            if 'prefix' in key:
+                key = '%s/%s' % (key['prefix']['addr'], key['prefix']['len'])
+            else:
+                return None
+        key = str(key).strip('"')
+        try:
+            network = ip_network(key, strict=False)
+        except ValueError:
+            return key
+        if network.prefixlen == network.max_prefixlen:
+            return str(network.network_address)
+        return str(network)
+
+    def _map_marks(self, chain, suffix):
+        # Map the keys of a marking map to their marks
+        marks = {}
+        for item in self._nft_list('map', '%s_%s_mark' % (chain, suffix)):
+            for elem in item.get('map', {}).get('elem', []):
+                marks[self._map_key(elem[0])] = str(elem[1])
+        return marks
+
+    @staticmethod
+    def _ip(address):
+        # Return the nft protocol of an address (or of an address:port)
+        return 'ip6' if address.count(':') > 1 else 'ip'
+
+    def _render_rule(self, rule):
+        # Translate the rule to the nft syntax
+        expr = []
+        if rule.source_ip is not None:
+            expr.append(
+                '%s saddr %s' % (self._ip(rule.source_ip), rule.source_ip)
+            )
+        if rule.destination_ip is not None:
+            expr.append('%s daddr %s' % (
+                self._ip(rule.destination_ip), rule.destination_ip
+            ))
+        if rule.in_interface is not None:
+            expr.append('iifname "%s"' % rule.in_interface)
+        if rule.out_interface is not None:
+            expr.append('oifname "%s"' % rule.out_interface)
+        if rule.protocol is not None:
+            if rule.source_port is None and rule.destination_port is None:
+                expr.append('meta l4proto %s' % rule.protocol)
+            if rule.source_port is not None:
+                expr.append('%s sport %s' % (rule.protocol, rule.source_port))
+            if rule.destination_port is not None:
+                expr.append(
+                    '%s dport %s' % (rule.protocol, rule.destination_port)
+                )
+        if rule.match_name == 'statistic':
+            expr.append('numgen inc mod %s == %s' % (
+                rule.match_params.get('every', 1),
+                rule.match_params.get('packet', 0)
+            ))
+        elif rule.match_name == 'mark':
+            mark = str(rule.match_params['mark']).split('/')
+            if len(mark) == 2:
+                expr.append('meta mark and %s == %s' % (mark[1], mark[0]))
+            else:
+                expr.append('meta mark %s' % mark[0])
+        elif rule.match_name is not None:
+            raise InvalidFirewallRuleError(
+                'Unsupported match %s' % rule.match_name
+            )
+        expr.append('counter')
+        if rule.target_name == 'MARK':
+            expr.append('meta mark set %s' % self._mark_value(
+                rule.target_value
+            ))
+        elif rule.target_name == 'DNAT':
+            expr.append('dnat %s to %s' % (
+                self._ip(rule.target_value), rule.target_value
+            ))
+        elif rule.target_name in self.NFT_VERDICTS:
+            expr.append(self.NFT_VERDICTS[rule.target_name])
+        else:
+            raise InvalidFirewallRuleError(
+                'Unsupported target %s' % rule.target_name
+            )
+        expr.append('comment "%s"' % self._rule_comment(rule))
+        return ' '.join(expr)
+
+    def _rule_comment(self, rule):
+        digest = hashlib.sha1(repr(rule.key()).encode()).hexdigest()[:16]
+        return '%s:%s:%s' % (
+            self.NFT_COMMENT, digest, rule.out_interface or ''
+        )
+
+    def _rule_handles(self, chain):
+        # Map the comments of the installed rules to their handles
+        output = self._nft(args=[
+            '-j', '-a', 'list', 'chain', self.NFT_FAMILY, self.NFT_TABLE,
+            '%s_rules' % chain
+        ])
+        handles = {}
+        for item in json.loads(output).get('nftables', []):
+            rule = item.get('rule')
+            if rule is not None and 'comment' in rule:
+                handles.setdefault(rule['comment'], []).append(rule['handle'])
+        return handles
+
+    def firewall_rules(self, op, rules):
+        prefix = '%s %s' % (self.NFT_FAMILY, self.NFT_TABLE)
+        script = []
+        handles = {}
+        # (chain, map suffix) -> {key -> mark} of the map elements
+        marks = {}
+        for rule in rules:
+            self._setup_chain(rule, script)
+            chain = self._chain_name(rule)
+            element = self._map_element(rule)
+            if element is not None:
+                suffix, key = element
+                if op == 'add':
+                    if (chain, suffix) not in marks:
+                        marks[(chain, suffix)] = self._map_marks(
+                            chain, suffix
+                        )
+                    mark = self._mark_value(rule.target_value)
+                    current = marks[(chain, suffix)].get(self._map_key(key))
+                    if current is not None and current != mark:
+                        # Adding a key with a different mark fails: the
+                        # element is replaced in the same transaction
+                        script.append(
+                            'delete element %s %s_%s_mark { %s }' % (
+                                prefix, chain, suffix, key
+                            )
+                        )
+                    script.append('add element %s %s_%s_mark { %s : %s }' % (
+                        prefix, chain, suffix, key, mark
+                    ))
+                    marks[(chain, suffix)][self._map_key(key)] = mark
+                elif op == 'del':
+                    script.append('delete element %s %s_%s_mark { %s }' % (
+                        prefix, chain, suffix, key
+                    ))
+            elif op == 'add':
+                script.append('insert rule %s %s_rules %s' % (
+                    prefix, chain, self._render_rule(rule)
+                ))
+            elif op == 'del':
+                if chain not in handles:
+                    handles[chain] = self._rule_handles(chain)
+                comment = self._rule_comment(rule)
+                if not handles[chain].get(comment):
+                    raise InvalidFirewallRuleError(
+                        'Rule not found: %s' % rule
+                    )
+                script.append('delete rule %s %s_rules handle %s' % (
+                    prefix, chain, handles[chain][comment].pop()
+                ))
+        if not script:
+            return
+        # The whole script is committed as a single transaction
+        logging.debug('Applying nft transaction:\n%s', '\n'.join(script))
+        try:
+            self._nft('\n'.join(script) + '\n')
+        except NftablesError:
+            # Chains may have been created by the failed transaction
+            self.nft_chains.clear()
+            raise
+
+    def _nft_list(self, kind, name):
+        # Return the JSON items of a map or chain of the table, or an empty
+        # list if it does not exist (e.g. no rule was added to the chain)
+        try:
+            output = self._nft(args=[
+                '-j', 'list', kind, self.NFT_FAMILY, self.NFT_TABLE, name
+            ])
+        except NftablesError as e:
+            if 'No such file or directory' in str(e):
+                return []
+            raise
+        return json.loads(output).get('nftables', [])
+
+    def firewall_stats(self, table, chain):
+        chain = '%s_%s' % (table, chain)
+        stats = []
+        # Counters of the elements of the output interface map
+        for item in self._nft_list('map', '%s_oif_mark' % chain):
+            for elem in item.get('map', {}).get('elem', []):
+                key = elem[0]
+                if isinstance(key, dict) and 'elem' in key:
+                    counter = key['elem'].get('counter', {})
+                    stats.append({
+                        'packets': counter.get('packets', 0),
+                        'bytes': counter.get('bytes', 0),
+                        'out_interface': key['elem'].get('val')
+                    })
+        # Counters of the rules matching an output interface
+        for item in self._nft_list('chain', '%s_rules' % chain):
+            rule = item.get('rule')
+            if rule is None or 'comment' not in rule:
+                continue
+            out_interface = rule['comment'].split(':')[-1]
+            if out_interface == '':
+                continue
+            for expr in rule.get('expr', []):
+                if 'counter' in expr:
+                    stats.append({
+                        'packets': expr['counter'].get('packets', 0),
+                        'bytes': expr['counter'].get('bytes', 0),
+                        'out_interface': out_interface
+                    })
+        return stats
+
+    def _lb_handles(self):
+        # Map the comments of the load balancing rules to their handles
+        try:
+            output = self._nft(args=[
+                '-j', '-a', 'list', 'chain', self.NFT_FAMILY,
+                self.NFT_TABLE, self.NFT_LB_CHAIN
+            ])
+        except NftablesError:
+            return {}
+        handles = {}
+        for item in json.loads(output).get('nftables', []):
+            rule = item.get('rule')
+            if rule is not None and 'comment' in rule:
+                handles.setdefault(rule['comment'], []).append(rule['handle'])
+        return handles
+
+    @classmethod
+    def _lb_routes(cls, lb):
+        # Map the marks of the members of a numgen load balancer to their
+        # interface: each mark is routed through the interface by the
+        # routing table with the same number as the mark
+        routes = {}
+        for interface, _, mark in lb.members:
+            try:
+                table = int(cls._mark_value(mark), 0)
+            except ValueError:
+                table = None
+            if table is None or table in cls.NFT_LB_RESERVED_TABLES or (
+                not 0 < table < 2 ** 32
+            ):
+                raise InvalidLoadBalancerError(
+                    'Invalid mark %r of member %s: the numgen mode requires '
+                    'a mark usable as routing table' % (mark, interface)
+                )
+            if routes.setdefault(table, interface) != interface:
+                raise InvalidLoadBalancerError(
+                    'Mark %s used by members %s and %s' % (
+                        mark, routes[table], interface
+                    )
+                )
+        return routes
+
+    def _lb_marks(self, lb_map):
+        # Return the marks of the elements of a numgen map
+        marks = set()
+        for item in self._nft_list('map', lb_map):
+            for elem in item.get('map', {}).get('elem', []):
+                try:
+                    marks.add(int(str(elem[1]), 0))
+                except ValueError:
+                    pass
+        return marks
+
+    def _lb_rule(self, op, lb, table):
+        self.rule(
+            op, family=AF_INET6 if ':' in lb.destination else AF_INET,
+            fwmark=table, table=table, priority=self.NFT_LB_RULE_PRIORITY
+        )
+
+    def _lb_route_marks(self, lb, routes):
+        # Install the policy rule and the route of each mark
+        for table, interface in sorted(routes.items()):
+            self.route(
+                'replace', dst=lb.destination, table=table,
+                oif=self.link_lookup(ifname=interface)[0]
+            )
+            try:
+                self._lb_rule('add', lb, table)
+            except NetlinkError as e:
+                if e.code != NETLINK_ERROR_FILE_EXISTS:
+                    raise
+
+    def _lb_unroute_marks(self, lb, tables):
+        # Remove the policy rule and the route of the marks not used
+        # anymore; the ones already removed are ignored
+        for table in sorted(tables):
+            for remove in (
+                lambda: self._lb_rule('del', lb, table),
+                lambda: self.route('del', dst=lb.destination, table=table)
+            ):
+                try:
+                    remove()
+                except NetlinkError as e:
+                    if e.code not in (
+                        NETLINK_ERROR_NO_SUCH_FILE,
+                        NETLINK_ERROR_NO_SUCH_PROCESS
+                    ):
+                        raise
+
+    def load_balancer(self, op, lb):
+        if lb.mode != 'numgen':
+            return super(NftablesBackend, self).load_balancer(op, lb)
+        prefix = '%s %s' % (self.NFT_FAMILY, self.NFT_TABLE)
+        lb_map = 'lb_%s' % lb.name
+        comment = '%s-lb:%s' % (self.NFT_COMMENT, lb.name)
+        routes = self._lb_routes(lb) if op != 'del' else {}
+        slots = lb.slots()
+        script = []
+        # Marks routed by the current map
+        marks = set()
+        if op in ('change', 'replace', 'del'):
+            # Remove the current rule and map in the same transaction
+            handles = self._lb_handles().get(comment, [])
+            if not handles and op != 'replace':
+                raise NftablesError('Load balancer not found: %s' % lb.name)
+            for handle in handles:
+                script.append('delete rule %s %s handle %s' % (
+                    prefix, self.NFT_LB_CHAIN, handle
+                ))
+            if handles:
+                marks = self._lb_marks(lb_map)
+                script.append('delete map %s %s' % (prefix, lb_map))
+        if op != 'del':
+            script.append('add table %s' % prefix)
+            script.append(
+                'add chain %s %s { type filter hook prerouting '
+                'priority -150; }' % (prefix, self.NFT_LB_CHAIN)
+            )
+            script.append(
+                'add map %s %s { typeof numgen inc mod %d : meta mark; '
+                'counter; }' % (prefix, lb_map, len(slots))
+            )
+            script.append('add element %s %s { %s }' % (
+                prefix, lb_map, ', '.join(
+                    '%d : %s' % (slot, self._mark_value(member[2]))
+                    for slot, member in enumerate(slots)
+                )
+            ))
+            script.append(
+                'add rule %s %s %s daddr %s meta mark set numgen inc mod %d '
+                'map @%s comment "%s"' % (
+                    prefix, self.NFT_LB_CHAIN, self._ip(lb.destination),
+                    lb.destination, len(slots), lb_map, comment
+                )
+            )
+        # The marks are routed before the packets are marked, and their
+        # routes are removed once no packet is marked anymore
+        self._lb_route_marks(lb, routes)
+        logging.debug('Applying nft transaction:\n%s', '\n'.join(script))
+        self._nft('\n'.join(script) + '\n')
+        self._lb_unroute_marks(lb, marks - set(routes))
+
+    def load_balancer_stats(self, lb):
+        if lb.mode != 'numgen':
+            return super(NftablesBackend, self).load_balancer_stats(lb)
+        slots = lb.slots()
+        counters = dict((member[0], [0, 0]) for member in lb.members)
+        # Counters of the map elements (one element for each slot)
+        output = self._nft(args=[
+            '-j', 'list', 'map', self.NFT_FAMILY, self.NFT_TABLE,
+            'lb_%s' % lb.name
+        ])
+        for item in json.loads(output).get('nftables', []):
+            for elem in item.get('map', {}).get('elem', []):
+                key = elem[0]
+                if not isinstance(key, dict) or 'elem' not in key:
+                    continue
+                slot = key['elem'].get('val')
+                if not isinstance(slot, int) or slot >= len(slots):
+                    continue
+                counter = key['elem'].get('counter', {})
+                member = counters[slots[slot][0]]
+                member[0] += counter.get('packets', 0)
+                member[1] += counter.get('bytes', 0)
+        return [
+            {
+                'member': interface,
+                'packets': counters[interface][0],
+                'bytes': counters[interface][1]
+            }
+            for interface, _, _ in lb.members
+        ]
+
+
+class _RecordedMessage(dict):
+    '''Minimal stand-in for the pyroute2 netlink messages'''
+
+    def get_attr(self, name, default=None):
+        return self.get('attrs', {}).get(name, default)
+
+
+class _RecordedSession(object):
+    '''Quagga VTY session that only records the written commands'''
+
+    def __init__(self, backend, port):
+        self.backend = backend
+        self.port = port
+
+    def read_until(self, match, timeout=None):
+        return match
+
+    def write(self, buffer):
+        self.backend.record('quagga_write', (self.port, buffer), {})
+
+    def read_all(self):
+        return b''
+
+    def close(self):
+        pass
+
+
+class RecordingBackend(DataplaneBackend):
+    '''In-memory backend recording every operation
+
+    No change is applied to the kernel; the backend keeps a simplified
+    model of links, routes, rules, neighbors, FDB entries and firewall
+    rules, enough to drive the request handlers in tests and benchmarks.
+    '''
+
+    name = 'recording'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = []
+        self.links = {}
+        self.next_ifindex = 1
+        self.routes = {}
+        self.rules = []
+        self.addrs = {}
+        self.neighbours = {}
+        self.fdb_entries = set()
+        self.firewall = []
+        self.link('add', ifname='lo', kind='loopback')
+        self.calls = []
+
+    def record(self, method, args, kwargs):
+        with self.lock:
+            self.calls.append((method, args, kwargs))
+
+    @staticmethod
+    def _route_key(kwargs):
+        # Split the prefix length from the destination, as pyroute2 does
+        dst = kwargs.get('dst')
+        dst_len = kwargs.get('dst_len')
+        family = kwargs.get('family')
+        if dst is not None and '/' in dst:
+            dst, dst_len = dst.split('/')
+            dst_len = int(dst_len)
+        if family is None and dst is not None:
+            family = AF_INET6 if ':' in dst else AF_INET
+        return (family, kwargs.get('table'), dst, dst_len, kwargs.get('tos'))
+
+    @staticmethod
+    def _route_encap(route):
+        encap = route.get('encap')
+        if encap is None or 'attrs' not in encap:
+            return None
+        attrs = {}
+        for name, value in encap['attrs']:
+            if name == 'SEG6_IPTUNNEL_SRH' and value.get('mode') == 'inline':
+                # The kernel reports the first segment added by the encoder
+                value = dict(value, segs=['::'] + list(value['segs']))
+            attrs[name] = value
+        return _RecordedMessage(attrs=attrs)
+
+    def route(self, op, **kwargs):
+        self.record('route', (op,), kwargs)
+        key = self._route_key(kwargs)
+        if op == 'add' or op == 'append':
+            if key in self.routes and op == 'add':
+                raise NetlinkError(NETLINK_ERROR_FILE_EXISTS)
+            self.routes[key] = kwargs
+        elif op == 'replace':
+            self.routes[key] = kwargs
+        elif op == 'change':
+            if key not in self.routes:
+                raise NetlinkError(NETLINK_ERROR_NO_SUCH_PROCESS)
+            self.routes[key] = kwargs
+        elif op == 'del':
+            if self.routes.pop(key, None) is None:
+                raise NetlinkError(NETLINK_ERROR_NO_SUCH_PROCESS)
+        return ()
+
+    def flush_routes(self, **kwargs):
+        self.record('flush_routes', (), kwargs)
+        table = kwargs.get('table')
+        for key in list(self.routes):
+            if table is None or key[1] == table:
+                del self.routes[key]
+        return ()
+
+    def get_routes(self, **kwargs):
+        self.record('get_routes', (), kwargs)
+        routes = []
+        for (family, table, dst, dst_len, tos), route in self.routes.items():
+            if kwargs.get('table') not in (None, table):
+                continue
+            routes.append(_RecordedMessage(
+                family=family, table=table, dst_len=dst_len or 0, tos=tos,
+                proto=route.get('proto', RTPROT_STATIC),
+                type=route.get('type', RTN_UNICAST),
+                attrs={'RTA_DST': dst, 'RTA_TABLE': table,
+                       'RTA_OIF': route.get('oif'),
+                       'RTA_GATEWAY': route.get('gateway'),
+                       'RTA_ENCAP': self._route_encap(route)}
+            ))
+        return routes
+
+    def rule(self, op, **kwargs):
+        self.record('rule', (op,), kwargs)
+        if op == 'add':
+            self.rules.append(kwargs)
+        elif op == 'del':
+            try:
+                self.rules.remove(kwargs)
+            except ValueError:
+                raise NetlinkError(NETLINK_ERROR_NO_SUCH_PROCESS)
+        return ()
+
+    def get_rules(self, **kwargs):
+        self.record('get_rules', (), kwargs)
+        return [
+            _RecordedMessage(
+                family=rule.get('family'),
+                attrs={'FRA_PRIORITY': rule.get('priority'),
+                       'FRA_TABLE': rule.get('table')}
+            )
+            for rule in self.rules
+        ]
+
+    def _lookup_index(self, kwargs):
+        if kwargs.get('index') is not None:
+            return kwargs['index']
+        link = self.links.get(kwargs.get('ifname'))
+        if link is None:
+            raise NetlinkError(NETLINK_ERROR_NO_SUCH_DEVICE)
+        return link['index']
+
+    def link(self, op, **kwargs):
+        self.record('link', (op,), kwargs)
+        if op == 'add':
+            ifname = kwargs['ifname']
+            if ifname in self.links:
+                raise NetlinkError(NETLINK_ERROR_FILE_EXISTS)
+            self.links[ifname] = {
+                'index': self.next_ifindex,
+                'ifname': ifname,
+                'kind': kwargs.get('kind'),
+                'master': kwargs.get('master', 0),
+                'state': kwargs.get('state', 'down'),
+                'address': '00:00:00:00:00:00',
+                'stats': {}
+            }
+            self.next_ifindex += 1
+        elif op == 'set':
+            index = self._lookup_index(kwargs)
+            for link in self.links.values():
+                if link['index'] == index:
+                    for attr in ('master', 'state'):
+                        if attr in kwargs:
+                            link[attr] = kwargs[attr]
+                    break
+            else:
+                raise NetlinkError(NETLINK_ERROR_NO_SUCH_DEVICE)
+        elif op == 'del':
+            index = self._lookup_index(kwargs)
+            for ifname, link in list(self.links.items()):
+                if link['index'] == index:
+                    del self.links[ifname]
+        return ()
+
+    def link_lookup(self, **kwargs):
+        link = self.links.get(kwargs.get('ifname'))
+        return [link['index']] if link is not None else []
+
+    def get_links(self, *argv, **kwargs):
+        self.record('get_links', argv, kwargs)
+        links = []
+        for link in self.links.values():
+            if argv and link['index'] not in argv:
+                continue
+            links.append(_RecordedMessage(
+                index=link['index'],
+                attrs={
+                    'IFLA_IFNAME': link['ifname'],
+                    'IFLA_ADDRESS': link['address'],
+                    'IFLA_OPERSTATE': link['state'].upper(),
+                    'IFLA_MASTER': link['master'] or None,
+                    'IFLA_LINKINFO': _RecordedMessage(
+                        attrs={'IFLA_INFO_KIND': link['kind']}
+                    ),
+                    'IFLA_STATS64': dict(link['stats'])
+                }
+            ))
+        return links
+
+    def addr(self, op, **kwargs):
+        self.record('addr', (op,), kwargs)
+        key = (kwargs.get('index'), kwargs.get('address'), kwargs.get('mask'))
+        if op == 'add':
+            if key in self.addrs:
+                raise NetlinkError(NETLINK_ERROR_FILE_EXISTS)
+            self.addrs[key] = kwargs
+        elif op == 'del':
+            if self.addrs.pop(key, None) is None:
+                raise NetlinkError(NETLINK_ERROR_NO_SUCH_PROCESS)
+        return ()
+
+    def get_addr(self, **kwargs):
+        self.record('get_addr', (), kwargs)
+        return [
+            _RecordedMessage(
+                index=index, prefixlen=mask, family=addr.get('family'),
+                attrs={'IFA_ADDRESS': address}
+            )
+            for (index, address, mask), addr in self.addrs.items()
+            if kwargs.get('index') in (None, index)
+        ]
+
+    def neigh(self, op, **kwargs):
+        self.record('neigh', (op,), kwargs)
+        key = (kwargs.get('ifindex'), kwargs.get('dst'))
+        if op == 'add' and key in self.neighbours:
+            raise NetlinkError(NETLINK_ERROR_FILE_EXISTS)
+        if op in ('add', 'replace', 'set'):
+            self.neighbours[key] = kwargs
+        elif op == 'del':
+            if self.neighbours.pop(key, None) is None:
+                raise NetlinkError(NETLINK_ERROR_NO_SUCH_PROCESS)
+        return ()
+
+    def get_neighbours(self, **kwargs):
+        self.record('get_neighbours', (), kwargs)
+        return [
+            _RecordedMessage(
+                ifindex=ifindex, family=neigh.get('family'),
+                state=neigh.get('state'),
+                attrs={'NDA_DST': dst, 'NDA_LLADDR': neigh.get('lladdr')}
+            )
+            for (ifindex, dst), neigh in self.neighbours.items()
+            if kwargs.get('ifindex') in (None, ifindex)
+        ]
+
+    def fdb(self, op, **kwargs):
+        self.record('fdb', (op,), kwargs)
+        key = (kwargs.get('ifindex'), kwargs.get('lladdr'), kwargs.get('dst'))
+        if op in ('add', 'append'):
+            if key in self.fdb_entries:
+                raise NetlinkError(NETLINK_ERROR_FILE_EXISTS)
+            self.fdb_entries.add(key)
+        elif op == 'del':
+            if key not in self.fdb_entries:
+                raise NetlinkError(NETLINK_ERROR_NO_SUCH_PROCESS)
+            self.fdb_entries.remove(key)
+        return ()
+
+    def get_fdb(self, **kwargs):
+        self.record('get_fdb', (), kwargs)
+        return [
+            _RecordedMessage(
+                ifindex=ifindex, family=AF_BRIDGE,
+                attrs={'NDA_LLADDR': lladdr, 'NDA_DST': dst}
+            )
+            for ifindex, lladdr, dst in sorted(self.fdb_entries)
+            if kwargs.get('ifindex') in (None, ifindex)
+        ]
+
+    def firewall_rules(self, op, rules):
+        self.record('firewall_rules', (op, list(rules)), {})
+        for rule in rules:
+            if op == 'add':
+                self.firewall.insert(0, rule)
+            elif op == 'del':
+                for i, installed in enumerate(self.firewall):
+                    if installed.key() == rule.key():
+                        del self.firewall[i]
+                        break
+
+    def firewall_stats(self, table, chain):
+        self.record('firewall_stats', (table, chain), {})
+        return [
+            {'packets': 0, 'bytes': 0, 'out_interface': rule.out_interface}
+            for rule in self.firewall
+            if rule.table == table and rule.chain == chain
+            and rule.out_interface is not None
+        ]
+
+    def probe_delay(self, out_interface, destination, count=1, timeout=None):
+        self.record(
+            'probe_delay', (out_interface, destination, count),
+            {'timeout': timeout} if timeout is not None else {}
+        )
+        return 0.0
+
+    def quagga_session(self, port, password=None):
+        self.record('quagga_session', (port,), {})
+        return _RecordedSession(self, port)
+
+
+# Available backends, indexed by name
+DATAPLANE_BACKENDS = {
+    Pyroute2Backend.name: Pyroute2Backend,
+    NftablesBackend.name: NftablesBackend,
+    RecordingBackend.name: RecordingBackend
+}
+
+
+# Create a new instance of the backend identified by the provided name
+def get_backend(name=DEFAULT_DATAPLANE_BACKEND, **kwargs):
+    if name not in DATAPLANE_BACKENDS:
+        raise ValueError(
+            'Unknown dataplane backend %s. Supported backends: %s'
+            % (name, sorted(DATAPLANE_BACKENDS))
+        )
+    logger.info('*** Using %s dataplane backend', name)
+    return DATAPLANE_BACKENDS[name](**kwargs)
@@ -0,0 +1,303 @@
+#!/usr/bin/python
+
+# Write coalescing of the routes for the SRv6 gRPC Southbound
+#
+# Under controller churn the same route is often added and removed (or
+# replaced several times) by concurrent requests within a few
+# milliseconds. The coalescing backend wraps a dataplane backend and
+# collects the route writes for a short window; the writes of each route
+# (family, table, destination, tos, metric) are merged into a single
+# kernel write and the merged writes are flushed in one batch.
+#
+# Each request must still get the result it would have got without the
+# coalescing. The result of a route write depends only on whether the
+# route existed before (add fails with EEXIST if it exists, del fails with
+# ESRCH if it does not), so the sequence of writes of a route is merged
+# into a single write that leaves the route in the same final state and
+# whose result tells whether the route existed; the results of all the
+# writes of the sequence are derived from it. For example an add followed
+# by a del becomes a single del: ESRCH means that the route did not exist,
+# so both the add and the del succeeded. Sequences that cannot be merged
+# this way, and merged writes failing with any other error, are applied
+# one by one. A del carrying a nexthop (gateway, oif, ...) fails with
+# ESRCH also if the route exists with a different nexthop, so the
+# sequences including such a del are never merged.
+#
+# The window is waited only under contention, i.e. if other writers are
+# active or the previous batch merged the writes of several writers: the
+# writes of a single thread (e.g. a large request) are flushed at once.
+#
+# The writes that cannot be merged (e.g. a flush of the routes with no
+# destination) are applied directly, after the writes before them in the
+# same request are flushed, so the order of each request is preserved.
+#
+
+from __future__ import absolute_import, division, print_function
+
+# General imports
+import logging
+import threading
+from collections import OrderedDict
+from socket import AF_INET, AF_INET6
+from pyroute2.netlink.exceptions import NetlinkError
+
+from .sb_grpc_metrics import metrics
+
+# Window (in milliseconds) during which the writes are collected
+DEFAULT_COALESCE_WINDOW = 2
+# The writes are flushed as soon as this number of writes is collected
+DEFAULT_MAX_COALESCED = 1024
+
+# Route operations that can be merged
+COALESCED_OPS = ('add', 'replace', 'del')
+
+# Attributes selecting the nexthop of a route
+NEXTHOP_ATTRS = ('gateway', 'oif', 'multipath', 'encap')
+
+# Netlink error codes of the route writes
+NETLINK_ERROR_NO_SUCH_PROCESS = 3
+NETLINK_ERROR_FILE_EXISTS = 17
+
+# Main routing table (used when no table is specified)
+RT_TABLE_MAIN = 254
+
+# Final states of a route
+ROUTE_ABSENT = ('absent',)
+ROUTE_UNCHANGED = ('unchanged',)
+
+# Logger reference
+logger = logging.getLogger(__name__)
+
+
+# Return the key identifying a route in the kernel, or None if the route
+# cannot be identified (e.g. no destination)
+def route_key(kwargs):
+    dst = kwargs.get('dst')
+    if dst is None:
+        return None
+    dst_len = kwargs.get('dst_len')
+    if '/' in dst:
+        dst, dst_len = dst.split('/')
+        dst_len = int(dst_len)
+    family = kwargs.get('family')
+    if family is None:
+        family = AF_INET6 if ':' in dst else AF_INET
+    table = kwargs.get('table')
+    return (
+        family, table if table is not None else RT_TABLE_MAIN, dst, dst_len,
+        kwargs.get('tos'), kwargs.get('priority')
+    )
+
+
+# Apply a sequence of (op, kwargs) writes to a route that exists (or not)
+# and return the error code of each write and the final state of the route
+def _simulate(writes, exists):
+    codes = []
+    state = ROUTE_UNCHANGED if exists else ROUTE_ABSENT
+    for op, kwargs in writes:
+        if op == 'add' and state is not ROUTE_ABSENT:
+            codes.append(NETLINK_ERROR_FILE_EXISTS)
+        elif op == 'del' and state is ROUTE_ABSENT:
+            codes.append(NETLINK_ERROR_NO_SUCH_PROCESS)
+        else:
+            codes.append(0)
+            state = ROUTE_ABSENT if op == 'del' else ('value', kwargs)
+    return codes, state
+
+
+# Return the single write equivalent to a sequence of writes and, for each
+# result of the merged write, the error codes of the writes of the
+# sequence; return None if the writes cannot be merged
+def merge_writes(writes):
+    if len(writes) > 1 and any(
+        op == 'del' and any(
+            kwargs.get(attr) is not None for attr in NEXTHOP_ATTRS
+        )
+        for op, kwargs in writes
+    ):
+        # The result of the del does not depend only on the existence of
+        # the route
+        return None
+    outcomes = dict(
+        (exists, _simulate(writes, exists)) for exists in (True, False)
+    )
+    # Try a del and the last write of each kind
+    candidates = OrderedDict()
+    for op, kwargs in writes:
+        candidates[op] = (op, kwargs)
+    for candidate in candidates.values():
+        codes = {}
+        for exists, (write_codes, state) in outcomes.items():
+            (code,), candidate_state = _simulate([candidate], exists)
+            if candidate_state != state:
+                break
+            if codes.get(code, write_codes) != write_codes:
+                # The result of the write does not tell the results of
+                # the sequence
+                break
+            codes[code] = write_codes
+        else:
+            return candidate, codes
+    return None
+
+
+class _Write(object):
+
+    __slots__ = ('op', 'kwargs', 'result', 'exception', 'event')
+
+    def __init__(self, op, kwargs):
+        self.op = op
+        self.kwargs = kwargs
+        self.result = None
+        self.exception = None
+        self.event = threading.Event()
+
+    def complete(self, result, exception):
+        self.result = result
+        self.exception = exception
+        self.event.set()
+
+
+class CoalescingBackend(object):
+    '''Dataplane backend coalescing the route writes of another backend
+
+    Every method but route() and route_batch() is delegated to the wrapped
+    backend.
+    '''
+
+    def __init__(self, backend, window=DEFAULT_COALESCE_WINDOW,
+                 max_batch=DEFAULT_MAX_COALESCED):
+        self.backend = backend
+        self.window = window / 1000
+        self.max_batch = max_batch
+        self.condition = threading.Condition()
+        # The batches are flushed one at a time and in order
+        self.flush_lock = threading.Lock()
+        # route key -> list of _Write, in arrival order
+        self.pending = OrderedDict()
+        self.count = 0
+        self.leader = False
+        # Number of writers in route_batch()
+        self.active = 0
+        # Number of writers of the pending batch
+        self.writers = 0
+        # Whether the previous batch had more than one writer
+        self.contended = False
+
+    def __getattr__(self, attr):
+        return getattr(self.backend, attr)
+
+    def route(self, op, **kwargs):
+        (result, exception), = self.route_batch([(op, kwargs)])
+        if exception is not None:
+            raise exception
+        return result
+
+    def route_batch(self, routes):
+        writes = [_Write(op, kwargs) for op, kwargs in routes]
+        with self.condition:
+            self.active += 1
+        # The writes that cannot be merged (e.g. a flush) are applied
+        # immediately, in the order of the request: the writes before them
+        # are flushed first, the writes after them are collected only
+        # once they are applied
+        coalesced = []
+        for write in writes:
+            if write.op in COALESCED_OPS and (
+                route_key(write.kwargs) is not None
+            ):
+                coalesced.append(write)
+                continue
+            self._coalesce(coalesced)
+            coalesced = []
+            (result, exception), = self.backend.route_batch(
+                [(write.op, write.kwargs)]
+            )
+            write.complete(result, exception)
+        self._coalesce(coalesced)
+        with self.condition:
+            self.active -= 1
+        return [(write.result, write.exception) for write in writes]
+
+    # Collect the writes in the pending batch and wait until the batch
+    # including them is flushed
+    def _coalesce(self, writes):
+        if not writes:
+            return
+        leader = False
+        with self.condition:
+            for write in writes:
+                self.pending.setdefault(
+                    route_key(write.kwargs), []
+                ).append(write)
+            self.count += len(writes)
+            self.writers += 1
+            if not self.leader:
+                # The first writer of the window flushes the batch
+                self.leader = leader = True
+            elif self.count >= self.max_batch:
+                self.condition.notify_all()
+        if leader:
+            with self.condition:
+                # Wait for the writes of the other writers, if any
+                if self.count < self.max_batch and (
+                    self.active > 1 or self.contended
+                ):
+                    self.condition.wait(self.window)
+            with self.flush_lock:
+                with self.condition:
+                    batch = self.pending
+                    self.pending = OrderedDict()
+                    self.count = 0
+                    self.leader = False
+                    self.contended = self.writers > 1
+                    self.writers = 0
+                self._flush(batch)
+        for write in writes:
+            write.event.wait()
+
+    def _flush(self, batch):
+        merged = []
+        serial = []
+        for writes in batch.values():
+            merge = merge_writes([(w.op, w.kwargs) for w in writes])
+            if merge is None:
+                serial.append(writes)
+            else:
+                merged.append((writes, merge))
+        try:
+            results = self.backend.route_batch(
+                [candidate for _, (candidate, _) in merged]
+            )
+            for (writes, (_, codes)), (result, e) in zip(merged, results):
+                code = 0 if e is None else getattr(e, 'code', None)
+                if code not in codes:
+                    if len(writes) == 1:
+                        # The merged write is the write itself
+                        writes[0].complete(result, e)
+                    else:
+                        # Unexpected error: apply the writes one by one
+                        serial.append(writes)
+                    continue
+                for write, write_code in zip(writes, codes[code]):
+                    write.complete(
+                        result if write_code == 0 else None,
+                        NetlinkError(write_code) if write_code else None
+                    )
+            for writes in serial:
+                results = self.backend.route_batch(
+                    [(write.op, write.kwargs) for write in writes]
+                )
+                for write, (result, e) in zip(writes, results):
+                    write.complete(result, e)
+        except Exception as e:
+            logger.exception('Cannot flush the route writes')
+            for writes in batch.values():
+                for write in writes:
+                    if not write.event.is_set():
+                        write.complete(None, e)
+        metrics.inc('coalescer_writes', sum(map(len, batch.values())))
+        metrics.inc(
+            'coalescer_kernel_writes',
+            len(merged) + sum(map(len, serial))
+        )
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+
+# Asynchronous jobs for the SRv6 gRPC Southbound
+#
+# A job is a list of steps, each one a southbound operation (add, get,
+# change, del) with its request. Submitting a job returns its id
+# immediately; the steps are executed by a small pool of workers taking
+# the jobs from a bounded queue, so large requests do not block a gRPC
+# worker and are completed even if the client deadline expires. The
+# controller polls or streams the progress of the job (steps done out of
+# the total, failed steps).
+#
+# The queue is bounded: when it is full, new jobs are rejected with
+# JobQueueFullError. Finished jobs are kept (up to a maximum number) to
+# let the controller read their results.
+#
+
+from __future__ import absolute_import, division, print_function
+
+# General imports
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .sb_grpc_metrics import metrics
+from .sb_grpc_utils import JobQueueFullError
+
+# Number of workers executing the jobs
+DEFAULT_JOB_WORKERS = 2
+# Maximum number of jobs waiting in the queue
+DEFAULT_MAX_PENDING_JOBS = 64
+# Maximum number of finished jobs kept for the controller
+DEFAULT_MAX_FINISHED_JOBS = 1024
+
+# Job states
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# Logger reference
+logger = logging.getLogger(__name__)
+
+
+class Job(object):
+
+    __slots__ = ('id', 'steps', 'stop_on_error', 'client', 'state', 'done',
+                 'errors', 'replies', 'submitted', 'started', 'finished',
+                 'condition')
+
+    def __init__(self, steps, stop_on_error=False, client=None):
+        self.id = uuid.uuid4().hex
+        # List of (op, request)
+        self.steps = steps
+        self.stop_on_error = stop_on_error
+        # Client that submitted the job
+        self.client = client
+        self.state = JOB_QUEUED
+        self.done = 0
+        # List of (step index, status, message) of the failed steps; the
+        # status is None if the step raised an exception
+        self.errors = []
+        # Replies of the steps, in order
+        self.replies = []
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.condition = threading.Condition()
+
+    @property
+    def total(self):
+        return len(self.steps)
+
+    def is_finished(self):
+        return self.state in (JOB_DONE, JOB_FAILED)
+
+    # Wait until the job makes progress beyond done steps (or finishes);
+    # return False on timeout
+    def wait(self, done, timeout=None):
+        with self.condition:
+            if self.done == done and not self.is_finished():
+                self.condition.wait(timeout)
+            return self.done != done or self.is_finished()
+
+    def _update(self, **kwargs):
+        with self.condition:
+            for name, value in kwargs.items():
+                setattr(self, name, value)
+            self.condition.notify_all()
+
+
+class JobQueue(object):
+    '''Bounded queue of jobs executed by a pool of workers
+
+    execute is called as execute(op, request, client) for each step, with
+    the client that submitted the job, and returns (status, reply); a
+    status other than success marks the step as failed.
+    '''
+
+    def __init__(self, execute, success, workers=DEFAULT_JOB_WORKERS,
+                 max_pending=DEFAULT_MAX_PENDING_JOBS,
+                 max_finished=DEFAULT_MAX_FINISHED_JOBS):
+        self.execute = execute
+        self.success = success
+        self.num_workers = workers
+        self.max_finished = max_finished
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.lock = threading.Lock()
+        # job id -> Job, in submission order
+        self.jobs = OrderedDict()
+        self.workers = []
+
+    def submit(self, steps, stop_on_error=False, client=None):
+        job = Job(list(steps), stop_on_error, client)
+        with self.lock:
+            # The workers are started by the first job
+            if not self.workers:
+                for i in range(self.num_workers):
+                    worker = threading.Thread(
+                        target=self._worker, name='job-worker-%d' % i
+                    )
+                    worker.daemon = True
+                    worker.start()
+                    self.workers.append(worker)
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                metrics.inc('jobs_rejected')
+                raise JobQueueFullError(
+                    'Too many pending jobs (%d)' % self.queue.maxsize
+                )
+            self.jobs[job.id] = job
+            self._retire()
+        metrics.inc('jobs_submitted')
+        return job
+
+    def get(self, job_id):
+        # Raise KeyError if the job is unknown
+        with self.lock:
+            return self.jobs[job_id]
+
+    def _retire(self):
+        # Forget the oldest finished jobs
+        finished = [
+            job_id for job_id, job in self.jobs.items() if job.is_finished()
+        ]
+        for job_id in finished[:max(len(finished) - self.max_finished, 0)]:
+            del self.jobs[job_id]
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            try:
+                self._run(job)
+            finally:
+                self.queue.task_done()
+
+    def _run(self, job):
+        job._update(state=JOB_RUNNING, started=time.time())
+        failed = False
+        for i, (op, request) in enumerate(job.steps):
+            try:
+                status, reply = self.execute(op, request, job.client)
+            except Exception as e:
+                logger.exception('Step %d of job %s failed', i, job.id)
+                failed = True
+                reply = None
+                with job.condition:
+                    job.errors.append((i, None, str(e)))
+            else:
+                if status != self.success:
+                    failed = True
+                    with job.condition:
+                        job.errors.append((i, status, ''))
+            with job.condition:
+                job.replies.append(reply)
+            job._update(done=i + 1)
+            if failed and job.stop_on_error:
+                break
+        job._update(
+            state=JOB_FAILED if failed else JOB_DONE, finished=time.time()
+        )
+        metrics.inc('jobs_failed' if failed else 'jobs_done')
+        logger.info(
+            'Job %s %s: %d/%d steps, %d errors, %.1f ms', job.id, job.state,
+            job.done, job.total, len(job.errors),
+            (job.finished - job.started) * 1000
+        )
@@ -0,0 +1,369 @@
+#!/usr/bin/python
+
+# Persistent journal of the SRv6 gRPC Southbound
+#
+# The journal records the southbound operations (add, change, del) applied
+# by the controllers, so that a restarted agent (e.g. after a
+# ShutdownDevice with reboot) can program them again without waiting for
+# the controller to push everything. Each record carries the operation,
+# the serialized request and the state version, incremented by every
+# record; the controller compares the version with its own to decide
+# whether a resync is needed.
+#
+# The records are appended to the journal file and synced to disk in
+# batches: a writer waits until the batch including its record is synced
+# (group commit), so one fsync covers all the operations applied in the
+# meantime. The journal is periodically compacted into a snapshot holding
+# only the live records: a del drops the older adds and changes touching
+# only the objects it deletes, and is dropped as well if all its objects
+# were created by the dropped adds (and no other record may touch them);
+# a change repeated by a later identical change is dropped too. The
+# snapshot is written atomically and then the journal is truncated; the
+# journal records already covered by the snapshot are skipped when the
+# journal is loaded.
+#
+# Each record is stored as <length, crc32> followed by <version,
+# operation, payload>; a torn or corrupted tail (e.g. a crash while
+# appending) is detected by the crc and discarded.
+#
+
+from __future__ import absolute_import, division, print_function
+
+# General imports
+import logging
+import os
+import struct
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+
+from .sb_grpc_metrics import metrics
+
+# Files of the journal
+JOURNAL_FILE = 'journal'
+SNAPSHOT_FILE = 'snapshot'
+
+# Interval (in milliseconds) between two syncs of the journal
+DEFAULT_FSYNC_INTERVAL = 10
+# The journal is compacted after this number of records
+DEFAULT_COMPACT_THRESHOLD = 10000
+
+# Operations recorded in the journal
+OPERATIONS = ('add', 'change', 'del')
+
+# Record and snapshot formats
+RECORD_HEADER = struct.Struct('>II')
+RECORD_BODY = struct.Struct('>QB')
+SNAPSHOT_MAGIC = b'SRJ1'
+SNAPSHOT_HEADER = struct.Struct('>4s16sQ')
+
+# Logger reference
+logger = logging.getLogger(__name__)
+
+
+def encode_record(version, op, payload):
+    body = RECORD_BODY.pack(version, OPERATIONS.index(op)) + payload
+    return RECORD_HEADER.pack(
+        len(body), zlib.crc32(body) & 0xffffffff
+    ) + body
+
+
+# Return the (version, op, payload) records of a buffer and the length of
+# the valid part of the buffer
+def decode_records(data, offset=0):
+    records = []
+    while offset + RECORD_HEADER.size <= len(data):
+        length, crc = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        body = data[start:start + length]
+        if (
+            len(body) != length or length < RECORD_BODY.size
+            or zlib.crc32(body) & 0xffffffff != crc
+        ):
+            break
+        version, op = RECORD_BODY.unpack_from(body)
+        if op >= len(OPERATIONS):
+            break
+        records.append((version, OPERATIONS[op], body[RECORD_BODY.size:]))
+        offset = start + length
+    return records, offset
+
+
+class Journal(object):
+
+    '''Append-only journal of the applied operations
+
+    object_keys(payload) returns the objects touched by a record as
+    (group, ids), where ids is a set of object ids or None if the objects
+    are unknown; two records may touch the same objects if they have the
+    same group and their ids intersect (or one of them is None). Without
+    object_keys, any two records may touch the same objects, and a del
+    cancels only the add of the same request.
+    '''
+
+    def __init__(self, path, fsync_interval=DEFAULT_FSYNC_INTERVAL,
+                 compact_threshold=DEFAULT_COMPACT_THRESHOLD,
+                 object_keys=None):
+        self.path = path
+        self.object_keys = object_keys
+        self.fsync_interval = fsync_interval / 1000
+        self.compact_threshold = compact_threshold
+        self.lock = threading.Lock()
+        self.synced = threading.Condition(self.lock)
+        self.stop_event = threading.Event()
+        # Identifier of the journal: a new journal (e.g. after the journal
+        # is lost) restarts the versions with a different id
+        self.id = None
+        self.version = 0
+        self.synced_version = 0
+        # version -> (op, payload) of the live records
+        self.records = OrderedDict()
+        # (op, payload) -> versions of the live add and change records
+        self.index = {}
+        # version -> objects touched by the live records
+        self.keys = {}
+        # (group, id) -> versions of the live records touching the object
+        self.objects = {}
+        # version -> objects touched by the live records whose objects are
+        # unknown (keys or ids None)
+        self.unknown = {}
+        # Encoded records not yet written
+        self.buffer = []
+        self.appended = 0
+        self.file = None
+        self.thread = None
+
+    def open(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        snapshot = os.path.join(self.path, SNAPSHOT_FILE)
+        journal = os.path.join(self.path, JOURNAL_FILE)
+        if os.path.exists(snapshot):
+            with open(snapshot, 'rb') as f:
+                data = f.read()
+            magic, journal_id, self.version = (
+                SNAPSHOT_HEADER.unpack_from(data)
+            )
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError('Invalid journal snapshot %s' % snapshot)
+            self.id = uuid.UUID(bytes=journal_id).hex
+            records, _ = decode_records(data, SNAPSHOT_HEADER.size)
+            for version, op, payload in records:
+                self._add(version, op, payload)
+        else:
+            self.id = uuid.uuid4().hex
+        if os.path.exists(journal):
+            with open(journal, 'rb') as f:
+                data = f.read()
+            records, length = decode_records(data)
+            if length < len(data):
+                logger.warning(
+                    'Discarding %d bytes at the end of the journal',
+                    len(data) - length
+                )
+                with open(journal, 'r+b') as f:
+                    f.truncate(length)
+            for version, op, payload in records:
+                # Records already in the snapshot
+                if version > self.version:
+                    self._add(version, op, payload)
+                    self.version = version
+                    self.appended += 1
+        self.synced_version = self.version
+        if not os.path.exists(snapshot):
+            # Persist the id of the journal
+            self._write_snapshot()
+        self.file = open(journal, 'ab')
+        self.thread = threading.Thread(target=self._run, name='journal')
+        self.thread.daemon = True
+        self.thread.start()
+        metrics.set_gauge('journal_version', lambda: self.version)
+        logger.info(
+            'Journal %s loaded: version %d, %d live records',
+            self.id, self.version, len(self.records)
+        )
+
+    # Return the live records, in order, as (version, op, payload)
+    def entries(self):
+        with self.lock:
+            return [
+                (version, op, payload)
+                for version, (op, payload) in self.records.items()
+            ]
+
+    # Append a record and wait until it is synced; return its version
+    def append(self, op, payload):
+        version = self.record(op, payload)
+        self.wait_synced(version)
+        return version
+
+    # Append a record without waiting for the sync; return its version.
+    # The records are replayed in the order of their versions, so the
+    # writers touching the same objects record them holding the locks of
+    # the objects
+    def record(self, op, payload):
+        with self.lock:
+            self.version += 1
+            version = self.version
+            self.buffer.append(encode_record(version, op, payload))
+            self._add(version, op, payload)
+            self.appended += 1
+        metrics.inc('journal_records')
+        return version
+
+    # Wait until the record with the given version is synced
+    def wait_synced(self, version):
+        with self.lock:
+            while (
+                self.synced_version < version and not self.stop_event.is_set()
+            ):
+                self.synced.wait()
+
+    def _add(self, version, op, payload):
+        keys = (
+            self.object_keys(payload) if self.object_keys is not None
+            else None
+        )
+        if op == 'del' and keys is not None and keys[1] is not None:
+            if self._cancel(keys):
+                return
+        elif op == 'del' and self.index.get(('add', payload)):
+            # The objects are unknown: the del cancels the add of the same
+            # request, unless a newer record may have touched the same
+            # objects: in that case the del is needed to undo it as well
+            add_version = self.index[('add', payload)][-1]
+            if not any(
+                self._conflict(keys, self.keys[record_version])
+                for record_version in self.records
+                if record_version > add_version
+            ):
+                self._remove(add_version)
+                return
+        if op == 'change' and self.index.get(('change', payload)):
+            # The change is repeated: the older one is superseded
+            self._remove(self.index[('change', payload)][-1])
+        self.records[version] = (op, payload)
+        self.keys[version] = keys
+        if op in ('add', 'change'):
+            self.index.setdefault((op, payload), []).append(version)
+        if keys is None or keys[1] is None:
+            self.unknown[version] = keys
+        else:
+            for id in keys[1]:
+                self.objects.setdefault((keys[0], id), set()).add(version)
+
+    # Cancel the live adds and changes touching only the objects deleted
+    # by a del: the del removes the objects whatever the older records
+    # did. Return True if the del is not needed either, that is if all its
+    # objects were created by the cancelled adds and no other live record
+    # may touch them
+    def _cancel(self, keys):
+        group, ids = keys
+        versions = set()
+        for id in ids:
+            versions.update(self.objects.get((group, id), ()))
+        created = set()
+        for version in sorted(versions):
+            op = self.records[version][0]
+            record_ids = self.keys[version][1]
+            if op in ('add', 'change') and record_ids <= ids:
+                if op == 'add':
+                    created.update(record_ids)
+                self._remove(version)
+        if created != ids:
+            return False
+        return not any(
+            self.objects.get((group, id)) for id in ids
+        ) and not any(
+            self._conflict(keys, other) for other in self.unknown.values()
+        )
+
+    def _remove(self, version):
+        op, payload = self.records.pop(version)
+        keys = self.keys.pop(version)
+        versions = self.index.get((op, payload))
+        if versions and version in versions:
+            versions.remove(version)
+            if not versions:
+                del self.index[(op, payload)]
+        if keys is None or keys[1] is None:
+            del self.unknown[version]
+        else:
+            for id in keys[1]:
+                self.objects[(keys[0], id)].discard(version)
+                if not self.objects[(keys[0], id)]:
+                    del self.objects[(keys[0], id)]
+
+    # Return True if two records may touch the same objects
+    @staticmethod
+    def _conflict(keys, other):
+        if keys is None or other is None:
+            return True
+        (group, ids), (other_group, other_ids) = keys, other
+        return group == other_group and (
+            ids is None or other_ids is None or bool(ids & other_ids)
+        )
+
+    def _run(self):
+        while not self.stop_event.wait(self.fsync_interval):
+            try:
+                self._sync()
+            except (IOError, OSError):
+                logger.exception('Cannot sync the journal')
+
+    def _sync(self):
+        with self.lock:
+            if self.buffer:
+                self.file.write(b''.join(self.buffer))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.buffer = []
+                metrics.inc('journal_syncs')
+            self.synced_version = self.version
+            self.synced.notify_all()
+            if self.appended >= self.compact_threshold:
+                self._compact()
+
+    def _compact(self):
+        # The snapshot covers all the records written so far, then the
+        # journal restarts empty
+        self._write_snapshot()
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.appended = 0
+        metrics.inc('journal_compactions')
+        logger.info(
+            'Journal compacted: version %d, %d live records',
+            self.version, len(self.records)
+        )
+
+    def _write_snapshot(self):
+        snapshot = os.path.join(self.path, SNAPSHOT_FILE)
+        tmp = snapshot + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC, uuid.UUID(hex=self.id).bytes, self.version
+            ))
+            for version, (op, payload) in self.records.items():
+                f.write(encode_record(version, op, payload))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, snapshot)
+        # Persist the rename
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self._sync()
+        self.file.close()
@@ -0,0 +1,61 @@
+#!/usr/bin/python
+
+# Per-object locks of the SRv6 gRPC Southbound
+#
+# The handlers run concurrently on the gRPC thread pool. The ones that
+# read and then modify kernel objects (e.g. the members of a VRF, the
+# routes of a table, the rules of an iptables chain) lock the objects
+# they touch, so independent requests run in parallel while the requests
+# touching the same objects are serialized.
+#
+# Objects are identified by (type, id) keys, e.g. (LOCK_VRF, 'vrf1') or
+# (LOCK_LINK, 5), and mapped on a fixed set of lock stripes. All the keys
+# of an operation are locked at once, always in stripe order, so two
+# operations cannot deadlock; a handler must not lock other keys while
+# holding some. An operation touching unknown objects locks all the
+# stripes (keys None).
+#
+
+from __future__ import absolute_import, division, print_function
+
+# General imports
+import threading
+from contextlib import contextmanager
+
+from .sb_grpc_metrics import metrics
+
+# Number of lock stripes
+DEFAULT_LOCK_STRIPES = 64
+
+# Types of the locked objects
+LOCK_VRF = 'vrf'
+LOCK_TABLE = 'table'
+LOCK_LINK = 'ifindex'
+LOCK_CHAIN = 'chain'
+LOCK_RULES = 'rules'
+LOCK_LOAD_BALANCER = 'load_balancer'
+
+
+class ObjectLocks(object):
+
+    def __init__(self, stripes=DEFAULT_LOCK_STRIPES):
+        self.stripes = [threading.RLock() for _ in range(stripes)]
+
+    def _stripes(self, keys):
+        if keys is None:
+            return range(len(self.stripes))
+        return sorted(set(hash(key) % len(self.stripes) for key in keys))
+
+    @contextmanager
+    def hold(self, keys):
+        stripes = self._stripes(keys)
+        for stripe in stripes:
+            lock = self.stripes[stripe]
+            if not lock.acquire(False):
+                metrics.inc('object_lock_contended')
+                lock.acquire()
+        try:
+            yield
+        finally:
+            for stripe in reversed(stripes):
+                self.stripes[stripe].release()
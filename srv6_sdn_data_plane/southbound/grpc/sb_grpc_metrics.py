@@ -0,0 +1,141 @@
+#!/usr/bin/python
+
+# Metrics of the SRv6 gRPC Southbound
+#
+# Simple thread-safe registry of counters and gauges. Gauges can be
+# static values or callables evaluated when a snapshot is taken (e.g. the
+# resident memory of the process).
+#
+# The link statistics sampler reads the IFLA_STATS64 counters of the
+# tunnel interfaces with a single RTM_GETLINK dump and computes the rates
+# from the previous sample of each interface.
+#
+
+from __future__ import absolute_import, division, print_function
+
+# General imports
+import logging
+import os
+import resource
+import threading
+import time
+
+# Logger reference
+logger = logging.getLogger(__name__)
+
+
+# Return the resident set size of the process (in bytes)
+def get_rss():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    # Fallback to the peak RSS if /proc is not available
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss * 1024 if os.uname()[0] == 'Linux' else maxrss
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        # value can be a number or a callable returning a number
+        with self.lock:
+            self.gauges[name] = value
+
+    def get(self, name, default=None):
+        with self.lock:
+            if name in self.counters:
+                return self.counters[name]
+            value = self.gauges.get(name, default)
+        return value() if callable(value) else value
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+        for name, value in gauges.items():
+            counters[name] = value() if callable(value) else value
+        return counters
+
+    def log_report(self):
+        logging.info('*** Metrics')
+        for name, value in sorted(self.snapshot().items()):
+            logging.info('***   %-40s %s', name, value)
+
+
+# Link kinds reported as tunnels
+TUNNEL_KINDS = ('gre', 'gretap', 'ip6gre', 'ip6gretap', 'ipip', 'ip6tnl',
+                'sit', 'vxlan', 'vrf')
+
+# IFLA_STATS64 counters reported for each link
+LINK_COUNTERS = ('rx_packets', 'tx_packets', 'rx_bytes', 'tx_bytes',
+                 'rx_errors', 'tx_errors', 'rx_dropped', 'tx_dropped')
+
+
+class LinkStatsSampler(object):
+
+    def __init__(self, kinds=TUNNEL_KINDS):
+        self.kinds = kinds
+        self.lock = threading.Lock()
+        # ifindex -> (timestamp, counters)
+        self.samples = {}
+
+    def sample(self, dataplane, ifnames=None):
+        now = time.time()
+        stats = []
+        samples = {}
+        # One dump for all the links
+        for msg in dataplane.get_links():
+            linkinfo = msg.get_attr('IFLA_LINKINFO')
+            kind = (
+                linkinfo.get_attr('IFLA_INFO_KIND')
+                if linkinfo is not None else None
+            )
+            ifname = msg.get_attr('IFLA_IFNAME')
+            if ifnames:
+                if ifname not in ifnames:
+                    continue
+            elif kind not in self.kinds:
+                continue
+            counters = msg.get_attr('IFLA_STATS64') or {}
+            counters = dict(
+                (name, counters.get(name, 0)) for name in LINK_COUNTERS
+            )
+            stat = dict(counters, ifname=ifname, kind=kind)
+            # Rates from the previous sample of the interface
+            with self.lock:
+                previous = self.samples.get(msg['index'])
+            if previous is not None and now > previous[0]:
+                interval = now - previous[0]
+                for name in ('packets', 'bytes'):
+                    for direction in ('rx', 'tx'):
+                        counter = '%s_%s' % (direction, name)
+                        stat['%s_rate' % counter] = max(
+                            counters[counter] - previous[1][counter], 0
+                        ) / interval
+            samples[msg['index']] = (now, counters)
+            stats.append(stat)
+        with self.lock:
+            if ifnames:
+                self.samples.update(samples)
+            else:
+                # Forget the removed interfaces
+                self.samples = samples
+        return stats
+
+
+# Metrics of the southbound server
+metrics = Metrics()
+metrics.set_gauge('process_rss_bytes', get_rss)
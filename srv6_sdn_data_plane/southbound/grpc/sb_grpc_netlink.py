@@ -0,0 +1,232 @@
+#!/usr/bin/python
+
+# Pipelined netlink requests for the SRv6 gRPC Southbound
+#
+# Bulk operations (e.g. thousands of static neighbors, hundreds of tenant
+# VRFs) are encoded as
+# raw netlink messages and written to a NETLINK_ROUTE socket in windows:
+# each window is sent with a single system call and the ACKs of all its
+# messages are collected afterwards, instead of waiting for the ACK of
+# each message before sending the next one. The kernel processes every
+# message of a window, so each message gets its own status. If the socket
+# fails (e.g. ENOBUFS), the messages not acknowledged yet and the ones not
+# sent get the error of the socket, and the socket is replaced.
+#
+
+from __future__ import absolute_import, division, print_function
+
+# General imports
+import errno
+import logging
+import socket
+import struct
+import threading
+from socket import AF_INET, AF_INET6, inet_pton
+
+# Netlink constants (include/uapi/linux/netlink.h)
+NETLINK_ROUTE = 0
+NETLINK_CAP_ACK = 10
+SOL_NETLINK = 270
+NLMSG_ERROR = 2
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+NLM_F_REPLACE = 0x100
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+NLM_F_APPEND = 0x800
+
+# Neighbor messages (include/uapi/linux/rtnetlink.h, neighbour.h)
+RTM_NEWNEIGH = 28
+RTM_DELNEIGH = 29
+NDA_DST = 1
+NDA_LLADDR = 2
+NTF_SELF = 0x02
+NTF_PROXY = 0x08
+NUD_NOARP = 0x40
+NUD_PERMANENT = 0x80
+AF_BRIDGE = 7
+
+# Link messages (include/uapi/linux/if_link.h)
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+IFLA_IFNAME = 3
+IFLA_MASTER = 10
+IFLA_LINKINFO = 18
+IFLA_INFO_KIND = 1
+IFLA_INFO_DATA = 2
+IFLA_VRF_TABLE = 1
+IFF_UP = 0x1
+LINK_CREATE_FLAGS = NLM_F_REQUEST | NLM_F_ACK | NLM_F_CREATE | NLM_F_EXCL
+LINK_SET_FLAGS = NLM_F_REQUEST | NLM_F_ACK
+
+# Message type and flags of each operation
+NEIGH_OPS = {
+    'add': (RTM_NEWNEIGH, NLM_F_REQUEST | NLM_F_ACK | NLM_F_CREATE
+            | NLM_F_EXCL),
+    'append': (RTM_NEWNEIGH, NLM_F_REQUEST | NLM_F_ACK | NLM_F_CREATE
+               | NLM_F_APPEND),
+    'replace': (RTM_NEWNEIGH, NLM_F_REQUEST | NLM_F_ACK | NLM_F_CREATE
+                | NLM_F_REPLACE),
+    'del': (RTM_DELNEIGH, NLM_F_REQUEST | NLM_F_ACK)
+}
+
+# Maximum number of messages sent with a single system call
+DEFAULT_WINDOW = 256
+
+# Netlink structures
+NLMSG_HEADER = struct.Struct('=IHHII')
+NLA_HEADER = struct.Struct('=HH')
+NDMSG_HEADER = struct.Struct('=BBHiHBB')
+IFINFOMSG_HEADER = struct.Struct('=BBHiII')
+U32 = struct.Struct('=I')
+NLMSGERR = struct.Struct('=i')
+
+# Logger reference
+logger = logging.getLogger(__name__)
+
+
+def _nla(nla_type, value):
+    length = NLA_HEADER.size + len(value)
+    return (
+        NLA_HEADER.pack(length, nla_type) + value
+        + b'\0' * ((4 - length % 4) % 4)
+    )
+
+
+# Return the body of a RTM_NEWNEIGH/RTM_DELNEIGH message
+def encode_neigh(ifindex, dst=None, lladdr=None, family=None,
+                 state=NUD_PERMANENT, flags=0):
+    body = []
+    if dst is not None:
+        dst_family = AF_INET6 if ':' in dst else AF_INET
+        if family is None:
+            family = dst_family
+        body.append(_nla(NDA_DST, inet_pton(dst_family, dst)))
+    if lladdr is not None:
+        body.append(_nla(NDA_LLADDR, bytes(
+            bytearray(int(byte, 16) for byte in lladdr.split(':'))
+        )))
+    return NDMSG_HEADER.pack(
+        family or AF_INET, 0, 0, ifindex, state, flags, 0
+    ) + b''.join(body)
+
+
+# Return the body of a RTM_NEWLINK message: a new link if kind is given,
+# otherwise a change of the link ifindex (e.g. its master). With no kind
+# and no ifindex, the body of a RTM_DELLINK message deleting ifname
+def encode_link(ifindex=0, ifname=None, kind=None, info_data=b'',
+                master=None, up=False):
+    attrs = []
+    if ifname is not None:
+        attrs.append(_nla(IFLA_IFNAME, ifname.encode('ascii') + b'\0'))
+    if master is not None:
+        attrs.append(_nla(IFLA_MASTER, U32.pack(master)))
+    if kind is not None:
+        linkinfo = _nla(IFLA_INFO_KIND, kind.encode('ascii') + b'\0')
+        if info_data:
+            linkinfo += _nla(IFLA_INFO_DATA, info_data)
+        attrs.append(_nla(IFLA_LINKINFO, linkinfo))
+    return IFINFOMSG_HEADER.pack(
+        0, 0, 0, ifindex, IFF_UP if up else 0, IFF_UP if up else 0
+    ) + b''.join(attrs)
+
+
+# Return the body of a RTM_NEWLINK message creating a VRF, already up
+def encode_vrf(ifname, table):
+    return encode_link(
+        ifname=ifname, kind='vrf',
+        info_data=_nla(IFLA_VRF_TABLE, U32.pack(table)), up=True
+    )
+
+
+class NetlinkPipeline(object):
+    '''NETLINK_ROUTE socket sending the requests in windows'''
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.sock = None
+        self.seq = 0
+
+    def _socket(self):
+        if self.sock is None:
+            sock = socket.socket(
+                socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE
+            )
+            sock.bind((0, 0))
+            try:
+                # Do not echo the failed requests in the error messages
+                sock.setsockopt(SOL_NETLINK, NETLINK_CAP_ACK, 1)
+            except (OSError, socket.error):
+                pass
+            self.sock = sock
+        return self.sock
+
+    # Send a list of (msg_type, flags, body) requests and return, for
+    # each request, the error code (0 on success)
+    def request(self, messages):
+        codes = [None] * len(messages)
+        with self.lock:
+            for start in range(0, len(messages), self.window):
+                end = min(start + self.window, len(messages))
+                pending = {}
+                try:
+                    self._request_window(messages, start, end, pending, codes)
+                except (OSError, socket.error) as e:
+                    # The messages of the window still waiting for their
+                    # ACK (they may have been applied or not) and the
+                    # messages not sent fail with the error of the socket;
+                    # the socket is replaced, so its ACKs are not read by
+                    # the next requests
+                    code = e.errno or errno.EIO
+                    logger.warning(
+                        'Netlink pipeline failed, %d of %d requests not '
+                        'acknowledged: %s', len(pending) + len(messages) - end,
+                        len(messages), e
+                    )
+                    for i in pending.values():
+                        codes[i] = code
+                    for i in range(end, len(messages)):
+                        codes[i] = code
+                    if self.sock is not None:
+                        self.sock.close()
+                        self.sock = None
+                    break
+        return codes
+
+    # Send the messages of a window and collect their ACKs; pending maps
+    # the sequence numbers of the messages not acknowledged yet to their
+    # index
+    def _request_window(self, messages, start, end, pending, codes):
+        sock = self._socket()
+        buf = []
+        for i in range(start, end):
+            msg_type, flags, body = messages[i]
+            self.seq = (self.seq + 1) & 0xffffffff
+            pending[self.seq] = i
+            buf.append(NLMSG_HEADER.pack(
+                NLMSG_HEADER.size + len(body), msg_type, flags, self.seq, 0
+            ) + body)
+        sock.send(b''.join(buf))
+        # Collect the ACKs of the window
+        while pending:
+            data = sock.recv(65536)
+            offset = 0
+            while offset + NLMSG_HEADER.size <= len(data):
+                length, msg_type, _, seq, _ = (
+                    NLMSG_HEADER.unpack_from(data, offset)
+                )
+                if length < NLMSG_HEADER.size:
+                    break
+                if msg_type == NLMSG_ERROR and seq in pending:
+                    code, = NLMSGERR.unpack_from(
+                        data, offset + NLMSG_HEADER.size
+                    )
+                    codes[pending.pop(seq)] = -code
+                offset += (length + 3) & ~3
+
+    def close(self):
+        with self.lock:
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
@@ -0,0 +1,232 @@
+#!/usr/bin/python
+
+# Admission scheduler of the SRv6 gRPC Southbound
+#
+# The requests of all the controllers share the gRPC thread pool; without
+# a scheduler a bulk resync from one controller delays the urgent updates
+# (e.g. a failover) from another one. The scheduler limits the number of
+# requests executed concurrently (execution slots) and decides which
+# waiting request gets the next free slot:
+#
+#   - each client has a queue per entity type; the clients are served
+#     with start-time fair queuing, weighted by the weight of the client
+#     and by the cost of the requests (number of entries), and the entity
+#     queues of a client are served round robin;
+#   - urgent requests (small requests, or requests explicitly marked as
+#     urgent) have their own per-client queue, served before the other
+#     ones, up to a burst of consecutive urgent requests;
+#   - a request exceeding the limits of the queues is rejected with
+#     AdmissionRejectedError instead of waiting indefinitely.
+#
+
+from __future__ import absolute_import, division, print_function
+
+# General imports
+import logging
+import threading
+from collections import OrderedDict, deque
+
+from .sb_grpc_metrics import metrics
+from .sb_grpc_utils import AdmissionRejectedError
+
+# Number of requests executed concurrently
+DEFAULT_EXECUTION_SLOTS = 4
+# Maximum number of waiting requests per client queue
+DEFAULT_MAX_QUEUE = 256
+# Maximum number of waiting requests
+DEFAULT_MAX_PENDING = 1024
+# Requests with at most this cost are urgent
+DEFAULT_SMALL_COST = 4
+# Maximum number of urgent requests served in a row when other requests
+# are waiting
+DEFAULT_URGENT_BURST = 8
+# Weight of the clients with no configured weight
+DEFAULT_CLIENT_WEIGHT = 1
+
+# Threads serving the RPCs not going through the scheduler (streams,
+# job watches, ...)
+DEFAULT_EXTRA_WORKERS = 32
+
+# Interval (in seconds) between two checks of the client while waiting
+ADMISSION_POLL_INTERVAL = 0.5
+
+# Logger reference
+logger = logging.getLogger(__name__)
+
+
+# Return the cost of a request, i.e. the number of entries (paths,
+# routes, neighbors, ...) carried by its repeated fields
+def request_cost(request):
+    cost = 0
+    for field, value in getattr(request, 'ListFields', list)():
+        if field.label == field.LABEL_REPEATED:
+            cost += len(value)
+        elif field.message_type is not None:
+            cost += request_cost(value)
+    return max(cost, 1)
+
+
+class Ticket(object):
+
+    __slots__ = ('client', 'entity', 'cost', 'urgent', 'queue', 'granted',
+                 'event')
+
+    def __init__(self, client, entity, cost, urgent):
+        self.client = client
+        self.entity = entity
+        self.cost = cost
+        self.urgent = urgent
+        # Queue of the ticket, while waiting
+        self.queue = None
+        self.granted = False
+        self.event = threading.Event()
+
+
+class _Flow(object):
+    # Queues of a client
+
+    __slots__ = ('weight', 'urgent', 'queues', 'finish', 'pending')
+
+    def __init__(self, weight):
+        self.weight = weight
+        self.urgent = deque()
+        # entity -> deque of tickets, in round robin order
+        self.queues = OrderedDict()
+        # Virtual finish time of the last request served
+        self.finish = 0.0
+        self.pending = 0
+
+
+class AdmissionScheduler(object):
+
+    def __init__(self, slots=DEFAULT_EXECUTION_SLOTS, weights=None,
+                 max_queue=DEFAULT_MAX_QUEUE, max_pending=DEFAULT_MAX_PENDING,
+                 small_cost=DEFAULT_SMALL_COST,
+                 urgent_burst=DEFAULT_URGENT_BURST):
+        for client, weight in (weights or {}).items():
+            if not weight > 0:
+                raise ValueError(
+                    'Invalid weight %s of client %s: the weight must be '
+                    'positive' % (weight, client)
+                )
+        self.slots = slots
+        # client -> weight
+        self.weights = dict(weights or {})
+        self.max_queue = max_queue
+        self.max_pending = max_pending
+        self.small_cost = small_cost
+        self.urgent_burst = urgent_burst
+        self.lock = threading.Lock()
+        # client -> _Flow
+        self.flows = {}
+        self.vtime = 0.0
+        self.running = 0
+        self.pending = 0
+        self.urgent_streak = 0
+
+    # Number of threads needed to serve the requests: every running or
+    # waiting request holds a thread of the gRPC server
+    def workers(self, extra=DEFAULT_EXTRA_WORKERS):
+        return self.slots + self.max_pending + extra
+
+    # Wait for an execution slot and return the ticket to release when the
+    # request is complete. Return None if the client went away while
+    # waiting (is_active() returned False)
+    def acquire(self, client, entity, cost=1, urgent=False, is_active=None):
+        ticket = Ticket(
+            client, entity, cost, urgent or cost <= self.small_cost
+        )
+        with self.lock:
+            flow = self.flows.get(client)
+            if flow is None:
+                flow = self.flows[client] = _Flow(
+                    self.weights.get(client, DEFAULT_CLIENT_WEIGHT)
+                )
+            if ticket.urgent:
+                queue = flow.urgent
+            else:
+                queue = flow.queues.setdefault(entity, deque())
+            if len(queue) >= self.max_queue or (
+                self.pending >= self.max_pending
+            ):
+                metrics.inc('admission_rejected')
+                raise AdmissionRejectedError(
+                    'Too many pending requests from %s' % client
+                )
+            ticket.queue = queue
+            queue.append(ticket)
+            flow.pending += 1
+            self.pending += 1
+            self._dispatch()
+        while not ticket.event.wait(ADMISSION_POLL_INTERVAL):
+            if is_active is not None and not is_active():
+                with self.lock:
+                    if not ticket.granted:
+                        ticket.queue.remove(ticket)
+                        ticket.queue = None
+                        flow.pending -= 1
+                        self.pending -= 1
+                        metrics.inc('admission_cancelled')
+                        return None
+        metrics.inc('admission_admitted')
+        return ticket
+
+    def release(self, ticket):
+        with self.lock:
+            self.running -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        # Grant the free slots to the waiting tickets
+        while self.running < self.slots and self.pending:
+            ticket = self._next()
+            ticket.queue = None
+            ticket.granted = True
+            self.pending -= 1
+            self.running += 1
+            ticket.event.set()
+
+    def _next(self):
+        # Start time of the next request of each client; the clients with
+        # no waiting request are forgotten once they have been served
+        starts = {}
+        urgent = False
+        for client, flow in list(self.flows.items()):
+            if flow.pending:
+                starts[client] = max(self.vtime, flow.finish)
+                urgent = urgent or bool(flow.urgent)
+            elif flow.finish <= self.vtime:
+                del self.flows[client]
+        normal = any(
+            flow.pending > len(flow.urgent) for flow in self.flows.values()
+        )
+        urgent = urgent and (
+            not normal or self.urgent_streak < self.urgent_burst
+        )
+        self.urgent_streak = self.urgent_streak + 1 if urgent else 0
+        # Client with the lowest start time among the ones with a request
+        # of the selected class
+        client = min(
+            (
+                client for client, flow in self.flows.items()
+                if (len(flow.urgent) if urgent
+                    else flow.pending - len(flow.urgent))
+            ),
+            key=lambda client: starts[client]
+        )
+        flow = self.flows[client]
+        if urgent:
+            ticket = flow.urgent.popleft()
+        else:
+            for entity, queue in flow.queues.items():
+                if queue:
+                    break
+            ticket = queue.popleft()
+            # Round robin among the entity queues of the client
+            flow.queues.pop(entity)
+            if queue:
+                flow.queues[entity] = queue
+        flow.pending -= 1
+        self.vtime = starts[client]
+        flow.finish = starts[client] + ticket.cost / flow.weight
+        return ticket
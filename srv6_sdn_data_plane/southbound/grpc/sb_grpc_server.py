@@ -4,25 +4,24 @@
 from __future__ import absolute_import, division, print_function
 
 # General imports
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 import socket
 import logging
 import grpc
-import telnetlib
 import sys
+import threading
+import time
+from collections import OrderedDict
 from concurrent import futures
-from pyroute2 import IPRoute
 from pyroute2 import IPDB
+from pyroute2 import IPRoute
 from socket import AF_INET
 from socket import AF_INET6
 from socket import AF_UNSPEC
 from pyroute2.netlink.exceptions import NetlinkError
+from pyroute2.netlink import rtnl
 from pyroute2.netlink.rtnl import ndmsg
 
-import iptc
-import subprocess
-import re
-
 if sys.version_info >= (3, 0):
     from pyroute2.netlink.nlsocket import Stats  # noqa F401
 
@@ -57,19 +56,41 @@ from srv6_sdn_proto import srv6_manager_pb2
 from srv6_sdn_proto import status_codes_pb2
 from srv6_sdn_proto import network_events_listener_pb2
 from srv6_sdn_proto import network_events_listener_pb2_grpc
-from srv6_sdn_proto import gre_interface_pb2
-# from srv6_sdn_proto import ip_tunnel_interface_pb2
-from srv6_sdn_proto.ip_tunnel_interface_pb2 import IPTunnelType
 # from .sb_grpc_utils import InvalidAddressFamilyError
 from .sb_grpc_utils import InvalidAddressFamilyError, getAddressFamily, InvalidIPTablesRequestError
-
-# STAMP Support
-ENABLE_STAMP_SUPPORT = True
-
-# Import modules required by STAMP
-if ENABLE_STAMP_SUPPORT:
-    from srv6_delay_measurement import sender as stamp_sender_module
-    from srv6_delay_measurement import reflector as stamp_reflector_module
+from .sb_grpc_utils import LazyModule, StartupTimer
+from .sb_grpc_utils import InvalidLoadBalancerError, NftablesError
+from .sb_grpc_utils import InvalidTunnelTemplateError, JobQueueFullError
+from .sb_grpc_utils import AdmissionRejectedError
+from .sb_grpc_backends import FirewallRule, LoadBalancer, get_backend
+from .sb_grpc_backends import DEFAULT_DATAPLANE_BACKEND
+from .sb_grpc_coalescer import CoalescingBackend, DEFAULT_COALESCE_WINDOW
+from .sb_grpc_jobs import JobQueue
+from .sb_grpc_journal import Journal, OPERATIONS as JOURNAL_OPERATIONS
+from .sb_grpc_locks import LOCK_CHAIN, LOCK_LINK, LOCK_LOAD_BALANCER
+from .sb_grpc_locks import LOCK_RULES, LOCK_TABLE, LOCK_VRF, ObjectLocks
+from .sb_grpc_metrics import LinkStatsSampler, metrics
+from .sb_grpc_scheduler import AdmissionScheduler, request_cost
+from .sb_grpc_scheduler import DEFAULT_EXECUTION_SLOTS
+from .sb_grpc_seg6 import get_seg6local_encoder
+from .sb_grpc_telemetry import TelemetrySubscription
+from .sb_grpc_templates import TunnelTemplate, TunnelTemplateRegistry
+from .sb_grpc_state import AddrRecord, KernelState, LinkRecord, RouteRecord
+from .sb_grpc_state import RT_TABLE_MAIN, RTN_UNICAST, RTPROT_KERNEL
+from .sb_grpc_state import diff_routes, normalize_address, normalize_prefix
+
+# Proto modules used only by some requests are loaded on first use
+gre_interface_pb2 = LazyModule('srv6_sdn_proto.gre_interface_pb2')
+ip_tunnel_interface_pb2 = LazyModule(
+    'srv6_sdn_proto.ip_tunnel_interface_pb2'
+)
+
+# STAMP Support (can be disabled through the enable_stamp_support param)
+DEFAULT_ENABLE_STAMP_SUPPORT = True
+
+# Modules required by STAMP, loaded only if STAMP support is enabled
+stamp_sender_module = LazyModule('srv6_delay_measurement.sender')
+stamp_reflector_module = LazyModule('srv6_delay_measurement.reflector')
 
 # Global variables definition
 
@@ -129,15 +150,20 @@ ROUTE_TYPES = {
 # Whether to use Zebra or not for address configuration
 USE_ZEBRA = False
 
+# Low memory mode: do not mirror the kernel state with IPDB
+DEFAULT_LOW_MEMORY = False
+
 # Server reference
 grpc_server = None
-# Netlink socket
-ip_route = None
+# Dataplane backend
+dataplane = None
 ipdb = None
 # Non-loopback interfaces
 interfaces = []
 # Mapping interface to ids
 idxs = {}
+# Indexes of the kernel objects, populated by the warm-up
+kernel_state = KernelState()
 # Logger reference
 logger = logging.getLogger(__name__)
 # Server ip and port
@@ -157,6 +183,31 @@ NETLINK_ERROR_NO_SUCH_PROCESS = 3
 NETLINK_ERROR_FILE_EXISTS = 17
 NETLINK_ERROR_NO_SUCH_DEVICE = 19
 NETLINK_ERROR_OPERATION_NOT_SUPPORTED = 95
+# The socket buffer overflowed and some notifications were lost
+NETLINK_ERROR_NO_BUFFER_SPACE = 105
+
+# Receive buffer (in bytes) of the link monitor: a burst of notifications
+# (e.g. many interfaces created at once) must not overflow it
+LINK_MONITOR_RCVBUF = 8 * 1024 * 1024
+# Delay (in seconds) before receiving again after an error
+LINK_MONITOR_RETRY_INTERVAL = 1
+
+# Operations of the job steps
+JOB_OPERATIONS = ('add', 'get', 'change', 'del')
+# Maximum time (in seconds) between two progress checks of WatchJob
+JOB_WATCH_TIMEOUT = 1
+# Delay (in seconds) before a job step rejected by the admission
+# scheduler is submitted again
+JOB_ADMISSION_RETRY_INTERVAL = 0.1
+
+# Fields of the interfaces returned by Get if no field is requested
+INTERFACE_DEFAULT_FIELDS = frozenset(('name', 'mac', 'addrs', 'state'))
+
+# MAC address of the FDB entries of the remote VTEPs
+FDB_ALL_ZEROS = '00:00:00:00:00:00'
+
+# Names of the neighbor states
+NEIGH_STATES = dict((value, name) for name, value in ndmsg.states.items())
 
 
 class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
@@ -168,13 +219,42 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
         zebra_port=DEFAULT_ZEBRA_PORT,
         ospf6d_port=DEFAULT_OSPF6D_PORT,
         stop_event=None,
-        reboot_required=None
+        reboot_required=None,
+        dataplane=None,
+        state=None,
+        scheduler=None,
+        journal=None
     ):
         self.quagga_password = quagga_password
         self.zebra_port = zebra_port
         self.ospf6d_port = ospf6d_port
         self.stop_event = stop_event
         self.reboot_required = reboot_required
+        # Backend used to program the dataplane
+        if dataplane is None:
+            dataplane = get_backend(DEFAULT_DATAPLANE_BACKEND)
+        self.dataplane = dataplane
+        # Indexes of the kernel objects
+        self.state = state if state is not None else kernel_state
+        # Previous samples of the tunnel counters, used to compute the rates
+        self.link_stats = LinkStatsSampler()
+        # Templates of the tunnels
+        self.tunnel_templates = TunnelTemplateRegistry()
+        # Asynchronous jobs
+        self.jobs = JobQueue(
+            self._execute_step, status_codes_pb2.STATUS_SUCCESS
+        )
+        # Locks of the kernel objects modified by the handlers
+        self.locks = ObjectLocks()
+        # Locks of the journaled objects, always taken before the locks
+        # of the handlers
+        self.journal_locks = ObjectLocks()
+        # Admission of the requests
+        self.scheduler = (
+            scheduler if scheduler is not None else AdmissionScheduler()
+        )
+        # Journal of the applied operations (None to disable it)
+        self.journal = journal
 
     def parse_netlink_error(self, e):
         if e.code == NETLINK_ERROR_FILE_EXISTS:
@@ -191,7 +271,7 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
             return status_codes_pb2.STATUS_OPERATION_NOT_SUPPORTED
         else:
             logging.warning('Generic internal error: %s', e)
-            status_codes_pb2.STATUS_INTERNAL_ERROR
+            return status_codes_pb2.STATUS_INTERNAL_ERROR
 
     def ShutdownDevice(self, request, context):
         logging.info('\n\nShutdownDevice command received')
@@ -208,37 +288,55 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
         logging.debug('config received:\n%s', request)
         # Perform operation
         try:
-            if op == 'add' or 'del':
-                # Let's push the routes
+            if op == 'add' or op == 'del' or op == 'change':
+                # Changes are applied in place with a netlink replace, so
+                # the new segment list takes over atomically
+                route_op = 'replace' if op == 'change' else op
+                # Group the paths by destination and table: the paths
+                # sharing a destination are installed as a single
+                # multipath route, one nexthop for each segment list
+                routes = OrderedDict()
                 for path in request.paths:
                     # Rebuild segments
-                    segments = []
-                    for srv6_segment in path.sr_path:
-                        segments.append(srv6_segment.segment)
+                    segments = tuple(
+                        srv6_segment.segment for srv6_segment in path.sr_path
+                    )
                     table = path.table
                     if path.table == -1:
                         table = None
-                    if segments == []:
-                        segments = ['::']
+                    if segments == ():
+                        segments = ('::',)
                     if path.device != '':
                         oif = idxs[path.device]
                     else:
                         oif = None
-                    ip_route.route(
-                        op,
-                        dst=path.destination,
+                    # Weight of the nexthop (0 if not set)
+                    weight = getattr(path, 'weight', 0)
+                    routes.setdefault((path.destination, table), []).append(
+                        (path.encapmode, segments, oif, weight)
+                    )
+                # Let's push the routes
+                for (destination, table), nexthops in routes.items():
+                    if len(nexthops) > 1:
+                        self.dataplane.seg6_multipath_route(
+                            route_op,
+                            dst=destination,
+                            nexthops=nexthops,
+                            table=table
+                        )
+                        continue
+                    mode, segments, oif, _ = nexthops[0]
+                    self.dataplane.seg6_route(
+                        route_op,
+                        dst=destination,
+                        mode=mode,
+                        segs=segments,
                         oif=oif,
-                        table=table,
-                        encap={
-                            'type': 'seg6',
-                            'mode': path.encapmode,
-                            'segs': segments
-                        }
+                        table=table
                     )
             else:
                 # Operation unknown: this is a bug
                 logging.error('Unrecognized operation: %s', op)
-                exit(-1)
             # and create the response
             logging.debug('Send response: OK')
             return srv6_manager_pb2.SRv6ManagerReply(
@@ -269,166 +367,44 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
                 # Perform operation
                 if op == 'del':
                     # Delete a route
-                    ip_route.route(
-                        op, family=AF_INET6, dst=segment, table=localsid_table
+                    self.dataplane.seg6local(
+                        op, dst=segment, table=localsid_table
                     )
-                elif op == 'add':
-                    # Add a new route
-                    if action == 'End':
-                        ip_route.route(
-                            op,
-                            family=AF_INET6,
-                            dst=segment,
-                            oif=idxs[device],
-                            table=localsid_table,
-                            encap={
-                                'type': 'seg6local',
-                                'action': 'End'
-                            }
-                        )
-                    elif action == 'End.X':
-                        ip_route.route(
-                            op,
-                            family=AF_INET6,
-                            dst=segment,
-                            oif=idxs[device],
-                            table=localsid_table,
-                            encap={
-                                'type': 'seg6local',
-                                'action': 'End.X',
-                                'nh6': nexthop
-                            }
-                        )
-                    elif action == 'End.T':
-                        ip_route.route(
-                            op,
-                            family=AF_INET6,
-                            dst=segment,
-                            oif=idxs[device],
-                            table=localsid_table,
-                            encap={
-                                'type': 'seg6local',
-                                'action': 'End.T',
-                                'table': table
-                            }
+                elif op == 'add' or op == 'change':
+                    # Lookup the encoder of the behavior
+                    encoder = get_seg6local_encoder(action)
+                    if encoder is None:
+                        logging.debug('Error: Unrecognized action')
+                        return srv6_manager_pb2.SRv6ManagerReply(
+                            status=status_codes_pb2.STATUS_INVALID_ACTION
                         )
+                    # Parameter of the behavior
+                    if action in ('End.X', 'End.DX6', 'End.DX4'):
+                        value = nexthop
+                    elif action in ('End.T', 'End.DT6', 'End.DT4',
+                                    'End.DT46'):
+                        value = table
                     elif action == 'End.DX2':
-                        ip_route.route(
-                            op,
-                            family=AF_INET6,
-                            dst=segment,
-                            oif=idxs[device],
-                            table=localsid_table,
-                            encap={
-                                'type': 'seg6local',
-                                'action': 'End.DX2',
-                                'oif': interface
-                            }
-                        )
-                    elif action == 'End.DX6':
-                        ip_route.route(
-                            op,
-                            family=AF_INET6,
-                            dst=segment,
-                            oif=idxs[device],
-                            table=localsid_table,
-                            encap={
-                                'type': 'seg6local',
-                                'action': 'End.DX6',
-                                'nh6': nexthop
-                            }
-                        )
-                    elif action == 'End.DX4':
-                        ip_route.route(
-                            op,
-                            family=AF_INET6,
-                            dst=segment,
-                            oif=idxs[device],
-                            table=localsid_table,
-                            encap={
-                                'type': 'seg6local',
-                                'action': 'End.DX4',
-                                'nh4': nexthop
-                            }
-                        )
-                    elif action == 'End.DT6':
-                        ip_route.route(
-                            op,
-                            family=AF_INET6,
-                            dst=segment,
-                            oif=idxs[device],
-                            table=localsid_table,
-                            encap={
-                                'type': 'seg6local',
-                                'action': 'End.DT6',
-                                'table': table
-                            }
-                        )
-                    elif action == 'End.DT4':
-                        ip_route.route(
-                            op,
-                            family=AF_INET6,
-                            dst=segment,
-                            oif=idxs[device],
-                            table=localsid_table,
-                            encap={
-                                'type': 'seg6local',
-                                'action': 'End.DT4',
-                                'vrf_table': table
-                            }
-                        )
-                    elif action == 'End.DT46':
-                        ip_route.route(
-                            op,
-                            family=AF_INET6,
-                            dst=segment,
-                            oif=idxs[device],
-                            table=localsid_table,
-                            encap={
-                                'type': 'seg6local',
-                                'action': 'End.DT46',
-                                'vrf_table': table
-                            }
-                        )
-                    elif action == 'End.B6':
-                        # Rebuild segments
-                        segments = []
-                        for srv6_segment in function.segs:
-                            segments.append(srv6_segment.segment)
-                        ip_route.route(
-                            op,
-                            family=AF_INET6,
-                            dst=segment,
-                            oif=idxs[device],
-                            table=localsid_table,
-                            encap={
-                                'type': 'seg6local',
-                                'action': 'End.B6',
-                                'srh': {'segs': segments}
-                            }
-                        )
-                    elif action == 'End.B6.Encaps':
+                        value = self.dataplane.link_lookup(
+                            ifname=interface
+                        )[0]
+                    elif action in ('End.B6', 'End.B6.Encaps'):
                         # Rebuild segments
-                        segments = []
-                        for srv6_segment in function.segs:
-                            segments.append(srv6_segment.segment)
-                        ip_route.route(
-                            op,
-                            family=AF_INET6,
-                            dst=segment,
-                            oif=idxs[device],
-                            table=localsid_table,
-                            encap={
-                                'type': 'seg6local',
-                                'action': 'End.B6.Encaps',
-                                'srh': {'segs': segments}
-                            }
+                        value = tuple(
+                            srv6_segment.segment
+                            for srv6_segment in function.segs
                         )
                     else:
-                        logging.debug('Error: Unrecognized action')
-                        return srv6_manager_pb2.SRv6ManagerReply(
-                            status=status_codes_pb2.STATUS_INVALID_ACTION
-                        )
+                        value = None
+                    # Add a new route, or replace the existing one in place
+                    self.dataplane.seg6local(
+                        'replace' if op == 'change' else op,
+                        dst=segment,
+                        action=action,
+                        value=value,
+                        table=localsid_table,
+                        oif=idxs[device]
+                    )
                 else:
                     # Operation unknown: this is a bug
                     logging.error('Unrecognized operation: %s', op)
@@ -448,71 +424,78 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
         # Let's process the request
         try:
             if op == 'add' or op == 'del':
-                for rule in request.rules:
-                    # Extract params from the request
-                    family = rule.family
-                    table = rule.table
-                    priority = rule.priority
-                    action = rule.action
-                    scope = rule.scope
-                    destination = rule.destination
-                    dst_len = rule.dst_len
-                    source = rule.source
-                    src_len = rule.src_len
-                    in_interface = rule.in_interface
-                    out_interface = rule.out_interface
-                    fwmark = rule.fwmark
-                    # Check optional fields
-                    table = table if table != -1 else None
-                    priority = priority if priority != -1 else (self._get_lowest_priority_rule() -1)
-                    action = action if action != '' else None
-                    scope = scope if scope != -1 else None
-                    destination = destination if destination != '' else None
-                    dst_len = dst_len if dst_len != -1 else None
-                    source = source if source != '' else None
-                    src_len = src_len if src_len != -1 else None
-                    in_interface = in_interface if in_interface != '' else None
-                    out_interface = (
-                        out_interface if out_interface != '' else None
-                    )
+                # The default priority is computed from the current
+                # rules: the rules are serialized
+                with self.locks.hold([(LOCK_RULES,)]):
+                    for rule in request.rules:
+                        # Extract params from the request
+                        family = rule.family
+                        table = rule.table
+                        priority = rule.priority
+                        action = rule.action
+                        scope = rule.scope
+                        destination = rule.destination
+                        dst_len = rule.dst_len
+                        source = rule.source
+                        src_len = rule.src_len
+                        in_interface = rule.in_interface
+                        out_interface = rule.out_interface
+                        fwmark = rule.fwmark
+                        # Check optional fields
+                        table = table if table != -1 else None
+                        priority = priority if priority != -1 else (self._get_lowest_priority_rule() -1)
+                        action = action if action != '' else None
+                        scope = scope if scope != -1 else None
+                        destination = (
+                            destination if destination != '' else None
+                        )
+                        dst_len = dst_len if dst_len != -1 else None
+                        source = source if source != '' else None
+                        src_len = src_len if src_len != -1 else None
+                        in_interface = (
+                            in_interface if in_interface != '' else None
+                        )
+                        out_interface = (
+                            out_interface if out_interface != '' else None
+                        )
 
-                    fwmark = fwmark if fwmark != -1 else None
-
-                    # # FIXME remmove this just for debug -------------------------------------------------------
-                    # logging.info('|||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||')
-                    # logging.info('op: %s', op)
-                    # logging.info('family: %s', family)
-                    # logging.info('table: %s', table)
-                    # logging.info('priority: %s', priority)
-                    # logging.info('action: %s', action)
-                    # logging.info('scope: %s', scope)
-                    # logging.info('destination: %s', destination)
-                    # logging.info('dst_len: %s', dst_len)
-                    # logging.info('source: %s', source)
-                    # logging.info('src_len: %s', src_len)
-                    # logging.info('in_interface: %s', in_interface)
-                    # logging.info('out_interface: %s', out_interface)
-                    # logging.info('|||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||')
-                    # # --------------------------------------------------------------------------------------------
-
-
-                    # Create or delete the rule
-                    ip_route.rule(
-                        op,
-                        family=family,
-                        table=table,
-                        priority=priority,
-                        action=action,
-                        rtscope=scope,
-                        dst=destination,
-                        dst_len=dst_len,
-                        src=source,
-                        src_len=src_len,
-                        iifname=in_interface,
-                        oifname=out_interface,
-                        fwmark=fwmark
+                        fwmark = fwmark if fwmark != -1 else None
+
+                        # # FIXME remmove this just for debug -------------------------------------------------------
+                        # logging.info('|||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||')
+                        # logging.info('op: %s', op)
+                        # logging.info('family: %s', family)
+                        # logging.info('table: %s', table)
+                        # logging.info('priority: %s', priority)
+                        # logging.info('action: %s', action)
+                        # logging.info('scope: %s', scope)
+                        # logging.info('destination: %s', destination)
+                        # logging.info('dst_len: %s', dst_len)
+                        # logging.info('source: %s', source)
+                        # logging.info('src_len: %s', src_len)
+                        # logging.info('in_interface: %s', in_interface)
+                        # logging.info('out_interface: %s', out_interface)
+                        # logging.info('|||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||')
+                        # # --------------------------------------------------------------------------------------------
+
+
+                        # Create or delete the rule
+                        self.dataplane.rule(
+                            op,
+                            family=family,
+                            table=table,
+                            priority=priority,
+                            action=action,
+                            rtscope=scope,
+                            dst=destination,
+                            dst_len=dst_len,
+                            src=source,
+                            src_len=src_len,
+                            iifname=in_interface,
+                            oifname=out_interface,
+                            fwmark=fwmark
 
-                    )
+                        )
             else:
                 # Operation unknown: this is a bug
                 logging.error('Unrecognized operation: %s', op)
@@ -530,8 +513,16 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
         logging.debug('config received:\n%s', request)
         # Let's process the request
         try:
-            if op == 'add' or op == 'del':
-                for route in request.routes:
+            if op == 'add' or op == 'del' or op == 'change':
+                # Changes are applied in place with a netlink replace
+                route_op = 'replace' if op == 'change' else op
+                # The routes are submitted in batch (the backend can
+                # coalesce them with the routes of concurrent requests),
+                # with a status per route
+                ifindexes = {}
+                statuses = [None] * len(request.routes)
+                entries = []
+                for i, route in enumerate(request.routes):
                     # Extract params from the request
                     family = route.family
                     tos = route.tos
@@ -560,21 +551,32 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
                     )
                     src_len = src_len if src_len != -1 else None
                     in_interface = (
-                        ip_route.link_lookup(ifname=in_interface)[0]
+                        self._get_ifindex(in_interface, ifindexes)
                         if in_interface != ''
                         else None
                     )
                     out_interface = (
-                        ip_route.link_lookup(ifname=out_interface)[0]
+                        self._get_ifindex(out_interface, ifindexes)
                         if out_interface != ''
                         else None
                     )
+                    if (
+                        (route.in_interface != '' and in_interface is None)
+                        or (route.out_interface != ''
+                            and out_interface is None)
+                    ):
+                        statuses[i] = status_codes_pb2.STATUS_NO_SUCH_DEVICE
+                        continue
                     gateway = gateway if gateway != '' else None
-                    
+
                     # Let's push the route
                     if destination is None and op == 'del':
-                        # Destination not specified, delete all the routes
-                        ip_route.flush_routes(
+                        # Destination not specified, delete all the
+                        # routes; the routes before the flush are applied
+                        # first
+                        self._apply_routes(entries, statuses)
+                        entries = []
+                        self.dataplane.flush_routes(
                             table=table,
                             tos=tos,
                             scope=scope,
@@ -587,23 +589,92 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
                             gateway=gateway,
                             family=family
                         )
+                        statuses[i] = status_codes_pb2.STATUS_SUCCESS
                     else:
-                        # Create or delete the route
-                        ip_route.route(
-                            op,
-                            table=table,
-                            tos=tos,
-                            scope=scope,
-                            type=type,
-                            proto=proto,
-                            dst=destination,
-                            prefsrc=preferred_source,
-                            src_len=src_len,
-                            dst_len=dst_len,
-                            iif=in_interface,
-                            oif=out_interface,
-                            gateway=gateway,
-                            family=family
+                        # Create, replace or delete the route
+                        entries.append((i, route_op, {
+                            'table': table,
+                            'tos': tos,
+                            'scope': scope,
+                            'type': type,
+                            'proto': proto,
+                            'dst': destination,
+                            'prefsrc': preferred_source,
+                            'src_len': src_len,
+                            'dst_len': dst_len,
+                            'iif': in_interface,
+                            'oif': out_interface,
+                            'gateway': gateway,
+                            'family': family
+                        }))
+                self._apply_routes(entries, statuses)
+                # The request fails with the error of the first failed
+                # route, the status of each route is in route_statuses
+                status = status_codes_pb2.STATUS_SUCCESS
+                for entry_status in statuses:
+                    if entry_status != status_codes_pb2.STATUS_SUCCESS:
+                        status = entry_status
+                        break
+                response = srv6_manager_pb2.SRv6ManagerReply(status=status)
+                if _has_field(response, 'route_statuses'):
+                    for route, entry_status in zip(request.routes, statuses):
+                        route_status = response.route_statuses.add()
+                        route_status.destination = route.destination
+                        route_status.table = route.table
+                        route_status.status = entry_status
+                logging.debug('Send response: %s', status)
+                return response
+            else:
+                # Operation unknown: this is a bug
+                logging.error('Unrecognized operation: %s', op)
+            # and create the response
+            logging.debug('Send response: OK')
+            return srv6_manager_pb2.SRv6ManagerReply(
+                status=status_codes_pb2.STATUS_SUCCESS
+            )
+        except NetlinkError as e:
+            return srv6_manager_pb2.SRv6ManagerReply(
+                status=self.parse_netlink_error(e)
+            )
+
+    # Apply a list of (op, route() arguments) and raise the error of the
+    # first failed route
+    def _route_batch(self, routes):
+        if not routes:
+            return
+        for _, e in self.dataplane.route_batch(routes):
+            if e is not None:
+                raise e
+
+    # Apply a list of (index, op, route() arguments) and set the status of
+    # each route
+    def _apply_routes(self, entries, statuses):
+        if not entries:
+            return
+        results = self.dataplane.route_batch(
+            [(route_op, kwargs) for _, route_op, kwargs in entries]
+        )
+        for (i, _, _), (_, e) in zip(entries, results):
+            if e is None:
+                statuses[i] = status_codes_pb2.STATUS_SUCCESS
+            elif isinstance(e, NetlinkError):
+                statuses[i] = self.parse_netlink_error(e)
+            else:
+                statuses[i] = status_codes_pb2.STATUS_INTERNAL_ERROR
+
+    def HandleRouteTableRequest(self, op, request, context):
+        logging.debug('config received:\n%s', request)
+        # Let's process the request
+        try:
+            if op == 'add' or op == 'change' or op == 'del':
+                for route_table in request.tables:
+                    # 'del' replaces the table with an empty route set
+                    paths = route_table.paths if op != 'del' else []
+                    routes = route_table.routes if op != 'del' else []
+                    # The table is diffed against its current routes
+                    with self.locks.hold([(LOCK_TABLE, route_table.table)]):
+                        self._replace_route_table(
+                            route_table.table, paths, routes
                         )
             else:
                 # Operation unknown: this is a bug
@@ -618,6 +689,89 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
                 status=self.parse_netlink_error(e)
             )
 
+    def _replace_route_table(self, table, paths, routes):
+        # Desired routes: route key -> (signature, route params)
+        desired = {}
+        for path in paths:
+            # Rebuild segments
+            segments = tuple(
+                srv6_segment.segment for srv6_segment in path.sr_path
+            )
+            if segments == ():
+                segments = ('::',)
+            oif = idxs[path.device] if path.device != '' else None
+            family, dst, dst_len = normalize_prefix(path.destination)
+            desired[(family, table, dst, dst_len)] = (
+                (oif, None, (path.encapmode or 'encap', segments)),
+                dict(mode=path.encapmode, segs=segments, oif=oif)
+            )
+        for route in routes:
+            oif = (
+                self.dataplane.link_lookup(ifname=route.out_interface)[0]
+                if route.out_interface != ''
+                else None
+            )
+            gateway = route.gateway if route.gateway != '' else None
+            family, dst, dst_len = normalize_prefix(
+                route.destination if route.destination != '' else None,
+                route.dst_len if route.dst_len != -1 else None,
+                route.family if route.family != -1 else None
+            )
+            desired[(family, table, dst, dst_len)] = (
+                (oif, gateway, None),
+                dict(oif=oif, gateway=gateway)
+            )
+        # Current routes of the table (except the kernel routes), from the
+        # startup snapshot if the table has not changed since, otherwise
+        # from a dump
+        records = self.state.take_routes(table)
+        if records is None:
+            records = {}
+            for msg in self.dataplane.get_routes(
+                family=AF_UNSPEC, table=table
+            ):
+                record = RouteRecord.from_msg(msg)
+                if (
+                    record.table != table
+                    or record.proto == RTPROT_KERNEL
+                    or msg.get('type') != RTN_UNICAST
+                ):
+                    continue
+                records[record.key()] = record
+        current = dict(
+            (key, record.signature()) for key, record in records.items()
+        )
+        create, replace, delete = diff_routes(
+            current, dict((k, v[0]) for k, v in desired.items())
+        )
+        # Make before break: new and changed routes are installed with
+        # 'replace' before removing the stale ones, so no destination
+        # is left without a route. The plain routes are submitted in
+        # batch
+        routes = []
+        for key in create + replace:
+            family, _, dst, dst_len = key
+            params = desired[key][1]
+            dst = '%s/%s' % (dst, dst_len) if dst is not None else 'default'
+            if 'segs' in params:
+                self.dataplane.seg6_route(
+                    'replace', dst=dst, table=table, **params
+                )
+            else:
+                routes.append(('replace', dict(
+                    family=family, dst=dst, table=table, **params
+                )))
+        self._route_batch(routes)
+        self._route_batch([
+            ('del', dict(family=family, dst=dst, dst_len=dst_len, table=table))
+            for family, _, dst, dst_len in delete
+        ])
+        logging.info(
+            'Route table %s replaced: %d created, %d replaced, %d deleted, '
+            '%d unchanged', table, len(create), len(replace), len(delete),
+            len(desired) - len(create) - len(replace)
+        )
+
     def HandleIPAddrPyroute2Request(self, op, request, context):
         logging.debug('config received:\n%s', request)
         # Let's process the request
@@ -642,9 +796,9 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
                     if family in [AF_INET, AF_INET6]:
                         # Add or Remove IPv6 address
                         try:
-                            ip_route.addr(
+                            self.dataplane.addr(
                                 op,
-                                index=ip_route.link_lookup(ifname=device)[0],
+                                index=self.dataplane.link_lookup(ifname=device)[0],
                                 address=ip.split('/')[0],
                                 mask=int(ip.split('/')[1]),
                                 family=family
@@ -655,9 +809,9 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
                     elif family == AF_UNSPEC:
                         if op == 'del':
                             # Remove IPv4/IPv6 address
-                            ip_route.addr(
+                            self.dataplane.addr(
                                 op,
-                                index=ip_route.link_lookup(ifname=device)[0],
+                                index=self.dataplane.link_lookup(ifname=device)[0],
                                 address=ip.split('/')[0],
                                 mask=int(ip.split('/')[1])
                             )
@@ -698,7 +852,7 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
                 password = self.quagga_password
                 try:
                     # Init telnet
-                    tn = telnetlib.Telnet('localhost', port)
+                    tn = self.dataplane.quagga_session(port, password)
                     # Password
                     tn.read_until(b'Password: ')
                     tn.write(('%s\r\n' % password).encode('latin-1'))
@@ -841,123 +995,110 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
         logging.debug('config received:\n%s', request)
         # Let's process the request
         try:
-            if op == 'add' or op == 'del':
+            if op == 'add':
+                # The tenants are provisioned in bulk: all the VRFs are
+                # created up in one pipelined pass, then their interfaces
+                # are enslaved in a second pass, with a status per VRF
+                keys = []
                 for device in request.devices:
-                    ip_route.link(
-                        op,
-                        ifname=device.name,
-                        kind='vrf',
-                        vrf_table=device.table
+                    keys.append((LOCK_VRF, device.name))
+                    keys.append((LOCK_TABLE, device.table))
+                    keys.extend(
+                        (LOCK_LINK, ifindex) for ifindex in (
+                            self.state.get_ifindex(interface)
+                            for interface in device.interfaces
+                        ) if ifindex is not None
                     )
-                    if op == 'add':
-                        # Enable the new VRF
-                        vrfindex = ip_route.link_lookup(ifname=device.name)[0]
-                        ip_route.link('set', index=vrfindex, state='up')
-                        '''
-                        # Set the default route for the table
-                        # (and hence default route for the VRF)
-                        ip_route.route('add', table=device.table,
-                                        type='unreachable', dst='default',
-                                        priority=4278198272, family=AF_INET)
-                        ip_route.route('add', table=device.table,
-                                        type='unreachable', dst='default',
-                                        priority=4278198272, family=AF_INET6)
-                        '''
-                    '''
-                    elif op == 'del':
-                        ip_route.route('del', table=device.table,
-                                        type='unreachable',
-                                        dst='default', family=AF_INET)
-                        ip_route.route('del', table=device.table,
-                                        type='unreachable',
-                                        dst='default', family=AF_INET6)
-                    '''
+                with self.locks.hold(keys):
+                    results = self.dataplane.vrf_batch([
+                        (device.name, device.table, list(device.interfaces))
+                        for device in request.devices
+                    ])
+                status = status_codes_pb2.STATUS_SUCCESS
+                response = srv6_manager_pb2.SRv6ManagerReply()
+                for device, (_, e) in zip(request.devices, results):
+                    if e is None:
+                        vrf_status = status_codes_pb2.STATUS_SUCCESS
+                    elif isinstance(e, NetlinkError):
+                        vrf_status = self.parse_netlink_error(e)
+                    else:
+                        logging.warning('Cannot setup the VRF: %s', e)
+                        vrf_status = status_codes_pb2.STATUS_NO_SUCH_DEVICE
+                    if (
+                        vrf_status != status_codes_pb2.STATUS_SUCCESS
+                        and status == status_codes_pb2.STATUS_SUCCESS
+                    ):
+                        status = vrf_status
+                    if not _has_field(response, 'vrf_statuses'):
+                        continue
+                    device_status = response.vrf_statuses.add()
+                    device_status.name = device.name
+                    device_status.status = vrf_status
                 # and create the response
-                if op == 'add':
-                    return self.HandleVRFDeviceRequest(
-                        'change', request, context
-                    )
-                else:
-                    logging.debug('Send response: OK')
-                    return srv6_manager_pb2.SRv6ManagerReply(
-                        status=status_codes_pb2.STATUS_SUCCESS
-                    )
-            elif op == 'change':
-                # FIXME remove this just logging ----------------------------------------------------------------------
-                logging.info("\n\######################33333####### op == change : n")
-                logging.info("request : ")
-                logging.info(request)
-
-                # --------------------------------------------------------------------------------------------------
+                logging.debug('Send response: %s', status)
+                response.status = status
+                return response
+            elif op == 'del':
                 for device in request.devices:
-                    if device.op == 'add_interfaces':
-                        # Get the VRF index
-                        vrfindex = ip_route.link_lookup(ifname=device.name)[0]
-                        # Add the remaining links to the VRF
-                        for interface in device.interfaces:
-                            ifindex = ip_route.link_lookup(ifname=interface)[0]
-                            ip_route.link(
-                                'set', index=ifindex, master=vrfindex
-                            )
-                        return srv6_manager_pb2.SRv6ManagerReply(
-                            status=status_codes_pb2.STATUS_SUCCESS
+                    with self.locks.hold([
+                        (LOCK_VRF, device.name), (LOCK_TABLE, device.table)
+                    ]):
+                        self.dataplane.link(
+                            op,
+                            ifname=device.name,
+                            kind='vrf',
+                            vrf_table=device.table
                         )
-                    elif device.op == 'del_interfaces':
-                        # Get the VRF index
-                        vrfindex = ip_route.link_lookup(ifname=device.name)[0]
-                        # For each link in the VRF
-                        interfaces_in_vrf = set()
-                        for link in ip_route.get_links():
-                            if link.get_attr('IFLA_MASTER') == vrfindex:
-                                interfaces_in_vrf.add(
-                                    link.get_attr('IFLA_IFNAME')
-                                )
-                        # Add the remaining links to the VRF
-                        for interface in device.interfaces:
-                            if interface not in interfaces_in_vrf:
-                                logging.warning(
-                                    'Interface does not belong to the VRF'
-                                )
-                                return srv6_manager_pb2.SRv6ManagerReply(
-                                    status=(
-                                        status_codes_pb2.STATUS_NO_SUCH_DEVICE
-                                    )
-                                )
-                            ifindex = ip_route.link_lookup(ifname=interface)[0]
-                            ip_route.link('set', index=ifindex, master=0)
+                # and create the response
+                logging.debug('Send response: OK')
+                return srv6_manager_pb2.SRv6ManagerReply(
+                    status=status_codes_pb2.STATUS_SUCCESS
+                )
+            elif op == 'change':
+                ifindexes = {}
+                for device in request.devices:
+                    vrfindex = self._get_ifindex(device.name, ifindexes)
+                    if vrfindex is None:
                         return srv6_manager_pb2.SRv6ManagerReply(
-                            status=status_codes_pb2.STATUS_SUCCESS
+                            status=status_codes_pb2.STATUS_NO_SUCH_DEVICE
                         )
-                    else:
-                        # Get the interfaces to be added to the VRF
-                        interfaces = []
-                        for interface in device.interfaces:
-                            interfaces.append(interface)
-                        # Get the VRF index
-                        vrfindex = ip_route.link_lookup(ifname=device.name)[0]
-                        # For each link in the VRF
-                        for link in ip_route.get_links():
-                            if link.get_attr('IFLA_MASTER') == vrfindex:
-                                if link.get_attr('IFLA_IFNAME') in interfaces:
-                                    # The link belongs to the VRF
-                                    interfaces.remove(
-                                        link.get_attr('IFLA_IFNAME')
-                                    )
-                                else:
-                                    # The link has to be removed from the VRF
-                                    ifindex = link.get('index')
-                                    ip_route.link(
-                                        'set', index=ifindex, master=0
-                                    )
-                        # Add the remaining links to the VRF
-                        for interface in interfaces:
-                            ifindex = ip_route.link_lookup(ifname=interface)[0]
-                            ip_route.link(
-                                'set', index=ifindex, master=vrfindex
+                    # Resolve the interfaces of the request
+                    interfaces = OrderedDict()
+                    for interface in device.interfaces:
+                        ifindex = self._get_ifindex(interface, ifindexes)
+                        if ifindex is None:
+                            return srv6_manager_pb2.SRv6ManagerReply(
+                                status=status_codes_pb2.STATUS_NO_SUCH_DEVICE
+                            )
+                        interfaces[ifindex] = interface
+                    # The members of the VRF are read and modified holding
+                    # the locks of the VRF and of all the interfaces
+                    # involved; the current members are known only after
+                    # reading them, so the read is repeated until all of
+                    # them are locked
+                    keys = set([(LOCK_VRF, device.name)])
+                    keys.update((LOCK_LINK, ifindex) for ifindex in interfaces)
+                    while True:
+                        with self.locks.hold(keys):
+                            interfaces_in_vrf = self._get_slaves(vrfindex)
+                            members = set(
+                                (LOCK_LINK, ifindex)
+                                for ifindex in interfaces_in_vrf
                             )
+                            if members <= keys:
+                                status = self._change_vrf_members(
+                                    device.op, vrfindex, interfaces,
+                                    interfaces_in_vrf
+                                )
+                                break
+                        keys |= members
+                    if status != status_codes_pb2.STATUS_SUCCESS:
                         return srv6_manager_pb2.SRv6ManagerReply(
-                            status=status_codes_pb2.STATUS_SUCCESS
+                            status=status
                         )
+                return srv6_manager_pb2.SRv6ManagerReply(
+                    status=status_codes_pb2.STATUS_SUCCESS
+                )
             else:
                 # Operation unknown: this is a bug
                 logging.error('Unrecognized operation: %s', op)
@@ -966,6 +1107,45 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
                 status=self.parse_netlink_error(e)
             )
 
+    # Change the members of a VRF: add_interfaces and del_interfaces add
+    # and remove the interfaces, any other mode syncs the members with the
+    # interfaces (an OrderedDict ifindex -> ifname)
+    def _change_vrf_members(self, mode, vrfindex, interfaces,
+                            interfaces_in_vrf):
+        if mode == 'add_interfaces':
+            # Add the links to the VRF
+            enslave = [
+                ifindex for ifindex in interfaces
+                if ifindex not in interfaces_in_vrf
+            ]
+            release = []
+        elif mode == 'del_interfaces':
+            for ifindex in interfaces:
+                if ifindex not in interfaces_in_vrf:
+                    logging.warning('Interface does not belong to the VRF')
+                    return status_codes_pb2.STATUS_NO_SUCH_DEVICE
+            enslave = []
+            release = list(interfaces)
+        else:
+            # Sync the membership: the links not in the request are
+            # removed from the VRF and the remaining links are added to
+            # the VRF
+            enslave = [
+                ifindex for ifindex in interfaces
+                if ifindex not in interfaces_in_vrf
+            ]
+            release = [
+                ifindex for ifindex in interfaces_in_vrf
+                if ifindex not in interfaces
+            ]
+        for ifindex in release:
+            self.dataplane.link('set', index=ifindex, master=0)
+            self.state.set_master(ifindex, None)
+        for ifindex in enslave:
+            self.dataplane.link('set', index=ifindex, master=vrfindex)
+            self.state.set_master(ifindex, vrfindex)
+        return status_codes_pb2.STATUS_SUCCESS
+
     def HandleInterfaceRequest(self, op, request, context):
         logging.debug('config received:\n%s', request)
         # Let's process the request
@@ -979,7 +1159,7 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
                 password = self.quagga_password
                 try:
                     # Init telnet
-                    tn = telnetlib.Telnet('localhost', port)
+                    tn = self.dataplane.quagga_session(port, password)
                     # Password
                     tn.read_until(b'Password: ')
                     tn.write(('%s\r\n' % password).encode('latin-1'))
@@ -1030,66 +1210,62 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
                     )
             elif op == 'get':
                 # Handle get operation
-                # Get the interfaces
-                interfaces = []
+                # The interfaces are read from the kernel state, kept up
+                # to date by the link and address notifications; only the
+                # requested fields are filled (all but the statistics if
+                # no field is specified)
+                fields = set(getattr(request, 'fields', ())) or (
+                    INTERFACE_DEFAULT_FIELDS
+                )
+                ifindexes = {}
                 for interface in request.interfaces:
-                    ifindex = ip_route.link_lookup(ifname=interface.name)[0]
-                    interfaces.append(ifindex)
-                links = dict()
-                for link in ip_route.get_links(*interfaces):
-                    if (
-                        link.get_attr('IFLA_LINKINFO')
-                        and (
-                            link.get_attr('IFLA_LINKINFO')
-                            .get_attr('IFLA_INFO_KIND') != 'vrf'
+                    if self._get_ifindex(interface.name, ifindexes) is None:
+                        return srv6_manager_pb2.SRv6ManagerReply(
+                            status=status_codes_pb2.STATUS_NO_SUCH_DEVICE
                         )
+                links, addrs = self._get_interfaces(
+                    list(ifindexes.values()), 'addrs' in fields
+                )
+                stats = {}
+                if 'stats' in fields:
+                    # Counters are not notified: read them with one dump
+                    for msg in self.dataplane.get_links(
+                        *[link.index for link in links]
                     ):
-                        # Skip the VRFs
-                        # Get the index of the interface
-                        ifindex = link.get('index')
-                        # Get the name of the interface
-                        ifname = link.get_attr('IFLA_IFNAME')
-                        # Get the MAC address of the interface
-                        macaddr = link.get_attr('IFLA_ADDRESS')
-                        # Get the state of the interface
-                        state = link.get_attr('IFLA_OPERSTATE')
-                        # Save the interface
-                        links[ifindex] = (ifname, macaddr, state)
-                # Get the addresses assigned to the interfaces
-                addrs = dict()
-                for addr in ip_route.get_addr():
-                    # Get the index of the interface
-                    ifindex = addr.get('index')
-                    # Get the IP address of the interface
-                    ipaddr = addr.get_attr('IFA_ADDRESS')
-                    # Get prefix length
-                    prefixlen = addr.get('prefixlen')
-                    # IP/mask
-                    ipaddr = '%s/%s' % (ipaddr, prefixlen)
-                    # Save the address
-                    if addrs.get(ifindex) is None:
-                        addrs[ifindex] = list()
-                    addrs[ifindex].append(ipaddr)
-                # Mapping interface name to MAC address and IP address
-                interfaces = dict()
-                for ifindex in links:
-                    ifname = links[ifindex][0]
-                    macaddr = links[ifindex][1]
-                    state = links[ifindex][2]
-                    ipaddr = addrs[ifindex]
-                    interfaces[ifname] = (macaddr, ipaddr, state, ifindex)
+                        stats[msg.get('index')] = (
+                            msg.get_attr('IFLA_STATS64') or {}
+                        )
                 # Create the response
                 response = srv6_manager_pb2.SRv6ManagerReply(
                     status=status_codes_pb2.STATUS_SUCCESS
                 )
-                for ifname in interfaces:
+                for link in links:
+                    if link.kind is None or link.kind == 'vrf':
+                        # Skip the VRFs
+                        continue
                     interface = response.interfaces.add()
-                    interface.index = int(interfaces[ifname][3])
-                    interface.name = ifname
-                    interface.macaddr = interfaces[ifname][0]
-                    for addr in interfaces[ifname][1]:
-                        interface.ipaddrs.append(addr)
-                    interface.state = interfaces[ifname][2]
+                    interface.index = int(link.index)
+                    if 'name' in fields:
+                        interface.name = link.ifname
+                    if 'mac' in fields:
+                        interface.macaddr = link.address
+                    if 'addrs' in fields:
+                        for addr in addrs.get(link.index, ()):
+                            interface.ipaddrs.append(str(addr))
+                    if 'state' in fields:
+                        interface.state = link.state
+                    # The counters are reported only if the installed proto
+                    # has them, as the fields of the request
+                    if 'stats' in fields and _has_field(
+                        interface, 'rx_packets'
+                    ):
+                        link_stats = stats.get(link.index, {})
+                        interface.rx_packets = str(
+                            link_stats.get('rx_packets', 0))
+                        interface.tx_packets = str(
+                            link_stats.get('tx_packets', 0))
+                        interface.rx_bytes = str(link_stats.get('rx_bytes', 0))
+                        interface.tx_bytes = str(link_stats.get('tx_bytes', 0))
                 logging.debug('Send response:\n%s', response)
                 return response
             else:
@@ -1104,29 +1280,103 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
         logging.debug('config received:\n%s', request)
         # Let's process the request
         try:
-            if op == 'add' or op == 'del':
-                for neigh in request.neighs:
+            if op == 'add' or op == 'del' or op == 'change':
+                # The neighbors are programmed in batch: the devices are
+                # resolved once for each request and the entries are
+                # pipelined towards the kernel, with a status per entry
+                neigh_op = 'replace' if op == 'change' else op
+                ifindexes = {}
+                statuses = [None] * len(request.neighs)
+                entries = []
+                for i, neigh in enumerate(request.neighs):
                     # Extract params from the request
-                    family = neigh.family
-                    addr = neigh.addr
-                    lladdr = None
-                    if neigh.lladdr:
-                        lladdr = neigh.lladdr
-                    device = neigh.device
+                    ifindex = self._get_ifindex(neigh.device, ifindexes)
+                    if ifindex is None:
+                        statuses[i] = status_codes_pb2.STATUS_NO_SUCH_DEVICE
+                        continue
                     flags = 0
                     if neigh.proxy:
                         flags |= ndmsg.NTF_PROXY
-                    # Create or delete the neigh
-                    device = ip_route.link_lookup(ifname=device)[0]
-                    ip_route.neigh(
-                        op,
-                        family=family,
-                        dst=addr,
-                        lladdr=lladdr,
-                        ifindex=device,
-                        flags=flags,
-                        state=ndmsg.states['permanent']
+                    entries.append((i, {
+                        'family': neigh.family or None,
+                        'dst': neigh.addr,
+                        'lladdr': neigh.lladdr or None,
+                        'ifindex': ifindex,
+                        'flags': flags,
+                        'state': ndmsg.states['permanent']
+                    }))
+                # Create, replace or delete the neighs
+                results = self.dataplane.neigh_batch(
+                    neigh_op, [entry for _, entry in entries]
+                )
+                for (i, _), (_, e) in zip(entries, results):
+                    if e is None:
+                        statuses[i] = status_codes_pb2.STATUS_SUCCESS
+                    elif isinstance(e, NetlinkError):
+                        statuses[i] = self.parse_netlink_error(e)
+                    else:
+                        statuses[i] = status_codes_pb2.STATUS_INTERNAL_ERROR
+                # The request fails with the error of the first failed
+                # entry, the status of each entry is in neigh_statuses
+                status = status_codes_pb2.STATUS_SUCCESS
+                for entry_status in statuses:
+                    if entry_status != status_codes_pb2.STATUS_SUCCESS:
+                        status = entry_status
+                        break
+                response = srv6_manager_pb2.SRv6ManagerReply(status=status)
+                if _has_field(response, 'neigh_statuses'):
+                    for neigh, entry_status in zip(request.neighs, statuses):
+                        neigh_status = response.neigh_statuses.add()
+                        neigh_status.addr = neigh.addr
+                        neigh_status.device = neigh.device
+                        neigh_status.status = entry_status
+                logging.debug('Send response: %s', status)
+                return response
+            elif op == 'get':
+                response = srv6_manager_pb2.SRv6ManagerReply(
+                    status=status_codes_pb2.STATUS_SUCCESS
+                )
+                if not _has_field(response, 'neighs'):
+                    # The installed proto cannot carry the neighbors
+                    logging.error('Neighbor get not supported by the proto')
+                    return srv6_manager_pb2.SRv6ManagerReply(
+                        status=status_codes_pb2.STATUS_OPERATION_NOT_SUPPORTED
                     )
+                # Dump the neighbors once and filter them by device and
+                # state (all the neighbors if no filter is specified)
+                ifindexes = {}
+                devices = set()
+                for neigh in request.neighs:
+                    if not neigh.device:
+                        continue
+                    ifindex = self._get_ifindex(neigh.device, ifindexes)
+                    if ifindex is None:
+                        return srv6_manager_pb2.SRv6ManagerReply(
+                            status=status_codes_pb2.STATUS_NO_SUCH_DEVICE
+                        )
+                    devices.add(ifindex)
+                states = 0
+                for state in getattr(request, 'states', ()):
+                    states |= ndmsg.states[state]
+                ifnames = dict(
+                    (ifindex, ifname) for ifname, ifindex in ifindexes.items()
+                )
+                for msg in self.dataplane.get_neighbours(family=AF_UNSPEC):
+                    ifindex = msg.get('ifindex')
+                    if devices and ifindex not in devices:
+                        continue
+                    if states and not msg.get('state', 0) & states:
+                        continue
+                    if ifindex not in ifnames:
+                        ifnames[ifindex] = self._get_ifname(ifindex)
+                    neigh = response.neighs.add()
+                    neigh.family = msg.get('family') or AF_UNSPEC
+                    neigh.addr = msg.get_attr('NDA_DST') or ''
+                    neigh.lladdr = msg.get_attr('NDA_LLADDR') or ''
+                    neigh.device = ifnames[ifindex] or ''
+                    neigh.state = NEIGH_STATES.get(msg.get('state'), '')
+                logging.debug('Send response: OK')
+                return response
             else:
                 # Operation unknown: this is a bug
                 logging.error('Unrecognized operation: %s', op)
@@ -1139,12 +1389,18 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
             return srv6_manager_pb2.SRv6ManagerReply(
                 status=self.parse_netlink_error(e)
             )
+        except KeyError as e:
+            logging.error('Unknown neighbor state: %s', e)
+            return srv6_manager_pb2.SRv6ManagerReply(
+                status=status_codes_pb2.STATUS_INVALID_GRPC_REQUEST
+            )
 
     def HandleGREInterfaceRequest(self, op, request, context):
         logging.debug('config received:\n%s', request)
         # Let's process the request
         try:
             if op == 'add' or op == 'del':
+                tunnels = []
                 for gre_interface in request.gre_interfaces:
                     # Extract params from the request
                     name = gre_interface.name
@@ -1157,33 +1413,24 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
                     remote = remote if remote != '' else None
                     key = key if key != -1 else None
                     if type == gre_interface_pb2.IP6GRE:
-                        # Create or delete the gre interface
-                        ip_route.link(
-                            op,
-                            ifname=name,
-                            kind='ip6gre',
-                            ip6gre_local=local,
-                            ip6gre_remote=remote,
-                            ip6gre_key=key
-                        )
-                    if type == gre_interface_pb2.GRE:
-                        # Create or delete the gre interface
-                        ip_route.link(
-                            op,
-                            ifname=name,
-                            kind='gre',
-                            gre_local=local,
-                            gre_remote=remote,
-                            gre_key=key
-                        )
+                        tunnels.append((name, 'ip6gre', {
+                            'ip6gre_local': local,
+                            'ip6gre_remote': remote,
+                            'ip6gre_key': key
+                        }))
+                    elif type == gre_interface_pb2.GRE:
+                        tunnels.append((name, 'gre', {
+                            'gre_local': local,
+                            'gre_remote': remote,
+                            'gre_key': key
+                        }))
                     else:
                         logging.warning('Unrecognized GRE type: %s', type)
                         return srv6_manager_pb2.SRv6ManagerReply(
                             status=status_codes_pb2.STATUS_INTERNAL_ERROR
                         )
-                    # Enable the new GRE interface
-                    greindex = ip_route.link_lookup(ifname=name)[0]
-                    ip_route.link('set', index=greindex, state='up')
+                # Create (and enable) or delete the GRE interfaces
+                return self._tunnel_reply(op, tunnels)
             else:
                 # Operation unknown: this is a bug
                 logging.error('Unrecognized operation: %s', op)
@@ -1200,178 +1447,206 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
     def HandleIPVxLANRequest(self, op, request, context):
         logging.debug("config received:\n%s", request)
         # Let's process the request
-        for vxlan in request.vxlan:
-            # Extract params from the request
-            ifname = vxlan.ifname
-            vxlan_link = vxlan.vxlan_link
-            vxlan_id = vxlan.vxlan_id
-            vxlan_port = vxlan.vxlan_port
-            vxlan_group = None
-            if vxlan_group != '':
-                vxlan_group = vxlan.vxlan_group
-            # Let's push the vxlan command
-            if op == 'add':
-                # Create VTEP
-
-                # FIXME remove this just logging  ---------------------------------------------------------
-                logging.info("\n\n\n@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@\n")
-                logging.info(ifname)
-                logging.info(ip_route.link_lookup(ifname=vxlan_link)[0])
-                logging.info(vxlan_id)
-                logging.info(vxlan_port)
-                logging.info(vxlan_group)
-                logging.info("\n@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@\n\n\n")
-                logging.info("\n!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!\n\n\n")
-                logging.info(request)
-                logging.info("\n!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!\n\n\n")
-
-
-                # FIXME -----------------------------------------------------------------------------------
-
-
-                if getAddressFamily(vxlan_group) == AF_INET:
-                    ip_route.link(
-                        op,
-                        ifname=ifname,
-                        kind="vxlan",
-                        vxlan_link=ip_route.link_lookup(ifname=vxlan_link)[0],
-                        vxlan_id=vxlan_id,
-                        vxlan_port=vxlan_port,
-                        vxlan_port_range={
-                            'low': vxlan_port,
-                            'high': vxlan_port+1
-                        },
-                        vxlan_group=vxlan_group
-                    )
-                elif getAddressFamily(vxlan_group) == AF_INET6:
-                    ip_route.link(
-                        op,
-                        ifname=ifname,
-                        kind="vxlan",
-                        vxlan_link=ip_route.link_lookup(ifname=vxlan_link)[0],
-                        vxlan_id=vxlan_id,
-                        vxlan_port=vxlan_port,
-                        vxlan_port_range={
+        try:
+            if op == 'add' or op == 'del':
+                tunnels = []
+                ifindexes = {}
+                for vxlan in request.vxlan:
+                    # Extract params from the request
+                    ifname = vxlan.ifname
+                    if op == 'del':
+                        # Delete VTEP interface
+                        tunnels.append((ifname, 'vxlan', {}))
+                        continue
+                    vxlan_link = self._get_ifindex(vxlan.vxlan_link, ifindexes)
+                    if vxlan_link is None:
+                        return srv6_manager_pb2.SRv6ManagerReply(
+                            status=status_codes_pb2.STATUS_NO_SUCH_DEVICE
+                        )
+                    vxlan_id = vxlan.vxlan_id
+                    vxlan_port = vxlan.vxlan_port
+                    vxlan_group = vxlan.vxlan_group
+                    # Create VTEP
+                    params = {
+                        'vxlan_link': vxlan_link,
+                        'vxlan_id': vxlan_id,
+                        'vxlan_port': vxlan_port,
+                        'vxlan_port_range': {
                             'low': vxlan_port,
-                            'high': vxlan_port+1
-                        },
-                        vxlan_group6=vxlan_group
-                    )
-                else:
-                    return srv6_manager_pb2.SRv6ManagerReply(
-                        status=status_codes_pb2.STATUS_INVALID_ADDRESS
-                    )
-                # Set UP VTEP
-                ip_route.link(
-                    'set',
-                    index=ip_route.link_lookup(ifname=ifname)[0],
-                    state='up'
-                )
-            # Delete VTEP interface
-            elif op == 'del':
-                ip_route.link(
-                    'del',
-                    index=ip_route.link_lookup(ifname=ifname)[0]
-                )
+                            'high': vxlan_port + 1
+                        }
+                    }
+                    if getAddressFamily(vxlan_group) == AF_INET:
+                        params['vxlan_group'] = vxlan_group
+                    elif getAddressFamily(vxlan_group) == AF_INET6:
+                        params['vxlan_group6'] = vxlan_group
+                    else:
+                        return srv6_manager_pb2.SRv6ManagerReply(
+                            status=status_codes_pb2.STATUS_INVALID_ADDRESS
+                        )
+                    tunnels.append((ifname, 'vxlan', params))
+                # Create (and set UP) or delete the VTEPs
+                return self._tunnel_reply(op, tunnels)
             else:
                 # Operation unknown: this is a bug
-                print('Unrecognized operation')
-                exit(-1)
-        # and create the response
-        return srv6_manager_pb2.SRv6ManagerReply(
-            status=status_codes_pb2.STATUS_SUCCESS
-        )
+                logging.error('Unrecognized operation: %s', op)
+            # and create the response
+            return srv6_manager_pb2.SRv6ManagerReply(
+                status=status_codes_pb2.STATUS_SUCCESS
+            )
+        except NetlinkError as e:
+            return srv6_manager_pb2.SRv6ManagerReply(
+                status=self.parse_netlink_error(e)
+            )
 
     def HandleIPfdbentriesRequest(self, op, request, context):
         logging.debug("config received:\n%s", request)
         # Let's process the request
-        for fdbentries in request.fdbentries:
-            # Extract params from the request
-            ifindex = fdbentries.ifindex
-            dst = fdbentries.dst
-            # Let's push the fdb append command
-            if op == 'add':
-                ip_route.fdb(
-                    'append',
-                    ifindex=ip_route.link_lookup(ifname=ifindex)[0],
-                    lladdr='00:00:00:00:00:00',
-                    dst=dst
-                )
-
-            elif op == 'del':
-                ip_route.fdb(
-                    'del',
-                    ifindex=ip_route.link_lookup(ifname=ifindex)[0],
-                    lladdr='00:00:00:00:00:00',
-                    dst=dst
-                )
-            else:
-                # Operation unknown: this is a bug
-                print('Unrecognized operation')
-                exit(-1)
-        # and create the response
-        return srv6_manager_pb2.SRv6ManagerReply(
-            status=status_codes_pb2.STATUS_SUCCESS
-        )
-
-    def HandleIPTunnelRequest(self, op, request, context):
-        logging.debug('config received:\n%s', request)
-        # Let's process the request
         try:
-            for ip_tunnel in request.ip_tunnels:
-                if op == 'add':
-                    # Extract the tunnel type
-                    if ip_tunnel.tunnel_type == IPTunnelType.IP4IP4:
-                        ip_route.link(
-                            op,
-                            ifname=ip_tunnel.ifname,
-                            kind='sit',
-                            ip6tnl_local=ip_tunnel.local_addr,
-                            ip6tnl_remote=ip_tunnel.remote_addr,
-                            ip6tnl_mode='ipip'
-                        )
-                    elif ip_tunnel.tunnel_type == IPTunnelType.IP4IP6:
-                        ip_route.link(
-                            op,
-                            ifname=ip_tunnel.ifname,
-                            kind='ip6tnl',
-                            ip6tnl_local=ip_tunnel.local_addr,
-                            ip6tnl_remote=ip_tunnel.remote_addr,
-                            ip6tnl_mode='ipip6'
-                        )
-                    elif ip_tunnel.tunnel_type == IPTunnelType.IP6IP4:
-                        ip_route.link(
-                            op,
-                            ifname=ip_tunnel.ifname,
-                            kind='sit',
-                            ip6tnl_local=ip_tunnel.local_addr,
-                            ip6tnl_remote=ip_tunnel.remote_addr,
-                            ip6tnl_mode='ip6ip'
-                        )
-                    elif ip_tunnel.tunnel_type == IPTunnelType.IP6IP6:
-                        ip_route.link(
-                            op,
-                            ifname=ip_tunnel.ifname,
-                            kind='ip6tnl',
-                            ip6tnl_local=ip_tunnel.local_addr,
-                            ip6tnl_remote=ip_tunnel.remote_addr,
-                            ip6tnl_mode='ip6ip6'
+            # Group the remote VTEPs by VXLAN device: duplicated entries
+            # are pushed only once, and an entry with no dst only
+            # declares the device (e.g. to remove all its VTEPs)
+            ifindexes = {}
+            vteps = OrderedDict()
+            # Entry key -> dst of the request, reported in the statuses
+            requested = {}
+            for fdbentries in request.fdbentries:
+                # Extract params from the request
+                ifindex = self._get_ifindex(fdbentries.ifindex, ifindexes)
+                if ifindex is None:
+                    return srv6_manager_pb2.SRv6ManagerReply(
+                        status=status_codes_pb2.STATUS_NO_SUCH_DEVICE
+                    )
+                if fdbentries.dst:
+                    # The addresses are compared in the canonical form
+                    # reported by the kernel
+                    try:
+                        key = (ifindex, normalize_address(fdbentries.dst))
+                    except ValueError as e:
+                        logging.error('Invalid FDB entry: %s', e)
+                        return srv6_manager_pb2.SRv6ManagerReply(
+                            status=(
+                                status_codes_pb2.STATUS_INVALID_GRPC_REQUEST
+                            )
                         )
-                    else:
+                    vteps[key] = None
+                    requested.setdefault(key, fdbentries.dst)
+            # The entries of the devices are diffed and modified holding
+            # the locks of the devices
+            with self.locks.hold(
+                [(LOCK_LINK, ifindex) for ifindex in ifindexes.values()]
+            ):
+                if op == 'add':
+                    # Let's push the fdb append commands
+                    changes = [('append', list(vteps))]
+                elif op == 'del':
+                    changes = [('del', list(vteps))]
+                elif op == 'change':
+                    # The request carries the desired remote VTEPs of each
+                    # device: diff them against the current FDB (one dump for
+                    # all the devices) and apply only the changes
+                    devices = set(ifindexes.values())
+                    current = {}
+                    for msg in self.dataplane.get_fdb():
+                        if (
+                            msg.get('ifindex') in devices
+                            and msg.get_attr('NDA_LLADDR') == FDB_ALL_ZEROS
+                            and msg.get_attr('NDA_DST') is not None
+                        ):
+                            current[(
+                                msg.get('ifindex'),
+                                normalize_address(msg.get_attr('NDA_DST'))
+                            )] = None
+                    create, _, delete = diff_routes(current, vteps)
+                    changes = [('append', create), ('del', delete)]
+                else:
+                    # Operation unknown: this is a bug
+                    logging.error('Unrecognized operation: %s', op)
+                    return srv6_manager_pb2.SRv6ManagerReply(
+                        status=status_codes_pb2.STATUS_INVALID_GRPC_REQUEST
+                    )
+                # Apply the changes in batch, with a status for each entry
+                ifnames = dict(
+                    (ifindex, ifname) for ifname, ifindex in ifindexes.items()
+                )
+                status = status_codes_pb2.STATUS_SUCCESS
+                response = srv6_manager_pb2.SRv6ManagerReply()
+                for fdb_op, keys in changes:
+                    if not keys:
+                        continue
+                    results = self.dataplane.fdb_batch(fdb_op, [
+                        {
+                            'ifindex': ifindex, 'lladdr': FDB_ALL_ZEROS,
+                            'dst': dst
+                        }
+                        for ifindex, dst in keys
+                    ])
+                    for (ifindex, dst), (_, e) in zip(keys, results):
+                        if e is None:
+                            entry_status = status_codes_pb2.STATUS_SUCCESS
+                        elif isinstance(e, NetlinkError):
+                            entry_status = self.parse_netlink_error(e)
+                        else:
+                            entry_status = (
+                                status_codes_pb2.STATUS_INTERNAL_ERROR
+                            )
+                        if (
+                            entry_status != status_codes_pb2.STATUS_SUCCESS
+                            and status == status_codes_pb2.STATUS_SUCCESS
+                        ):
+                            status = entry_status
+                        if not _has_field(response, 'fdb_statuses'):
+                            continue
+                        fdb_status = response.fdb_statuses.add()
+                        fdb_status.ifindex = ifnames[ifindex]
+                        fdb_status.dst = requested.get((ifindex, dst), dst)
+                        fdb_status.status = entry_status
+            # and create the response
+            logging.debug('Send response: %s', status)
+            response.status = status
+            return response
+        except NetlinkError as e:
+            return srv6_manager_pb2.SRv6ManagerReply(
+                status=self.parse_netlink_error(e)
+            )
+
+    def HandleIPTunnelRequest(self, op, request, context):
+        logging.debug('config received:\n%s', request)
+        # Let's process the request
+        try:
+            if op == 'add' or op == 'del':
+                # Kind and mode of each tunnel type
+                tunnel_types = {
+                    ip_tunnel_interface_pb2.IP4IP4: ('sit', 'ipip'),
+                    ip_tunnel_interface_pb2.IP4IP6: ('ip6tnl', 'ipip6'),
+                    ip_tunnel_interface_pb2.IP6IP4: ('sit', 'ip6ip'),
+                    ip_tunnel_interface_pb2.IP6IP6: ('ip6tnl', 'ip6ip6')
+                }
+                tunnels = []
+                for ip_tunnel in request.ip_tunnels:
+                    if op == 'del':
+                        tunnels.append((ip_tunnel.ifname, None, {}))
+                        continue
+                    # Extract the tunnel type
+                    tunnel_type = tunnel_types.get(ip_tunnel.tunnel_type)
+                    if tunnel_type is None:
                         logging.error(
                             'Invalid tunnel type: %s', ip_tunnel.tunnel_type
                         )
                         return srv6_manager_pb2.SRv6ManagerReply(
                             status=status_codes_pb2.STATUS_INTERNAL_ERROR
                         )
-                    # Enable the new interface
-                    ifindex = ip_route.link_lookup(ifname=ip_tunnel.ifname)[0]
-                    ip_route.link('set', index=ifindex, state='up')
-                elif op == 'del':
-                    ip_route.link(op, ifname=ip_tunnel.ifname)
-                else:
-                    # Operation unknown: this is a bug
-                    logging.error('Unrecognized operation: %s', op)
+                    kind, mode = tunnel_type
+                    tunnels.append((ip_tunnel.ifname, kind, {
+                        'ip6tnl_local': ip_tunnel.local_addr,
+                        'ip6tnl_remote': ip_tunnel.remote_addr,
+                        'ip6tnl_mode': mode
+                    }))
+                # Create (and enable) or delete the interfaces
+                return self._tunnel_reply(op, tunnels)
+            else:
+                # Operation unknown: this is a bug
+                logging.error('Unrecognized operation: %s', op)
             logging.debug('Send response: OK')
             return srv6_manager_pb2.SRv6ManagerReply(
                 status=status_codes_pb2.STATUS_SUCCESS
@@ -1381,6 +1656,119 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
                 status=self.parse_netlink_error(e)
             )
 
+    def HandleTunnelTemplateRequest(self, op, request, context):
+        logging.debug('config received:\n%s', request)
+        # Let's process the request
+        try:
+            if op == 'add' or op == 'change':
+                # Validate all the templates before registering them
+                templates = [
+                    TunnelTemplate(
+                        name=template.name,
+                        kind=template.kind,
+                        local=template.local if template.local != '' else None,
+                        ttl=template.ttl if template.ttl != -1 else None,
+                        key=template.key if template.key != -1 else None,
+                        mode=template.mode if template.mode != '' else None,
+                        link=template.link if template.link != '' else None,
+                        port=template.port if template.port != 0 else None
+                    )
+                    for template in request.templates
+                ]
+                for template in templates:
+                    self.tunnel_templates.register(
+                        template, replace=(op == 'change')
+                    )
+            elif op == 'del':
+                for template in request.templates:
+                    self.tunnel_templates.unregister(template.name)
+            elif op == 'get':
+                response = srv6_manager_pb2.SRv6ManagerReply(
+                    status=status_codes_pb2.STATUS_SUCCESS
+                )
+                names = set(template.name for template in request.templates)
+                for template in self.tunnel_templates.list():
+                    if names and template.name not in names:
+                        continue
+                    tunnel_template = response.tunnel_templates.add()
+                    tunnel_template.name = template.name
+                    tunnel_template.kind = template.kind
+                    tunnel_template.local = template.local or ''
+                    tunnel_template.ttl = (
+                        template.ttl if template.ttl is not None else -1
+                    )
+                    tunnel_template.key = (
+                        template.key if template.key is not None else -1
+                    )
+                    tunnel_template.mode = template.mode or ''
+                    tunnel_template.link = template.link or ''
+                    tunnel_template.port = template.port or 0
+                return response
+            else:
+                # Operation unknown: this is a bug
+                logging.error('Unrecognized operation: %s', op)
+            # and create the response
+            logging.debug('Send response: OK')
+            return srv6_manager_pb2.SRv6ManagerReply(
+                status=status_codes_pb2.STATUS_SUCCESS
+            )
+        except InvalidTunnelTemplateError as e:
+            logging.error('Invalid tunnel template: %s', e)
+            return srv6_manager_pb2.SRv6ManagerReply(
+                status=status_codes_pb2.STATUS_INVALID_GRPC_REQUEST
+            )
+
+    def HandleTemplateTunnelRequest(self, op, request, context):
+        logging.debug('config received:\n%s', request)
+        # Let's process the request
+        try:
+            if op == 'add':
+                # The tunnels carry only the template, the interface name,
+                # the remote endpoint and optionally the key/VNI
+                ifindexes = {}
+                tunnels = []
+                for tunnel in request.tunnels:
+                    template = self.tunnel_templates.get(tunnel.template)
+                    vxlan_link = None
+                    if template.link is not None:
+                        vxlan_link = self._get_ifindex(
+                            template.link, ifindexes
+                        )
+                        if vxlan_link is None:
+                            return srv6_manager_pb2.SRv6ManagerReply(
+                                status=status_codes_pb2.STATUS_NO_SUCH_DEVICE
+                            )
+                    tunnels.append(template.instantiate(
+                        ifname=tunnel.ifname,
+                        remote=tunnel.remote,
+                        key=tunnel.key if tunnel.key != -1 else None,
+                        vxlan_link=vxlan_link
+                    ))
+                # Create and enable the tunnels
+                return self._tunnel_reply(op, tunnels)
+            elif op == 'del':
+                return self._tunnel_reply(op, [
+                    (tunnel.ifname, None, {}) for tunnel in request.tunnels
+                ])
+            else:
+                # Operation unknown: this is a bug
+                logging.error('Unrecognized operation: %s', op)
+            # and create the response
+            return srv6_manager_pb2.SRv6ManagerReply(
+                status=status_codes_pb2.STATUS_SUCCESS
+            )
+        except (InvalidTunnelTemplateError, ValueError, OSError) as e:
+            # ValueError and OSError: parameters rejected by the netlink
+            # encoder (e.g. an address of the wrong family)
+            logging.error('Invalid tunnel: %s', e)
+            return srv6_manager_pb2.SRv6ManagerReply(
+                status=status_codes_pb2.STATUS_INVALID_GRPC_REQUEST
+            )
+        except NetlinkError as e:
+            return srv6_manager_pb2.SRv6ManagerReply(
+                status=self.parse_netlink_error(e)
+            )
+
     # Add or delete iptables rules
     def HandleIptablesRuleRequest(self, op, request, context):
         # FIXME You Should add validation to the request params,
@@ -1400,6 +1788,7 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
         # Let's process the request
         try:
             if op == 'add' or op == 'del':
+                firewall_rules = list()
                 for rule in request.rules:
 
                     # Extract  from the request
@@ -1441,115 +1830,80 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
 
 
 
-                    # Initialize the iptables rule
-                    iptables_rule = iptc.Rule()
-                    
-
-                    
-                    if (source_ip is not None and source_ip != ''): iptables_rule.src = source_ip
-                    if (destination_ip is not None and destination_ip != ""): iptables_rule.dst = destination_ip
-                    if (in_interface is not None and in_interface != ""): iptables_rule.in_interface = in_interface
-                    if (out_interface is not None and out_interface != ""): iptables_rule.out_interface = out_interface
-
-                    # FIXME Add validation for protocol
-                    if (protocol is not None and protocol != ''):
-                        iptables_rule.protocol = protocol
-
-                        if (source_port is not None and source_port != '') \
-                             or (destination_port is not None and destination_port != ''):
-
-
-                            # Init the iptables Match if the source_port / destination_port is provided 
-                            iptables_match = iptc.Match(iptables_rule, iptables_rule.protocol)
-                            if (source_port is not None and source_port != ''): iptables_match.sport = source_port
-                            if (destination_port is not None and destination_port != ''): iptables_match.dport = destination_port
-
-                            # Add the match to the rule 
-                            iptables_rule.add_match(iptables_match)
-
-                    # Handle the statistic mode match. 
+                    # Handle the statistic mode match.
                     # TODO add more validation and other match names.
+                    match_params = dict()
                     if match_name is not None and match_name != '':
                         if match_name == 'statistic':
-                            match_statistic_mode = None
-                            match_statistic_every = None
-                            match_statistic_packet = None
-                            for attribute in match_attributes :
+                            for attribute in match_attributes:
                                 if attribute['attribute_name'] == 'mode':
-                                    match_statistic_mode = attribute['attribute_value']
-                                    if match_statistic_mode != 'nth':
+                                    if attribute['attribute_value'] != 'nth':
                                         raise NotImplementedError
-                                elif attribute['attribute_name'] == 'every':
-                                    match_statistic_every = attribute['attribute_value']
-                                elif attribute['attribute_name'] == 'packet':
-                                    match_statistic_packet = attribute['attribute_value']
-                                else :
+                                elif attribute['attribute_name'] not in (
+                                    'every', 'packet'
+                                ):
                                     raise NotImplementedError
-
-                            match_statistic = iptc.Match(iptables_rule, "statistic")
-                            if match_statistic_mode != None : 
-                                match_statistic.mode = match_statistic_mode
-                            if match_statistic_every != None :
-                                match_statistic.every = match_statistic_every
-                            if match_statistic_packet != None :
-                                match_statistic.packet = match_statistic_packet
-
-                            iptables_rule.add_match(match_statistic)
-
+                                match_params[attribute['attribute_name']] = (
+                                    attribute['attribute_value']
+                                )
                         elif match_name == 'mark':
-                            match_mark_value = None
-
-                            for attribute in match_attributes :
+                            for attribute in match_attributes:
                                 if attribute['attribute_name'] == 'mark':
-                                    match_mark_value = attribute['attribute_value']
+                                    match_params['mark'] = str(
+                                        attribute['attribute_value']
+                                    )
                                     break
-                                else :
+                                else:
                                     raise NotImplementedError
-
-
-                            if match_mark_value != None :
-                                match_mark = iptc.Match(iptables_rule, "mark")
-                                match_mark.mark = str(match_mark_value)
-                                iptables_rule.add_match(match_mark)
-                        else: 
+                            if 'mark' not in match_params:
+                                match_name = None
+                        else:
                             raise NotImplementedError
+                    else:
+                        match_name = None
 
-                    
-
-                    
-
-
-                    iptables_table = iptc.Table(table)
-
-                    if not iptables_table.autocommit:
-                        iptables_table.autocommit = True
-
-                    iptables_chain = iptc.Chain(iptables_table, chain)
-
-                    iptables_target = iptc.Target(iptables_rule, target_name)
+                    # FIXME Add validation for protocol
+                    protocol = protocol if protocol != '' else None
+                    if protocol is None:
+                        # Ports can be matched only if protocol is provided
+                        source_port = ''
+                        destination_port = ''
 
-                    
-                    if target_name == 'MARK':
-                        iptables_target.set_mark = target_value
-                    
-                    if target_name == 'DNAT':
-                        iptables_target.to_destination = target_value
-
-                    # if target_name == 'ACCEPT':
-                    #     pass
-                    # else:
-                    #     # TODO Throw an error : NotImplementedError
-                    #     raise NotImplementedError
-  
-
-                    iptables_rule.target = iptables_target
-
-                    if op == 'add':
-                        iptables_chain.insert_rule(iptables_rule)
-                        logging.debug('Added iptables rule: %s', iptables_rule)
-                    elif op == 'del':
-                        iptables_chain.delete_rule(iptables_rule)
-                        logging.debug('Deleted iptables rule: %s', iptables_rule)
+                    firewall_rules.append(FirewallRule(
+                        table=table,
+                        chain=chain,
+                        target_name=target_name,
+                        target_value=(
+                            target_value if target_value != '' else None
+                        ),
+                        protocol=protocol,
+                        source_ip=source_ip if source_ip != '' else None,
+                        destination_ip=(
+                            destination_ip if destination_ip != '' else None
+                        ),
+                        source_port=(
+                            source_port if source_port != '' else None
+                        ),
+                        destination_port=(
+                            destination_port if destination_port != ''
+                            else None
+                        ),
+                        in_interface=(
+                            in_interface if in_interface != '' else None
+                        ),
+                        out_interface=(
+                            out_interface if out_interface != '' else None
+                        ),
+                        match_name=match_name,
+                        match_params=match_params
+                    ))
+                # Apply all the rules at once, holding the locks of their
+                # chains
+                with self.locks.hold(set(
+                    (LOCK_CHAIN, rule.table, rule.chain)
+                    for rule in firewall_rules
+                )):
+                    self.dataplane.firewall_rules(op, firewall_rules)
             else:
                 logging.error('Unrecognized operation: %s', op)
 
@@ -1564,6 +1918,111 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
                             status=status_codes_pb2.STATUS_INTERNAL_ERROR
                         )
              
+    def HandleLoadBalancerRequest(self, op, request, context):
+        logging.debug('config received:\n%s', request)
+        # Let's process the request
+        try:
+            response = srv6_manager_pb2.SRv6ManagerReply(
+                status=status_codes_pb2.STATUS_SUCCESS
+            )
+            for load_balancer in request.load_balancers:
+                # Extract params from the request
+                lb = LoadBalancer(
+                    name=load_balancer.name,
+                    destination=load_balancer.destination,
+                    members=[
+                        (member.interface, member.weight, member.mark)
+                        for member in load_balancer.members
+                    ],
+                    table=(
+                        load_balancer.table
+                        if load_balancer.table != -1 else None
+                    ),
+                    mode=(
+                        load_balancer.mode
+                        if load_balancer.mode != '' else 'multipath'
+                    )
+                )
+                if op == 'add' or op == 'del':
+                    with self.locks.hold([(LOCK_LOAD_BALANCER, lb.name)]):
+                        self.dataplane.load_balancer(op, lb)
+                elif op == 'change':
+                    # Members and weights are replaced in place
+                    with self.locks.hold([(LOCK_LOAD_BALANCER, lb.name)]):
+                        self.dataplane.load_balancer('replace', lb)
+                elif op == 'get':
+                    # Per member counters
+                    for stat in self.dataplane.load_balancer_stats(lb):
+                        lb_stats = response.load_balancer_statistics.add()
+                        lb_stats.name = lb.name
+                        lb_stats.member = stat['member']
+                        lb_stats.packet_count = str(stat['packets'])
+                        lb_stats.byte_count = str(stat['bytes'])
+                else:
+                    # Operation unknown: this is a bug
+                    logging.error('Unrecognized operation: %s', op)
+            # and create the response
+            logging.debug('Send response: OK')
+            return response
+        except NetlinkError as e:
+            return srv6_manager_pb2.SRv6ManagerReply(
+                status=self.parse_netlink_error(e)
+            )
+        except InvalidLoadBalancerError as e:
+            logging.error('Invalid load balancer: %s', e)
+            return srv6_manager_pb2.SRv6ManagerReply(
+                status=status_codes_pb2.STATUS_INVALID_GRPC_REQUEST
+            )
+        except (NftablesError, IndexError) as e:
+            logging.error('Cannot configure the load balancer: %s', e)
+            return srv6_manager_pb2.SRv6ManagerReply(
+                status=status_codes_pb2.STATUS_INTERNAL_ERROR
+            )
+
+    def HandleTunnelStatsRequest(self, op, request, context):
+        logging.debug('config received:\n%s', request)
+        # Let's process the request
+        try:
+            if op != 'get':
+                # Operation unknown: this is a bug
+                logging.error('Unrecognized operation: %s', op)
+                return srv6_manager_pb2.SRv6ManagerReply(
+                    status=status_codes_pb2.STATUS_INVALID_GRPC_REQUEST
+                )
+            # The counters are read from the link statistics with a single
+            # dump, no accounting rule is installed on the packet path.
+            # If no interface is specified, all the tunnels are reported
+            ifnames = set(request.interfaces)
+            response = srv6_manager_pb2.SRv6ManagerReply(
+                status=status_codes_pb2.STATUS_SUCCESS
+            )
+            for stat in self.link_stats.sample(self.dataplane, ifnames):
+                tunnel_stats = response.tunnel_statistics.add()
+                tunnel_stats.interface = stat['ifname']
+                tunnel_stats.kind = stat['kind'] or ''
+                tunnel_stats.rx_packets = str(stat['rx_packets'])
+                tunnel_stats.tx_packets = str(stat['tx_packets'])
+                tunnel_stats.rx_bytes = str(stat['rx_bytes'])
+                tunnel_stats.tx_bytes = str(stat['tx_bytes'])
+                tunnel_stats.rx_errors = str(stat['rx_errors'])
+                tunnel_stats.tx_errors = str(stat['tx_errors'])
+                tunnel_stats.rx_dropped = str(stat['rx_dropped'])
+                tunnel_stats.tx_dropped = str(stat['tx_dropped'])
+                # Rates are available from the second sample
+                tunnel_stats.rx_packet_rate = str(
+                    stat.get('rx_packets_rate', 0))
+                tunnel_stats.tx_packet_rate = str(
+                    stat.get('tx_packets_rate', 0))
+                tunnel_stats.rx_byte_rate = str(stat.get('rx_bytes_rate', 0))
+                tunnel_stats.tx_byte_rate = str(stat.get('tx_bytes_rate', 0))
+            # and create the response
+            logging.debug('Send response: OK')
+            return response
+        except NetlinkError as e:
+            return srv6_manager_pb2.SRv6ManagerReply(
+                status=self.parse_netlink_error(e)
+            )
+
     def HandleIPTablesStatisticsRequest(self, op, request, context):
 
 
@@ -1673,10 +2132,92 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
 
 
     def Execute(self, op, request, context):
+        if self.journal is None or op not in JOURNAL_OPERATIONS:
+            return self._dispatch(op, request, context)
+        # Record the operations successfully applied, to replay them when
+        # the agent is restarted. The requests touching the same objects
+        # are applied and recorded holding the journal locks of the
+        # objects, so they are journaled in the order they hit the kernel
+        _, ids = request_object_keys(request)
+        keys = (
+            [(request.entity_type, id) for id in ids] if ids is not None
+            else None
+        )
+        version = None
+        with self.journal_locks.hold(keys):
+            reply = self._dispatch(op, request, context)
+            if (
+                reply is not None
+                and reply.status == status_codes_pb2.STATUS_SUCCESS
+            ):
+                version = self.journal.record(
+                    op, request.SerializeToString()
+                )
+        # The sync is waited without holding the locks
+        if version is not None:
+            self.journal.wait_synced(version)
+        return reply
+
+    # Drop the objects changed by a request from the startup snapshot of
+    # the kernel state (see KernelState); the routes, rules and neighbors
+    # changed by the other entities are not known, the whole snapshot is
+    # dropped
+    def _invalidate_snapshot(self, request):
+        entity_type = request.entity_type
+        if entity_type == srv6_manager_pb2.IPRoute:
+            for route in request.iproute_request.routes:
+                if route.table == -1 and route.destination == '':
+                    # Flush of the routes of all the tables
+                    self.state.invalidate_routes()
+                    break
+                self.state.invalidate_routes(
+                    route.table if route.table != -1 else RT_TABLE_MAIN
+                )
+        elif entity_type == getattr(srv6_manager_pb2, 'RouteTable', None):
+            # The handler takes the tables from the snapshot
+            pass
+        elif entity_type == srv6_manager_pb2.IPRule:
+            self.state.invalidate_rules()
+        elif entity_type == srv6_manager_pb2.IPNeigh:
+            for neigh in request.ipneigh_request.neighs:
+                ifindex = (
+                    self.state.get_ifindex(neigh.device)
+                    if neigh.device else None
+                )
+                # The neighbors of an unknown device (or of all the
+                # devices) are all dropped
+                self.state.invalidate_neighbours(ifindex)
+        elif entity_type in (
+            srv6_manager_pb2.IPTablesRule, srv6_manager_pb2.IPfdbentries
+        ):
+            # No route, rule or neighbor changed
+            pass
+        elif (
+            entity_type == srv6_manager_pb2.VRFDevice
+            and not any(
+                device.interfaces
+                for device in request.vrf_device_request.devices
+            )
+        ):
+            # Only the tables of the VRFs change (the interfaces enslaved
+            # to a VRF lose their routes and neighbors)
+            for device in request.vrf_device_request.devices:
+                self.state.invalidate_routes(device.table)
+            self.state.invalidate_rules()
+        else:
+            self.state.invalidate_routes()
+            self.state.invalidate_rules()
+            self.state.invalidate_neighbours()
+
+    def _dispatch(self, op, request, context):
 
         logging.info('============= operation: %s', op)
 
         entity_type = request.entity_type
+        # The objects about to be changed are dropped from the snapshot of
+        # the kernel state
+        if op != 'get':
+            self._invalidate_snapshot(request)
         # Handle operation
         # The operation to be executed depends on
         # the entity carried by the request message
@@ -1705,6 +2246,10 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
             request = request.iproute_request
             return self.HandleIPRouteRequest(op, request, context)
         
+        elif entity_type == getattr(srv6_manager_pb2, 'RouteTable', None):
+            request = request.route_table_request
+            return self.HandleRouteTableRequest(op, request, context)
+
         elif entity_type == srv6_manager_pb2.VRFDevice:
             request = request.vrf_device_request
             return self.HandleVRFDeviceRequest(op, request, context)
@@ -1737,6 +2282,10 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
             request = request.iptables_rule_request
             return self.HandleIptablesRuleRequest(op, request, context)
         
+        elif entity_type == getattr(srv6_manager_pb2, 'LoadBalancer', None):
+            request = request.load_balancer_request
+            return self.HandleLoadBalancerRequest(op, request, context)
+
         elif entity_type == srv6_manager_pb2.IPTablesRuleStatistics:
             request = request.iptables_statistics_request
             return self.HandleIPTablesStatisticsRequest(op, request, context)
@@ -1745,6 +2294,22 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
             request = request.tunnels_delay_request
             return self.HandleTunnelDelayStatsRequest(op, request, context)
 
+        elif entity_type == getattr(
+            srv6_manager_pb2, 'TunnelTemplate', None
+        ):
+            request = request.tunnel_template_request
+            return self.HandleTunnelTemplateRequest(op, request, context)
+
+        elif entity_type == getattr(
+            srv6_manager_pb2, 'TemplateTunnel', None
+        ):
+            request = request.template_tunnel_request
+            return self.HandleTemplateTunnelRequest(op, request, context)
+
+        elif entity_type == getattr(srv6_manager_pb2, 'TunnelStats', None):
+            request = request.tunnel_stats_request
+            return self.HandleTunnelStatsRequest(op, request, context)
+
         else:
             return srv6_manager_pb2.SRv6ManagerReply(
                 status=status_codes_pb2.STATUS_INVALID_GRPC_REQUEST
@@ -1752,22 +2317,473 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
 
     def Create(self, request, context):
         # Handle Create operation
-        return self.Execute('add', request, context)
+        return self._admit('add', request, context)
 
     def Get(self, request, context):
         # Handle Create operation
-        return self.Execute('get', request, context)
+        return self._admit('get', request, context)
 
     def Update(self, request, context):
         # Handle Remove operation
-        return self.Execute('change', request, context)
+        return self._admit('change', request, context)
 
     def Remove(self, request, context):
         # Handle Remove operation
-        return self.Execute('del', request, context)
+        return self._admit('del', request, context)
+
+    # Execute the request when the scheduler grants it an execution slot.
+    # The steps of the jobs are not scheduled: they are already limited by
+    # the job workers
+    def _admit(self, op, request, context):
+        metadata = dict(context.invocation_metadata())
+        client = _client(metadata, context)
+        try:
+            ticket = self.scheduler.acquire(
+                client,
+                request.entity_type,
+                cost=request_cost(request),
+                urgent=metadata.get('priority') == 'urgent',
+                is_active=context.is_active
+            )
+        except AdmissionRejectedError as e:
+            logging.warning('Request rejected: %s', e)
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+        if ticket is None:
+            context.abort(grpc.StatusCode.CANCELLED, 'Client went away')
+        try:
+            return self.Execute(op, request, context)
+        finally:
+            self.scheduler.release(ticket)
     
+    def GetStateVersion(self, request, context):
+        # Version of the state programmed by the controllers: the
+        # controller skips the resync if the journal id and the version
+        # match its own
+        response = srv6_manager_pb2.StateVersion()
+        if self.journal is not None:
+            response.journal_id = self.journal.id
+            response.version = self.journal.version
+        return response
+
+    # Replay the journal at startup; each operation is applied again and
+    # the kernel tells whether it was still in place
+    def replay_journal(self):
+        in_sync = {
+            'add': (status_codes_pb2.STATUS_SUCCESS,
+                    status_codes_pb2.STATUS_FILE_EXISTS),
+            'change': (status_codes_pb2.STATUS_SUCCESS,),
+            'del': (status_codes_pb2.STATUS_SUCCESS,
+                    status_codes_pb2.STATUS_NO_SUCH_PROCESS,
+                    status_codes_pb2.STATUS_NO_SUCH_DEVICE)
+        }
+        failed = 0
+        skipped = 0
+        entries = self.journal.entries()
+        for version, op, payload in entries:
+            # A record that cannot be replayed (e.g. its interface is gone)
+            # must not prevent the agent from starting
+            try:
+                request = srv6_manager_pb2.SRv6ManagerRequest.FromString(
+                    payload
+                )
+                # The operations already applied in the kernel (e.g. the
+                # agent restarted without a reboot) are not executed again;
+                # an invalid address is reported by the handler
+                try:
+                    applied = self._replay_in_sync(op, request)
+                except (OSError, ValueError):
+                    applied = False
+                if applied:
+                    skipped += 1
+                    continue
+                reply = self._dispatch(op, request, None)
+            except Exception:
+                failed += 1
+                logging.exception(
+                    'Cannot replay the operation %d (%s)', version, op
+                )
+                continue
+            if reply is None or reply.status not in in_sync[op]:
+                failed += 1
+                logging.warning(
+                    'Cannot replay the operation %d (%s): %s', version, op,
+                    reply.status if reply is not None else None
+                )
+        metrics.inc('journal_replay_failed', failed)
+        metrics.inc('journal_replay_skipped', skipped)
+        logging.info(
+            '*** Journal replayed: %d operations, %d already applied, '
+            '%d failed, version %d',
+            len(entries), skipped, failed, self.journal.version
+        )
+
+    # Return True if a journaled operation is already applied, according
+    # to the kernel state (the startup snapshot of the routes, rules and
+    # neighbors, the links for the VRFs). The objects changed by the
+    # replay are dropped from the snapshot, so the later operations on
+    # them are executed again; the operations on the other entities are
+    # always executed again
+    def _replay_in_sync(self, op, request):
+        entity_type = request.entity_type
+        if entity_type == srv6_manager_pb2.IPRoute:
+            routes = request.iproute_request.routes
+            if not routes:
+                return False
+            for route in routes:
+                # The snapshot holds only the unicast routes
+                if (
+                    route.destination == ''
+                    or route.type not in ('', 'unicast')
+                ):
+                    return False
+                table = route.table if route.table != -1 else RT_TABLE_MAIN
+                records = self.state.get_routes(table)
+                if records is None:
+                    return False
+                family, dst, dst_len = normalize_prefix(
+                    route.destination,
+                    route.dst_len if route.dst_len != -1 else None,
+                    route.family if route.family != -1 else None
+                )
+                record = records.get((family, table, dst, dst_len))
+                if op == 'del':
+                    if record is not None:
+                        return False
+                    continue
+                if record is None:
+                    return False
+                oif = (
+                    self.state.get_ifindex(route.out_interface)
+                    if route.out_interface != '' else None
+                )
+                gateway = (
+                    normalize_address(route.gateway)
+                    if route.gateway != '' else None
+                )
+                if op == 'change' and record.signature() != (
+                    oif, gateway, None
+                ):
+                    return False
+            return True
+        elif entity_type == srv6_manager_pb2.IPRule:
+            rules = self.state.get_rules()
+            if rules is None or not request.iprule_request.rules:
+                return False
+            for rule in request.iprule_request.rules:
+                match = any(
+                    self._rule_matches(rule, record) for record in rules
+                )
+                if match != (op == 'add'):
+                    return False
+            return True
+        elif entity_type == srv6_manager_pb2.IPNeigh:
+            neighs = request.ipneigh_request.neighs
+            if not neighs:
+                return False
+            for neigh in neighs:
+                ifindex = self.state.get_ifindex(neigh.device)
+                records = (
+                    self.state.get_neighbours(ifindex)
+                    if ifindex is not None else None
+                )
+                if records is None or neigh.proxy:
+                    return False
+                record = records.get(normalize_address(neigh.addr))
+                if op == 'del':
+                    if record is not None:
+                        return False
+                    continue
+                if record is None or (
+                    op == 'change'
+                    and (record.lladdr or '').lower()
+                    != neigh.lladdr.lower()
+                ):
+                    return False
+            return True
+        elif entity_type == srv6_manager_pb2.VRFDevice:
+            devices = request.vrf_device_request.devices
+            if op == 'change' or not devices:
+                return False
+            for device in devices:
+                vrfindex = self.state.get_ifindex(device.name)
+                if op == 'del':
+                    if vrfindex is not None:
+                        return False
+                    continue
+                link = (
+                    self.state.get_link(vrfindex)
+                    if vrfindex is not None else None
+                )
+                if link is None or link.kind != 'vrf':
+                    return False
+                slaves = self.state.get_slaves(vrfindex)
+                for interface in device.interfaces:
+                    if self.state.get_ifindex(interface) not in slaves:
+                        return False
+            return True
+        return False
+
+    # Return True if a rule record matches a rule of a request
+    @staticmethod
+    def _rule_matches(rule, record):
+        def prefix(addr, prefixlen):
+            if addr == '':
+                return (None, 0)
+            return normalize_prefix(
+                addr, prefixlen if prefixlen != -1 else None
+            )[1:]
+        return (
+            (rule.family == -1 or rule.family == record.family)
+            and (rule.table == -1 or rule.table == record.table)
+            and (rule.priority == -1 or rule.priority == record.priority)
+            and prefix(rule.source, rule.src_len)
+            == (record.src, record.src_len or 0)
+            and prefix(rule.destination, rule.dst_len)
+            == (record.dst, record.dst_len or 0)
+            and (rule.in_interface or None) == record.iifname
+            and (rule.out_interface or None) == record.oifname
+            and (rule.fwmark == -1 or rule.fwmark == record.fwmark)
+        )
+
+    # Abort the job RPCs if the installed proto does not define the jobs
+    def _check_jobs_supported(self, context):
+        if not _has_messages('JobRequest', 'JobQuery', 'JobStatus'):
+            context.abort(
+                grpc.StatusCode.UNIMPLEMENTED,
+                'Jobs not supported by the installed srv6_sdn_proto'
+            )
+
+    def SubmitJob(self, request, context):
+        # Queue the steps of the job and return the job id immediately;
+        # the steps are executed by the job workers, on behalf of the
+        # client submitting the job
+        logging.debug('config received:\n%s', request)
+        self._check_jobs_supported(context)
+        steps = []
+        for step in request.steps:
+            if step.operation not in JOB_OPERATIONS:
+                logging.error('Unrecognized operation: %s', step.operation)
+                context.abort(
+                    grpc.StatusCode.INVALID_ARGUMENT,
+                    'Unrecognized operation %s' % step.operation
+                )
+            steps.append((step.operation, step.request))
+        try:
+            job = self.jobs.submit(
+                steps, request.stop_on_error,
+                client=_client(dict(context.invocation_metadata()), context)
+            )
+        except JobQueueFullError as e:
+            logging.warning('Job rejected: %s', e)
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+        return self._job_status(job)
+
+    def GetJob(self, request, context):
+        # Poll the progress of a job; the replies of the steps are
+        # returned when the job is finished
+        self._check_jobs_supported(context)
+        try:
+            job = self.jobs.get(request.job_id)
+        except KeyError:
+            context.abort(grpc.StatusCode.NOT_FOUND, 'Unknown job')
+        return self._job_status(job, replies=job.is_finished())
+
+    def WatchJob(self, request, context):
+        # Stream the progress of a job until it is finished
+        self._check_jobs_supported(context)
+        try:
+            job = self.jobs.get(request.job_id)
+        except KeyError:
+            context.abort(grpc.StatusCode.NOT_FOUND, 'Unknown job')
+        done = None
+        while context.is_active():
+            finished = job.is_finished()
+            if job.done != done or finished:
+                done = job.done
+                yield self._job_status(job, replies=finished)
+            if finished:
+                break
+            job.wait(done, JOB_WATCH_TIMEOUT)
+        logging.info('Exiting from WatchJob()')
+
+    def _job_status(self, job, replies=False):
+        response = srv6_manager_pb2.JobStatus()
+        with job.condition:
+            response.job_id = job.id
+            response.state = job.state
+            response.done = job.done
+            response.total = job.total
+            for index, status, message in job.errors:
+                error = response.errors.add()
+                error.step = index
+                error.status = (
+                    status if status is not None
+                    else status_codes_pb2.STATUS_INTERNAL_ERROR
+                )
+                error.message = message
+            if replies:
+                response.replies.extend(
+                    reply if reply is not None
+                    else srv6_manager_pb2.SRv6ManagerReply(
+                        status=status_codes_pb2.STATUS_INTERNAL_ERROR
+                    )
+                    for reply in job.replies
+                )
+        return response
+
+    # Execute a step of a job and return (status, reply). The steps go
+    # through the admission scheduler as the requests of the client that
+    # submitted the job; a step rejected because the queues are full is
+    # submitted again, instead of failing the job
+    def _execute_step(self, op, request, client):
+        while True:
+            try:
+                ticket = self.scheduler.acquire(
+                    client, request.entity_type, cost=request_cost(request)
+                )
+                break
+            except AdmissionRejectedError:
+                time.sleep(JOB_ADMISSION_RETRY_INTERVAL)
+        try:
+            reply = self.Execute(op, request, None)
+        finally:
+            self.scheduler.release(ticket)
+        if reply is None:
+            # Some handlers do not reply to unrecognized operations
+            return status_codes_pb2.STATUS_INTERNAL_ERROR, None
+        return reply.status, reply
+
+    def Subscribe(self, request, context):
+        # Stream the requested counters every sample interval, sending
+        # only the counters changed since the previous sample
+        logging.debug('config received:\n%s', request)
+        if not _has_messages('TelemetrySubscription', 'TelemetryUpdate'):
+            context.abort(
+                grpc.StatusCode.UNIMPLEMENTED,
+                'Telemetry not supported by the installed srv6_sdn_proto'
+            )
+        try:
+            subscription = TelemetrySubscription(
+                dataplane=self.dataplane,
+                counter_sets=request.counter_sets,
+                interfaces=request.interfaces,
+                tunnels=[
+                    (tunnel.tunnel_interface_name, tunnel.tunnel_dst_endpoint)
+                    for tunnel in request.tunnels
+                ],
+                sample_interval=request.sample_interval
+            )
+        except ValueError as e:
+            logging.error('Invalid subscription: %s', e)
+            context.abort(
+                grpc.StatusCode.INVALID_ARGUMENT, 'Invalid subscription'
+            )
+        updates = subscription.updates(context.is_active, self.stop_event)
+        for timestamp, changed, removed in updates:
+            response = srv6_manager_pb2.TelemetryUpdate()
+            response.timestamp = timestamp
+            for (counter_set, name, counter), value in changed.items():
+                sample = response.samples.add()
+                sample.counter_set = counter_set
+                sample.name = name
+                sample.counter = counter
+                sample.value = str(value)
+            for counter_set, name, counter in removed:
+                sample = response.samples.add()
+                sample.counter_set = counter_set
+                sample.name = name
+                sample.counter = counter
+                sample.removed = True
+            yield response
+        logging.info('Exiting from Subscribe()')
+
+    # Return the index of an interface, from the kernel state if
+    # available; the resolved indexes are cached in ifindexes
+    def _get_ifindex(self, ifname, ifindexes):
+        if ifname not in ifindexes:
+            ifindex = self.state.get_ifindex(ifname)
+            if ifindex is None:
+                ifindex = next(
+                    iter(self.dataplane.link_lookup(ifname=ifname)), None
+                )
+            ifindexes[ifname] = ifindex
+        return ifindexes[ifname]
+
+    # Return the ifindexes of the slaves of a master device; the links
+    # are dumped only if the kernel state is not available
+    def _get_slaves(self, master):
+        if self.state.ready.is_set():
+            return self.state.get_slaves(master)
+        return set(
+            link.get('index') for link in self.dataplane.get_links()
+            if link.get_attr('IFLA_MASTER') == master
+        )
+
+    # Return the LinkRecords of the interfaces (all if ifindexes is empty)
+    # and, if required, their AddrRecords by ifindex; the kernel is dumped
+    # only if the kernel state is not available
+    def _get_interfaces(self, ifindexes, with_addrs=True):
+        addrs = {}
+        if self.state.ready.is_set():
+            links = self.state.get_links(ifindexes)
+            if with_addrs:
+                for link in links:
+                    addrs[link.index] = self.state.get_addrs(link.index)
+            return links, addrs
+        links = [
+            LinkRecord.from_msg(msg)
+            for msg in self.dataplane.get_links(*ifindexes)
+        ]
+        if with_addrs:
+            for msg in self.dataplane.get_addr():
+                addr = AddrRecord.from_msg(msg)
+                addrs.setdefault(addr.index, []).append(addr)
+        return links, addrs
+
+    # Create or delete the tunnels in batch and return a reply with the
+    # status of each tunnel; the request fails with the error of the
+    # first failed tunnel
+    def _tunnel_reply(self, op, tunnels):
+        results = self.dataplane.tunnel_batch(op, tunnels)
+        status = status_codes_pb2.STATUS_SUCCESS
+        response = srv6_manager_pb2.SRv6ManagerReply()
+        # The statuses of the tunnels are reported only if the installed
+        # proto has them
+        statuses = _has_field(response, 'tunnel_statuses')
+        for (ifname, _, _), (ifindex, e) in zip(tunnels, results):
+            if e is None:
+                tunnel_status = status_codes_pb2.STATUS_SUCCESS
+            elif isinstance(e, NetlinkError):
+                tunnel_status = self.parse_netlink_error(e)
+            else:
+                tunnel_status = status_codes_pb2.STATUS_NO_SUCH_DEVICE
+            if (
+                tunnel_status != status_codes_pb2.STATUS_SUCCESS
+                and status == status_codes_pb2.STATUS_SUCCESS
+            ):
+                status = tunnel_status
+            if not statuses:
+                continue
+            tunnel = response.tunnel_statuses.add()
+            tunnel.ifname = ifname
+            if ifindex is not None:
+                tunnel.index = ifindex
+            tunnel.status = tunnel_status
+        logging.debug('Send response: %s', status)
+        response.status = status
+        return response
+
+    # Return the name of an interface, or None
+    def _get_ifname(self, ifindex):
+        link = self.state.get_link(ifindex)
+        if link is not None:
+            return link.ifname
+        for msg in self.dataplane.get_links(ifindex):
+            return msg.get_attr('IFLA_IFNAME')
+        return None
+
     def _get_lowest_priority_rule(self):
-        rules = list(ip_route.get_rules())
+        rules = list(self.dataplane.get_rules())
         prio = None
         lowest_priority = None
         for rule in rules:
@@ -1779,197 +2795,267 @@ class SRv6Manager(srv6_manager_pb2_grpc.SRv6ManagerServicer):
         return lowest_priority
 
     def _get_iptables_rules_marked_with_out_interface_stats(self, _table, _chain):
-
-        # FIXME remove this code --------------------------------------------------------------
-        # table = iptc.Table(iptc.Table.MANGLE)
-        # chain = iptc.Chain(table, "PREROUTING")
-        
-        # stats = []
-        # table.refresh()
-        # for rule in chain.rules:
-        #     (packets, bytess) = rule.get_counters()
-        #     # matches = rule._get_matches()
-        #     rule_desc = rule.target.get_all_parameters()
-        #     # 
-        #     # stats.append((packets, bytess, rule_desc))
-        #     stats.append({
-        #         'packets': packets,
-        #         'bytes': bytess,
-        #         'rule_desc': rule_desc
-        #     })
-        # FIXME  -------------------------------------------------------------------------------END
-
-
-
         # FIXME the table and chain should be passed as parameters (from the request)
-        table = iptc.Table(iptc.Table.MANGLE)
-        chain = iptc.Chain(table, "FORWARD")
-        stats = []
-        table.refresh()
-        for rule in chain.rules:
-            
-            out_interface = rule.out_interface
-            if out_interface is not None and out_interface != 'any':
-                (packets, bytess) = rule.get_counters()
-                stats.append({
-                            'packets': packets,
-                            'bytes': bytess,
-                            'out_interface': out_interface
-                        })
-
-    
-
-        # FIXME -------------------------------------------------------------------------------START
-        # logging.info('\n\n\nstats : ')
-        # logging.info(stats['packets'])
-        # logging.info(stats['bytes'])
-        # logging.info(stats['mark_value'])
-        # FIXME -------------------------------------------------------------------------------END
-
-
-        return stats
-        
+        return self.dataplane.firewall_stats('mangle', 'FORWARD')
 
     def _get_tunnel_delay(self, tunnel_name, endpoint_destination):
         ECHO_NUMBER = 1
-        destination = endpoint_destination
-        out_interface = tunnel_name
-
-        ping_command = f"ping -c {ECHO_NUMBER} -I {out_interface} {destination}"  # Send 3 ICMP echo requests
-        # # FIXME remove this just logging ---------------------------------------------------------------------------
-        # logging.info("\n\n!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-        # logging.info(ping_command)
-        # logging.info("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!\n\n")
-
-        # # FIXME remove this just logging ---------------------------------------------------------------------------
-
-        ping_process = subprocess.Popen(ping_command, stdout=subprocess.PIPE, shell=True)
-        mean_delay = 0
-
-        for line in ping_process.stdout:
-            line = line.decode().strip()  # Convert bytes to string and remove leading/trailing spaces
-            if "time=" in line:
-                delay = re.search(r"time=(\d+\.?\d*)", line)
-                if delay:
-                    delay_value = float(delay.group(1))
-                    mean_delay += delay_value
+        return self.dataplane.probe_delay(
+            out_interface=tunnel_name,
+            destination=endpoint_destination,
+            count=ECHO_NUMBER
+        )
 
-        mean_delay = round((mean_delay/ECHO_NUMBER), 2)
-        
-        return mean_delay
 
 class NetworkEventsListener(
     network_events_listener_pb2_grpc.NetworkEventsListenerServicer
 ):
 
+    def __init__(self, low_memory=DEFAULT_LOW_MEMORY):
+        self.low_memory = low_memory
+
+    def _events(self):
+        if self.low_memory:
+            # Receive the events from a netlink socket bound to the
+            # link and address multicast groups, without mirroring the
+            # whole kernel state as IPDB does
+            with IPRoute() as ipr:
+                ipr.bind(groups=(
+                    rtnl.RTMGRP_LINK
+                    | rtnl.RTMGRP_IPV4_IFADDR
+                    | rtnl.RTMGRP_IPV6_IFADDR
+                ))
+                while True:
+                    for msg in ipr.get():
+                        yield msg
+        else:
+            # Inizialize IPDB
+            ipdb = IPDB()
+            # Process event queue
+            with ipdb.eventqueue() as evq:
+                for msg in evq:
+                    yield msg
+
     def Listen(self, request, context):
         logging.debug('config received:\n%s', request)
         # Send an ACK message to the client
         message = network_events_listener_pb2.NetworkEvent()
         message.type = EVENT_TYPES['CONNECTION_ESTABLISHED']
         yield message
-        # Inizialize IPDB
-        ipdb = IPDB()
-        # Process event queue
-        with ipdb.eventqueue() as evq:
-            # Process messages
-            for msg in evq:
-                if not context.is_active():
-                    logging.info('The client has been disconnected')
-                    break
-                ifindex = None
-                ifname = None
-                macaddr = None
-                ipaddr = None
-                prefixlen = None
-                state = None
-                if (
-                    msg.get_attr('IFLA_LINKINFO') is not None
-                    and (
-                        msg.get_attr('IFLA_LINKINFO')
-                        .get_attr('IFLA_INFO_KIND') == 'vrf'
-                    )
-                ):
-                    # Skip VRF devices
-                    continue
-                # Convert the message to a dictionary representation
-                nlmsg = eval(str(msg))
-                if nlmsg['event'] == 'RTM_NEWLINK':
-                    # New link message
-                    # Extract attributes from the Netlink message
-                    attrs = dict(nlmsg['attrs'])
-                    # Extract the state of the interface
-                    state = attrs.get('IFLA_OPERSTATE')
-                    if state == 'UP':
-                        type = 'INTF_UP'
-                    elif state == 'DOWN':
-                        type = 'INTF_DOWN'
-                    else:
-                        # Skip other events
-                        continue
-                    # Extract the interface index
-                    ifindex = nlmsg['index']
-                    # Extract the interface name
-                    ifname = attrs.get('IFLA_IFNAME')
-                    # Extract the MAC address of the interface
-                    macaddr = attrs.get('IFLA_ADDRESS')
-                elif nlmsg['event'] == 'RTM_DELLINK':
-                    # Deleted link message
-                    # Extract attributes from the Netlink message
-                    attrs = dict(nlmsg['attrs'])
-                    # Extract the state of the interface
-                    type = 'INTF_DEL'
-                    # Extract the index of the interface
-                    ifindex = nlmsg['index']
-                    # Extract the name of the interface
-                    ifname = attrs.get('IFLA_IFNAME')
-                    # Extract the MAC address of the interface
-                    macaddr = attrs.get('IFLA_ADDRESS')
-                elif nlmsg['event'] == 'RTM_NEWADDR':
-                    # Deleted link message
-                    # Extract attributes from the Netlink message
-                    attrs = dict(nlmsg['attrs'])
-                    # Extract the state of the interface
-                    type = 'NEW_ADDR'
-                    # Extract the index of the interface
-                    ifindex = nlmsg['index']
-                    # Extract the name of the interface
-                    ifname = attrs.get('IFLA_IFNAME')
-                    # Extract the IP address of the interface
-                    ipaddr = attrs.get('IFA_ADDRESS')
-                    # Extract the prefix length
-                    prefixlen = nlmsg['prefixlen']
-                elif nlmsg['event'] == 'RTM_DELADDR':
-                    # Deleted link message
-                    # Extract attributes from the Netlink message
-                    attrs = dict(nlmsg['attrs'])
-                    # Extract the state of the interface
-                    type = 'DEL_ADDR'
-                    # Extract the index of the interface
-                    ifindex = nlmsg['index']
-                    # Extract the IP address of the interface
-                    ipaddr = attrs.get('IFA_ADDRESS')
-                    # Extract the prefix length
-                    prefixlen = nlmsg['prefixlen']
+        # Process messages
+        for msg in self._events():
+            if not context.is_active():
+                logging.info('The client has been disconnected')
+                break
+            ifindex = None
+            ifname = None
+            macaddr = None
+            ipaddr = None
+            prefixlen = None
+            state = None
+            if (
+                msg.get_attr('IFLA_LINKINFO') is not None
+                and (
+                    msg.get_attr('IFLA_LINKINFO')
+                    .get_attr('IFLA_INFO_KIND') == 'vrf'
+                )
+            ):
+                # Skip VRF devices
+                continue
+            # Convert the message to a dictionary representation
+            nlmsg = eval(str(msg))
+            if nlmsg['event'] == 'RTM_NEWLINK':
+                # New link message
+                # Extract attributes from the Netlink message
+                attrs = dict(nlmsg['attrs'])
+                # Extract the state of the interface
+                state = attrs.get('IFLA_OPERSTATE')
+                if state == 'UP':
+                    type = 'INTF_UP'
+                elif state == 'DOWN':
+                    type = 'INTF_DOWN'
                 else:
                     # Skip other events
                     continue
-                # Create the response
-                response = network_events_listener_pb2.NetworkEvent()
-                response.interface.index = int(ifindex)
-                if ifname is not None:
-                    response.interface.name = ifname
-                if macaddr is not None:
-                    response.interface.macaddr = macaddr
-                if ipaddr is not None:
-                    response.interface.ipaddr = '%s/%s' % (ipaddr, prefixlen)
-                response.type = EVENT_TYPES[type]
-                # and send the response to the client
-                logging.debug('Send response:\n%s', response)
-                yield response
+                # Extract the interface index
+                ifindex = nlmsg['index']
+                # Extract the interface name
+                ifname = attrs.get('IFLA_IFNAME')
+                # Extract the MAC address of the interface
+                macaddr = attrs.get('IFLA_ADDRESS')
+            elif nlmsg['event'] == 'RTM_DELLINK':
+                # Deleted link message
+                # Extract attributes from the Netlink message
+                attrs = dict(nlmsg['attrs'])
+                # Extract the state of the interface
+                type = 'INTF_DEL'
+                # Extract the index of the interface
+                ifindex = nlmsg['index']
+                # Extract the name of the interface
+                ifname = attrs.get('IFLA_IFNAME')
+                # Extract the MAC address of the interface
+                macaddr = attrs.get('IFLA_ADDRESS')
+            elif nlmsg['event'] == 'RTM_NEWADDR':
+                # Deleted link message
+                # Extract attributes from the Netlink message
+                attrs = dict(nlmsg['attrs'])
+                # Extract the state of the interface
+                type = 'NEW_ADDR'
+                # Extract the index of the interface
+                ifindex = nlmsg['index']
+                # Extract the name of the interface
+                ifname = attrs.get('IFLA_IFNAME')
+                # Extract the IP address of the interface
+                ipaddr = attrs.get('IFA_ADDRESS')
+                # Extract the prefix length
+                prefixlen = nlmsg['prefixlen']
+            elif nlmsg['event'] == 'RTM_DELADDR':
+                # Deleted link message
+                # Extract attributes from the Netlink message
+                attrs = dict(nlmsg['attrs'])
+                # Extract the state of the interface
+                type = 'DEL_ADDR'
+                # Extract the index of the interface
+                ifindex = nlmsg['index']
+                # Extract the IP address of the interface
+                ipaddr = attrs.get('IFA_ADDRESS')
+                # Extract the prefix length
+                prefixlen = nlmsg['prefixlen']
+            else:
+                # Skip other events
+                continue
+            # Create the response
+            response = network_events_listener_pb2.NetworkEvent()
+            response.interface.index = int(ifindex)
+            if ifname is not None:
+                response.interface.name = ifname
+            if macaddr is not None:
+                response.interface.macaddr = macaddr
+            if ipaddr is not None:
+                response.interface.ipaddr = '%s/%s' % (ipaddr, prefixlen)
+            response.type = EVENT_TYPES[type]
+            # and send the response to the client
+            logging.debug('Send response:\n%s', response)
+            yield response
         logging.info('Exiting from Listen()')
 
 
+# Return the host of a gRPC peer (e.g. 'ipv6:[::1]:40000' -> '::1'), so
+# that all the connections of a controller share the same queues
+def _peer_host(peer):
+    family, _, address = peer.partition(':')
+    if family in ('ipv4', 'ipv6'):
+        address = address.rpartition(':')[0].strip('[]')
+    return address
+
+
+# Return the client of a request (the client-id metadata, or the address
+# of the controller), used by the admission scheduler
+def _client(metadata, context):
+    return metadata.get('client-id') or _peer_host(context.peer())
+
+
+# Return True if a proto message has a field: the reply fields added after
+# the release of srv6_sdn_proto in use (e.g. the per-entry statuses) are
+# filled only if the installed proto has them
+def _has_field(message, field):
+    return field in message.DESCRIPTOR.fields_by_name
+
+
+# Return True if the installed proto defines the messages of an RPC added
+# after the release of srv6_sdn_proto in use (see the proto extensions in
+# the README): without them the RPC fails with UNIMPLEMENTED
+def _has_messages(*names):
+    return all(hasattr(srv6_manager_pb2, name) for name in names)
+
+
+# Objects touched by a request, as (entity type, ids): the routes, the
+# VRFs and the neighbors are identified, the objects of the other entities
+# are unknown (None)
+def request_object_keys(request):
+    entity_type = request.entity_type
+    ids = None
+    if entity_type == srv6_manager_pb2.IPRoute:
+        routes = request.iproute_request.routes
+        # A route with no destination flushes the routes of the table
+        if all(route.destination for route in routes):
+            ids = set((route.table, route.destination) for route in routes)
+    elif entity_type == srv6_manager_pb2.VRFDevice:
+        ids = set(
+            device.name for device in request.vrf_device_request.devices
+        )
+    elif entity_type == srv6_manager_pb2.IPNeigh:
+        ids = set(
+            (neigh.device, neigh.addr)
+            for neigh in request.ipneigh_request.neighs
+        )
+    return entity_type, ids
+
+
+# Objects touched by a journaled request (see request_object_keys)
+def journal_object_keys(payload):
+    return request_object_keys(
+        srv6_manager_pb2.SRv6ManagerRequest.FromString(payload)
+    )
+
+
+# Keep the link and address indexes of the kernel state up to date with
+# the notifications (interfaces added, removed, enslaved to a VRF,
+# addresses assigned, ...); the route and rule notifications drop the
+# changed objects from the startup snapshot
+def watch_links(state, dataplane, stop_event=None):
+    ipr = IPRoute()
+    ipr.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, LINK_MONITOR_RCVBUF)
+    # Bind before the warm-up: the notifications received in the meantime
+    # are replayed in order after the dump
+    ipr.bind(groups=(
+        rtnl.RTMGRP_LINK
+        | rtnl.RTMGRP_IPV4_IFADDR
+        | rtnl.RTMGRP_IPV6_IFADDR
+        | rtnl.RTMGRP_IPV4_ROUTE
+        | rtnl.RTMGRP_IPV6_ROUTE
+        | rtnl.RTMGRP_IPV4_RULE
+        | rtnl.RTMGRP_IPV6_RULE
+    ))
+
+    def run():
+        state.ready.wait()
+        while stop_event is None or not stop_event.is_set():
+            try:
+                msgs = ipr.get()
+            except Exception as e:
+                # NetlinkError or OSError
+                code = getattr(e, 'code', None) or getattr(e, 'errno', None)
+                if code != NETLINK_ERROR_NO_BUFFER_SPACE:
+                    logger.exception('Cannot receive the link notifications')
+                    time.sleep(LINK_MONITOR_RETRY_INTERVAL)
+                    continue
+                # Some notifications were lost: the indexes are rebuilt
+                # from a new dump
+                logger.warning(
+                    'Link notifications lost, warming up the kernel state'
+                )
+                metrics.inc('link_monitor_overruns')
+                try:
+                    state.warm_up(dataplane)
+                except Exception:
+                    logger.exception('Cannot warm up the kernel state')
+                continue
+            for msg in msgs:
+                try:
+                    state.handle_event(msg)
+                except Exception:
+                    logger.exception(
+                        'Cannot handle the notification %s', msg.get('event')
+                    )
+        ipr.close()
+
+    thread = threading.Thread(target=run, name='link-monitor')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
 # Start gRPC server
 def start_server(
     grpc_ip=DEFAULT_GRPC_IP,
@@ -1981,38 +3067,69 @@ def start_server(
     certificate=DEFAULT_CERTIFICATE,
     key=DEFAULT_KEY,
     stop_event=None,
-    reboot_required=None
+    reboot_required=None,
+    dataplane_backend=DEFAULT_DATAPLANE_BACKEND,
+    enable_stamp_support=DEFAULT_ENABLE_STAMP_SUPPORT,
+    low_memory=DEFAULT_LOW_MEMORY,
+    execution_slots=DEFAULT_EXECUTION_SLOTS,
+    client_weights=None,
+    coalesce_window=DEFAULT_COALESCE_WINDOW,
+    journal_dir=None
 ):
-    # Configure gRPC server listener and ip route
-    global grpc_server, ip_route, ipdb
+    # Configure gRPC server listener and dataplane backend
+    global grpc_server, dataplane, ipdb
+    # Measure the duration of the startup phases
+    timer = StartupTimer()
+    # Setup the dataplane backend
+    if dataplane is not None:
+        logging.error('Dataplane backend is already setup')
+    else:
+        dataplane = get_backend(dataplane_backend)
+        # Coalesce the route writes of concurrent requests
+        if coalesce_window:
+            dataplane = CoalescingBackend(dataplane, coalesce_window)
+    timer.mark('dataplane backend')
     # Setup gRPC server
+    srv6_manager = None
     if grpc_server is not None:
         logging.error('gRPC Server is already up and running')
     else:
-        # Create the server and add the handlers
-        grpc_server = grpc.server(futures.ThreadPoolExecutor())
+        # Create the server and add the handlers. The requests waiting for
+        # an execution slot hold a thread, so the pool must fit all the
+        # requests the scheduler can queue; the RPCs beyond are rejected by
+        # gRPC instead of waiting for a thread
+        scheduler = AdmissionScheduler(execution_slots, client_weights)
+        workers = scheduler.workers()
+        grpc_server = grpc.server(
+            futures.ThreadPoolExecutor(max_workers=workers),
+            maximum_concurrent_rpcs=workers
+        )
         # Add the STAMP handlers
-        if ENABLE_STAMP_SUPPORT:
+        if enable_stamp_support:
             stamp_sender_module.run_grpc_server(
                 server=grpc_server, stop_event=stop_event
             )
             stamp_reflector_module.run_grpc_server(
                 server=grpc_server, stop_event=stop_event
             )
+            timer.mark('STAMP support')
+        srv6_manager = SRv6Manager(
+            quagga_password,
+            zebra_port,
+            ospf6d_port,
+            stop_event,
+            reboot_required,
+            dataplane,
+            kernel_state,
+            scheduler
+        )
         srv6_manager_pb2_grpc.add_SRv6ManagerServicer_to_server(
-            SRv6Manager(
-                quagga_password,
-                zebra_port,
-                ospf6d_port,
-                stop_event,
-                reboot_required
-            ),
-            grpc_server
+            srv6_manager, grpc_server
         )
         (
             network_events_listener_pb2_grpc
             .add_NetworkEventsListenerServicer_to_server(
-                NetworkEventsListener(), grpc_server
+                NetworkEventsListener(low_memory), grpc_server
             )
         )
         # If secure we need to create a secure endpoint
@@ -2033,33 +3150,74 @@ def start_server(
         else:
             # Create an insecure endpoint
             grpc_server.add_insecure_port('[%s]:%s' % (grpc_ip, grpc_port))
-    # Setup ip route
-    if ip_route is not None:
-        logging.error('IP Route is already setup')
-    else:
-        ip_route = IPRoute()
+        timer.mark('gRPC server setup')
     # Setup ipdb
-    if ipdb is not None:
+    if low_memory:
+        logging.info('*** Low memory mode enabled, IPDB disabled')
+    elif ipdb is not None:
         logging.error('IPDB is already setup')
     else:
         ipdb = IPDB()
-    # Resolve the interfaces
-    for link in ip_route.get_links():
-        if link.get_attr('IFLA_IFNAME') != 'lo':
-            interfaces.append(link.get_attr('IFLA_IFNAME'))
-    for interface in interfaces:
-        idxs[interface] = ip_route.link_lookup(ifname=interface)[0]
+        timer.mark('IPDB')
+    # Warm-up: dump the kernel state and build the indexes, with a
+    # snapshot of the routes, rules and neighbors; the server starts
+    # accepting requests only when the warm-up is complete
+    watch_links(kernel_state, dataplane, stop_event)
+    kernel_state.warm_up(dataplane, snapshot=True)
+    metrics.set_gauge(
+        'kernel_state_links', lambda: len(kernel_state.links)
+    )
+    timer.mark('kernel state warm-up')
+    # Resolve the interfaces (used by the handlers, also when the journal
+    # is replayed)
+    for ifindex, link in sorted(kernel_state.links.items()):
+        if link.ifname != 'lo':
+            interfaces.append(link.ifname)
+            idxs[link.ifname] = ifindex
+    # Reprogram the operations applied before the restart
+    journal = None
+    if journal_dir is not None and srv6_manager is not None:
+        journal = Journal(journal_dir, object_keys=journal_object_keys)
+        journal.open()
+        srv6_manager.journal = journal
+        srv6_manager.replay_journal()
+        timer.mark('journal replay')
+    # The snapshot of the rules and neighbors is used only by the replay;
+    # the routes are kept for the first resync of the route tables, but
+    # not in low memory mode
+    kernel_state.release_snapshot(routes=low_memory)
     # Start the loop for gRPC
     logging.info('*** Listening gRPC')
     grpc_server.start()
+    timer.mark('gRPC server start')
+    timer.report()
+    metrics.log_report()
     stop_event.wait()
     logging.info('*** Terminating gRPC server')
     grpc_server.stop(10).wait()
+    if journal is not None:
+        journal.close()
     logging.info('*** Server terminated')
+    metrics.log_report()
     # while True:
     #    time.sleep(5)
 
 
+# Parse a CLIENT=WEIGHT argument
+def client_weight(arg):
+    client, _, weight = arg.rpartition('=')
+    try:
+        weight = float(weight)
+    except ValueError:
+        weight = None
+    if not client or weight is None or not weight > 0:
+        raise ArgumentTypeError(
+            'invalid client weight %r: expected CLIENT=WEIGHT with a '
+            'positive weight' % arg
+        )
+    return client, weight
+
+
 # Parse options
 def parse_arguments():
     # Get parser
@@ -2128,6 +3286,62 @@ def parse_arguments():
         default=DEFAULT_KEY,
         help='Server key file'
     )
+    parser.add_argument(
+        '-b',
+        '--dataplane-backend',
+        dest='dataplane_backend',
+        action='store',
+        default=DEFAULT_DATAPLANE_BACKEND,
+        help='Backend used to program the dataplane'
+    )
+    parser.add_argument(
+        '--disable-stamp',
+        dest='enable_stamp_support',
+        action='store_false',
+        default=DEFAULT_ENABLE_STAMP_SUPPORT,
+        help='Disable STAMP support'
+    )
+    parser.add_argument(
+        '--low-memory',
+        dest='low_memory',
+        action='store_true',
+        default=DEFAULT_LOW_MEMORY,
+        help='Enable low memory mode'
+    )
+    parser.add_argument(
+        '--execution-slots',
+        dest='execution_slots',
+        action='store',
+        type=int,
+        default=DEFAULT_EXECUTION_SLOTS,
+        help='Number of requests executed concurrently'
+    )
+    parser.add_argument(
+        '--client-weight',
+        dest='client_weights',
+        action='append',
+        type=client_weight,
+        default=[],
+        help='Scheduling weight of a client, as CLIENT=WEIGHT (the client '
+             'is the client-id metadata or the address of the controller)'
+    )
+    parser.add_argument(
+        '--coalesce-window',
+        dest='coalesce_window',
+        action='store',
+        type=float,
+        default=DEFAULT_COALESCE_WINDOW,
+        help='Window (in ms) during which the route writes are coalesced '
+             '(0 to disable the coalescing)'
+    )
+    parser.add_argument(
+        '--journal-dir',
+        dest='journal_dir',
+        action='store',
+        default=None,
+        help='Directory of the journal of the applied operations, '
+             'replayed when the server is restarted'
+    )
     # Parse input parameters
     args = parser.parse_args()
     # Return the arguments
@@ -2155,6 +3369,19 @@ if __name__ == '__main__':
     certificate = args.server_cert
     # Server key
     key = args.server_key
+    # Dataplane backend
+    dataplane_backend = args.dataplane_backend
+    # STAMP support
+    enable_stamp_support = args.enable_stamp_support
+    # Low memory mode
+    low_memory = args.low_memory
+    # Journal
+    journal_dir = args.journal_dir
+    # Route writes coalescing
+    coalesce_window = args.coalesce_window
+    # Admission scheduler
+    execution_slots = args.execution_slots
+    client_weights = dict(args.client_weights)
     # Setup properly the logger
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
@@ -2174,5 +3401,12 @@ if __name__ == '__main__':
         ospf6d_port,
         secure,
         certificate,
-        key
+        key,
+        dataplane_backend=dataplane_backend,
+        enable_stamp_support=enable_stamp_support,
+        low_memory=low_memory,
+        execution_slots=execution_slots,
+        client_weights=client_weights,
+        coalesce_window=coalesce_window,
+        journal_dir=journal_dir
     )
@@ -0,0 +1,528 @@
+#!/usr/bin/python
+
+# Cached kernel state for the SRv6 gRPC Southbound
+#
+# Kernel objects (links, addresses) are cached as compact __slots__
+# records instead of full netlink messages, in order to keep the resident
+# memory low on small CPE devices; the routes dumped by the handlers and
+# the startup snapshot of the routes, rules and neighbors are compared as
+# records as well.
+#
+# Memory budget: run this module to measure the memory needed to cache
+# 10k routes and 1k interfaces (with 2 addresses each)
+#
+#     > python -m srv6_sdn_data_plane.southbound.grpc.sb_grpc_state
+#
+
+from __future__ import absolute_import, division, print_function
+
+# General imports
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from socket import AF_INET, AF_INET6, AF_UNSPEC, inet_ntop, inet_pton
+
+# Memory budget (in bytes) for 10k routes and 1k interfaces
+MEMORY_BUDGET = 5 * 1024 * 1024
+
+# Routes managed by the routing daemons and by the southbound (the routes
+# added by the kernel, e.g. local and broadcast routes, are never replaced)
+RTPROT_KERNEL = 2
+RTN_UNICAST = 1
+# Table of the routes with no table
+RT_TABLE_MAIN = 254
+
+
+class LinkRecord(object):
+
+    __slots__ = ('index', 'ifname', 'kind', 'master', 'state', 'address')
+
+    def __init__(self, index, ifname, kind=None, master=None, state=None,
+                 address=None):
+        self.index = index
+        self.ifname = ifname
+        self.kind = kind
+        self.master = master
+        self.state = state
+        self.address = address
+
+    @classmethod
+    def from_msg(cls, msg):
+        linkinfo = msg.get_attr('IFLA_LINKINFO')
+        return cls(
+            index=msg.get('index'),
+            ifname=msg.get_attr('IFLA_IFNAME'),
+            kind=(
+                linkinfo.get_attr('IFLA_INFO_KIND')
+                if linkinfo is not None else None
+            ),
+            master=msg.get_attr('IFLA_MASTER'),
+            state=msg.get_attr('IFLA_OPERSTATE'),
+            address=msg.get_attr('IFLA_ADDRESS')
+        )
+
+
+class AddrRecord(object):
+
+    __slots__ = ('index', 'family', 'address', 'prefixlen')
+
+    def __init__(self, index, family, address, prefixlen):
+        self.index = index
+        self.family = family
+        self.address = address
+        self.prefixlen = prefixlen
+
+    @classmethod
+    def from_msg(cls, msg):
+        return cls(
+            index=msg.get('index'),
+            family=msg.get('family'),
+            address=msg.get_attr('IFA_ADDRESS'),
+            prefixlen=msg.get('prefixlen')
+        )
+
+    def __str__(self):
+        return '%s/%s' % (self.address, self.prefixlen)
+
+
+class RouteRecord(object):
+
+    __slots__ = ('family', 'table', 'dst', 'dst_len', 'oif', 'gateway',
+                 'priority', 'proto', 'encap')
+
+    def __init__(self, family, table, dst, dst_len, oif=None, gateway=None,
+                 priority=None, proto=None, encap=None):
+        self.family = family
+        self.table = table
+        self.dst = dst
+        self.dst_len = dst_len
+        self.oif = oif
+        self.gateway = gateway
+        self.priority = priority
+        self.proto = proto
+        self.encap = encap
+
+    @classmethod
+    def from_msg(cls, msg):
+        table = msg.get_attr('RTA_TABLE')
+        return cls(
+            family=msg.get('family'),
+            table=table if table is not None else msg.get('table'),
+            dst=msg.get_attr('RTA_DST'),
+            dst_len=msg.get('dst_len'),
+            oif=msg.get_attr('RTA_OIF'),
+            gateway=msg.get_attr('RTA_GATEWAY'),
+            priority=msg.get_attr('RTA_PRIORITY'),
+            proto=msg.get('proto'),
+            encap=msg.get_attr('RTA_ENCAP')
+        )
+
+    def key(self):
+        return (self.family, self.table, self.dst, self.dst_len)
+
+    def signature(self):
+        return (self.oif, self.gateway, seg6_signature(self.encap))
+
+
+class RuleRecord(object):
+
+    __slots__ = ('family', 'table', 'priority', 'src', 'src_len', 'dst',
+                 'dst_len', 'iifname', 'oifname', 'fwmark')
+
+    def __init__(self, family, table, priority, src=None, src_len=0,
+                 dst=None, dst_len=0, iifname=None, oifname=None,
+                 fwmark=None):
+        self.family = family
+        self.table = table
+        self.priority = priority
+        self.src = src
+        self.src_len = src_len
+        self.dst = dst
+        self.dst_len = dst_len
+        self.iifname = iifname
+        self.oifname = oifname
+        self.fwmark = fwmark
+
+    @classmethod
+    def from_msg(cls, msg):
+        table = msg.get_attr('FRA_TABLE')
+        return cls(
+            family=msg.get('family'),
+            table=table if table is not None else msg.get('table'),
+            priority=msg.get_attr('FRA_PRIORITY'),
+            src=msg.get_attr('FRA_SRC'),
+            src_len=msg.get('src_len'),
+            dst=msg.get_attr('FRA_DST'),
+            dst_len=msg.get('dst_len'),
+            iifname=msg.get_attr('FRA_IIFNAME'),
+            oifname=msg.get_attr('FRA_OIFNAME'),
+            fwmark=msg.get_attr('FRA_FWMARK')
+        )
+
+
+class NeighRecord(object):
+
+    __slots__ = ('ifindex', 'family', 'dst', 'lladdr', 'state')
+
+    def __init__(self, ifindex, family, dst, lladdr=None, state=None):
+        self.ifindex = ifindex
+        self.family = family
+        self.dst = dst
+        self.lladdr = lladdr
+        self.state = state
+
+    @classmethod
+    def from_msg(cls, msg):
+        return cls(
+            ifindex=msg.get('ifindex'),
+            family=msg.get('family'),
+            dst=msg.get_attr('NDA_DST'),
+            lladdr=msg.get_attr('NDA_LLADDR'),
+            state=msg.get('state')
+        )
+
+
+# Return the (mode, segments) of a seg6 encap, or None
+def seg6_signature(encap):
+    if encap is None:
+        return None
+    srh = encap.get_attr('SEG6_IPTUNNEL_SRH')
+    if srh is None:
+        return None
+    segs = srh.get('segs', [])
+    if srh.get('mode') == 'inline':
+        # The first segment of the inline SRH is added by the encoder
+        segs = segs[1:]
+    return (srh.get('mode'), tuple(segs))
+
+
+# Return (family, prefix, prefix length) of a destination, with the
+# prefix in the canonical form used by the kernel dumps
+def normalize_prefix(dst, dst_len=None, family=None):
+    if dst is None or dst == 'default':
+        return (family or AF_INET, None, 0)
+    dst = dst.split('/')
+    if family is None:
+        family = AF_INET6 if ':' in dst[0] else AF_INET
+    if len(dst) == 2:
+        dst_len = int(dst[1])
+    elif dst_len is None:
+        dst_len = 128 if family == AF_INET6 else 32
+    return (family, inet_ntop(family, inet_pton(family, dst[0])), dst_len)
+
+
+# Return the canonical form of an IPv4 or IPv6 address, as reported by the
+# kernel (e.g. fc00:0::1 becomes fc00::1); raise ValueError if the address
+# is not valid
+def normalize_address(addr):
+    family = AF_INET6 if ':' in addr else AF_INET
+    try:
+        return inet_ntop(family, inet_pton(family, addr))
+    except (OSError, ValueError):
+        raise ValueError('Invalid address %s' % addr)
+
+
+# Compute the changes required to turn the current routes of a table into
+# the desired ones. Both arguments map the route keys to the signatures.
+# Return the keys to create, to replace and to delete
+def diff_routes(current, desired):
+    create = []
+    replace = []
+    for key, signature in desired.items():
+        if key not in current:
+            create.append(key)
+        elif current[key] != signature:
+            replace.append(key)
+    delete = [key for key in current if key not in desired]
+    return create, replace, delete
+
+
+class KernelState(object):
+    '''Indexes of the kernel objects
+
+    The state is populated by warm_up(), which performs a single dump of
+    the links and one of the addresses and builds all the indexes in one
+    pass. The ready event is set only when the warm-up is complete. The
+    indexes (including the master -> slaves index) are then kept up to
+    date by handle_event() with the link and address notifications.
+
+    At startup, the warm-up also takes a snapshot of the routes (of all
+    the tables), rules and neighbors, with one dump each, used by the
+    journal replay and by the first resync of the route tables instead
+    of a dump per request. The snapshot is never updated: the objects
+    are dropped from it before being changed by the southbound, and the
+    route tables when a route notification reports a change, so that it
+    never holds stale objects; the handlers dump the objects missing
+    from the snapshot.
+    '''
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.ready = threading.Event()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            # ifindex -> LinkRecord
+            self.links = {}
+            # ifname -> ifindex
+            self.ifindexes = {}
+            # master ifindex -> set of slave ifindexes
+            self.slaves = {}
+            # ifindex -> list of AddrRecord
+            self.addrs = {}
+            # Startup snapshot: table -> {route key -> RouteRecord} (the
+            # unicast routes not added by the kernel) and the tables
+            # changed since, list of RuleRecord, ifindex -> {dst ->
+            # NeighRecord} (an ifindex is dropped when its neighbors are
+            # changed); None if there is no snapshot or it is released
+            self.routes = None
+            self.stale_tables = set()
+            self.rules = None
+            self.neighbours = None
+
+    def warm_up(self, dataplane, snapshot=False):
+        start = time.time()
+        self.ready.clear()
+        # One dump per object type
+        links = dataplane.get_links()
+        addrs = dataplane.get_addr()
+        if snapshot:
+            routes = dataplane.get_routes(family=AF_UNSPEC)
+            rules = dataplane.get_rules(family=AF_UNSPEC)
+            neighbours = dataplane.get_neighbours(family=AF_UNSPEC)
+        # Build the indexes
+        with self.lock:
+            self.clear()
+            for msg in links:
+                self.add_link(LinkRecord.from_msg(msg))
+            for msg in addrs:
+                addr = AddrRecord.from_msg(msg)
+                self.addrs.setdefault(addr.index, []).append(addr)
+            if snapshot:
+                self.routes = {}
+                for msg in routes:
+                    route = RouteRecord.from_msg(msg)
+                    if (
+                        route.proto == RTPROT_KERNEL
+                        or msg.get('type') != RTN_UNICAST
+                    ):
+                        continue
+                    self.routes.setdefault(route.table, {})[route.key()] = (
+                        route
+                    )
+                self.rules = [RuleRecord.from_msg(msg) for msg in rules]
+                self.neighbours = dict((index, {}) for index in self.links)
+                for msg in neighbours:
+                    neigh = NeighRecord.from_msg(msg)
+                    self.neighbours.setdefault(neigh.ifindex, {})[
+                        neigh.dst
+                    ] = neigh
+        logging.info(
+            '*** Kernel state warm-up completed in %.1f ms: %d links, '
+            '%d addresses, %d routes, %d rules, %d neighbors',
+            (time.time() - start) * 1000, len(self.links),
+            sum(len(addrs) for addrs in self.addrs.values()),
+            sum(len(routes) for routes in (self.routes or {}).values()),
+            len(self.rules or ()),
+            sum(len(neighs) for neighs in (self.neighbours or {}).values())
+        )
+        self.ready.set()
+
+    def add_link(self, link):
+        with self.lock:
+            old = self.links.get(link.index)
+            if old is not None:
+                self.del_link(old.index)
+            self.links[link.index] = link
+            self.ifindexes[link.ifname] = link.index
+            if link.master:
+                self.slaves.setdefault(link.master, set()).add(link.index)
+
+    def del_link(self, ifindex):
+        with self.lock:
+            link = self.links.pop(ifindex, None)
+            if link is None:
+                return
+            if self.ifindexes.get(link.ifname) == ifindex:
+                del self.ifindexes[link.ifname]
+            if link.master in self.slaves:
+                self.slaves[link.master].discard(ifindex)
+                if not self.slaves[link.master]:
+                    del self.slaves[link.master]
+
+    def set_master(self, ifindex, master):
+        with self.lock:
+            link = self.links.get(ifindex)
+            if link is None:
+                return
+            if link.master in self.slaves:
+                self.slaves[link.master].discard(ifindex)
+                if not self.slaves[link.master]:
+                    del self.slaves[link.master]
+            link.master = master or None
+            if link.master:
+                self.slaves.setdefault(link.master, set()).add(ifindex)
+
+    # Update the link indexes from a RTM_NEWLINK/RTM_DELLINK notification
+    def handle_link_event(self, msg):
+        event = msg.get('event')
+        if event == 'RTM_NEWLINK':
+            self.add_link(LinkRecord.from_msg(msg))
+        elif event == 'RTM_DELLINK':
+            self.del_link(msg.get('index'))
+            with self.lock:
+                self.addrs.pop(msg.get('index'), None)
+
+    # Update the address index from a RTM_NEWADDR/RTM_DELADDR notification
+    def handle_addr_event(self, msg):
+        event = msg.get('event')
+        addr = AddrRecord.from_msg(msg)
+        with self.lock:
+            addrs = [
+                other for other in self.addrs.get(addr.index, [])
+                if (other.address, other.prefixlen)
+                != (addr.address, addr.prefixlen)
+            ]
+            if event == 'RTM_NEWADDR':
+                addrs.append(addr)
+            if addrs:
+                self.addrs[addr.index] = addrs
+            else:
+                self.addrs.pop(addr.index, None)
+
+    # Dispatch a link or address notification; the route and rule
+    # notifications drop the changed objects from the snapshot
+    def handle_event(self, msg):
+        if msg.get('event') in ('RTM_NEWLINK', 'RTM_DELLINK'):
+            self.handle_link_event(msg)
+        elif msg.get('event') in ('RTM_NEWADDR', 'RTM_DELADDR'):
+            self.handle_addr_event(msg)
+        elif msg.get('event') in ('RTM_NEWROUTE', 'RTM_DELROUTE'):
+            self.invalidate_routes(RouteRecord.from_msg(msg).table)
+        elif msg.get('event') in ('RTM_NEWRULE', 'RTM_DELRULE'):
+            self.invalidate_rules()
+
+    # Return the snapshot of the routes of a table (route key ->
+    # RouteRecord), or None if the table changed since the snapshot
+    def get_routes(self, table):
+        with self.lock:
+            if self.routes is None or table in self.stale_tables:
+                return None
+            return dict(self.routes.get(table, ()))
+
+    # Return the snapshot of the routes of a table and drop it, since the
+    # caller is about to change the table
+    def take_routes(self, table):
+        with self.lock:
+            routes = self.get_routes(table)
+            self.invalidate_routes(table)
+            return routes
+
+    # Drop a table (all the tables if None) from the snapshot
+    def invalidate_routes(self, table=None):
+        with self.lock:
+            if table is None:
+                self.routes = None
+            elif self.routes is not None:
+                self.routes.pop(table, None)
+                self.stale_tables.add(table)
+
+    # Return the snapshot of the rules, or None
+    def get_rules(self):
+        with self.lock:
+            return list(self.rules) if self.rules is not None else None
+
+    def invalidate_rules(self):
+        with self.lock:
+            self.rules = None
+
+    # Return the snapshot of the neighbors of an interface (dst ->
+    # NeighRecord), or None
+    def get_neighbours(self, ifindex):
+        with self.lock:
+            if self.neighbours is None or ifindex not in self.neighbours:
+                return None
+            return dict(self.neighbours[ifindex])
+
+    # Drop the neighbors of an interface (of all the interfaces if None)
+    # from the snapshot
+    def invalidate_neighbours(self, ifindex=None):
+        with self.lock:
+            if ifindex is None:
+                self.neighbours = None
+            elif self.neighbours is not None:
+                self.neighbours.pop(ifindex, None)
+
+    # Release the snapshot of the rules and neighbors (and of the routes)
+    def release_snapshot(self, routes=False):
+        with self.lock:
+            self.rules = None
+            self.neighbours = None
+            if routes:
+                self.routes = None
+
+    def get_ifindex(self, ifname):
+        with self.lock:
+            return self.ifindexes.get(ifname)
+
+    def get_link(self, ifindex):
+        with self.lock:
+            return self.links.get(ifindex)
+
+    def get_links(self, ifindexes=None):
+        with self.lock:
+            if not ifindexes:
+                return list(self.links.values())
+            return [
+                self.links[ifindex] for ifindex in ifindexes
+                if ifindex in self.links
+            ]
+
+    def get_addrs(self, ifindex):
+        with self.lock:
+            return list(self.addrs.get(ifindex, ()))
+
+    # Return the ifindexes of the slaves of a master device (e.g. a VRF)
+    def get_slaves(self, master):
+        with self.lock:
+            return set(self.slaves.get(master, ()))
+
+
+# Measure the memory required to cache the given number of objects
+def memory_budget(num_routes=10000, num_links=1000, addrs_per_link=2):
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    links = {}
+    addrs = {}
+    for i in range(num_links):
+        ifname = 'eth%d' % i
+        links[i + 1] = LinkRecord(
+            index=i + 1, ifname=ifname, kind='vxlan', master=None,
+            state='UP', address='00:00:00:%02x:%02x:%02x' % (
+                i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff
+            )
+        )
+        addrs[i + 1] = [
+            AddrRecord(i + 1, 10, 'fd00:%x::%x' % (i, j), 64)
+            for j in range(addrs_per_link)
+        ]
+    routes = {}
+    for i in range(num_routes):
+        route = RouteRecord(
+            family=10, table=254, dst='fd01:%x:%x::' % (i >> 16, i & 0xffff),
+            dst_len=64, oif=i % num_links + 1, priority=1024, proto=4
+        )
+        routes[route.key()] = route
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current - start
+
+
+if __name__ == '__main__':
+    used = memory_budget()
+    print('Memory used by 10k routes and 1k interfaces: %.2f MiB '
+          '(budget %.2f MiB)' % (used / 1048576, MEMORY_BUDGET / 1048576))
+    sys.exit(0 if used <= MEMORY_BUDGET else 1)
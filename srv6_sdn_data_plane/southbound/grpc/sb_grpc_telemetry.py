@@ -0,0 +1,201 @@
+#!/usr/bin/python
+
+# Streaming telemetry for the SRv6 gRPC Southbound
+#
+# A subscription samples the requested counter sets (link statistics,
+# iptables rule counters, tunnel delays) every sample interval and
+# reports only the counters whose value changed since the previous
+# sample. The first sample reports all the counters; counters that
+# disappear (e.g. a deleted tunnel) are reported as removed.
+#
+# Each counter is identified by (counter set, name, counter), where the
+# name is the interface, the rule mark or the tunnel.
+#
+# A counter set (or a tunnel) that cannot be sampled keeps the values of
+# the previous sample, so the other counters are still streamed. The
+# tunnels are probed concurrently and each probe waits at most a sample
+# interval for the reply; the sampling loop waits for the probes at most
+# a sample interval as well (a probe still running when the interval
+# expires is reported as timed out), so the probes cannot stall it.
+#
+
+from __future__ import absolute_import, division, print_function
+
+# General imports
+import logging
+import threading
+import time
+from concurrent import futures
+
+from .sb_grpc_metrics import LINK_COUNTERS, LinkStatsSampler, metrics
+
+# Counter sets
+LINK_STATS = 'link_stats'
+IPTABLES_RULES = 'iptables_rules'
+TUNNEL_DELAY = 'tunnel_delay'
+COUNTER_SETS = (LINK_STATS, IPTABLES_RULES, TUNNEL_DELAY)
+
+# Sample interval (in milliseconds)
+DEFAULT_SAMPLE_INTERVAL = 1000
+MIN_SAMPLE_INTERVAL = 100
+
+# Number of echo requests sent to measure the delay of a tunnel
+TUNNEL_DELAY_ECHO_NUMBER = 1
+# Maximum number of tunnels probed concurrently
+MAX_CONCURRENT_PROBES = 16
+
+# Table and chain of the rules marking the packets per out interface
+IPTABLES_STATS_TABLE = 'mangle'
+IPTABLES_STATS_CHAIN = 'FORWARD'
+
+# Logger reference
+logger = logging.getLogger(__name__)
+
+
+class TelemetrySubscription(object):
+
+    def __init__(self, dataplane, counter_sets, interfaces=None,
+                 tunnels=None, sample_interval=DEFAULT_SAMPLE_INTERVAL):
+        self.dataplane = dataplane
+        self.counter_sets = set(counter_sets)
+        unknown = self.counter_sets - set(COUNTER_SETS)
+        if unknown:
+            raise ValueError('Unknown counter sets: %s' % sorted(unknown))
+        # Interfaces of the link statistics (all the tunnels if empty)
+        self.interfaces = set(interfaces or ())
+        # (tunnel interface, destination endpoint) of the tunnel delays
+        self.tunnels = list(tunnels or ())
+        if not sample_interval:
+            sample_interval = DEFAULT_SAMPLE_INTERVAL
+        self.sample_interval = (
+            max(sample_interval, MIN_SAMPLE_INTERVAL) / 1000
+        )
+        self.link_stats = LinkStatsSampler()
+        # Threads probing the tunnels, created on first use, and the
+        # running probe of each tunnel
+        self.probes = None
+        self.running = {}
+        # (counter set, name, counter) -> value of the previous sample
+        self.values = {}
+
+    def sample(self):
+        values = {}
+        samplers = (
+            (LINK_STATS, self._sample_link_stats),
+            (IPTABLES_RULES, self._sample_iptables_rules),
+            (TUNNEL_DELAY, self._sample_tunnel_delay)
+        )
+        for counter_set, sampler in samplers:
+            if counter_set not in self.counter_sets:
+                continue
+            try:
+                values.update(sampler())
+            except Exception as e:
+                # Any error of the backend (netlink, iptables, nft, ...)
+                logger.warning(
+                    'Cannot sample the %s counters: %s', counter_set, e
+                )
+                metrics.inc('telemetry_sample_errors')
+                values.update(
+                    (key, value) for key, value in self.values.items()
+                    if key[0] == counter_set
+                )
+        return values
+
+    def _sample_link_stats(self):
+        values = {}
+        for stat in self.link_stats.sample(self.dataplane, self.interfaces):
+            for counter in LINK_COUNTERS:
+                values[(LINK_STATS, stat['ifname'], counter)] = stat[counter]
+        return values
+
+    def _sample_iptables_rules(self):
+        values = {}
+        for stat in self.dataplane.firewall_stats(
+            IPTABLES_STATS_TABLE, IPTABLES_STATS_CHAIN
+        ):
+            name = str(stat['out_interface'])
+            values[(IPTABLES_RULES, name, 'packets')] = stat['packets']
+            values[(IPTABLES_RULES, name, 'bytes')] = stat['bytes']
+        return values
+
+    def _sample_tunnel_delay(self):
+        values = {}
+        if not self.tunnels:
+            return values
+        if self.probes is None:
+            self.probes = futures.ThreadPoolExecutor(
+                max_workers=min(len(self.tunnels), MAX_CONCURRENT_PROBES)
+            )
+        # A tunnel whose previous probe timed out and is still running is
+        # not probed again: the sample waits for the running probe
+        probes = []
+        for tunnel, destination in self.tunnels:
+            probe = self.running.get(tunnel)
+            if probe is None or probe.done():
+                probe = self.probes.submit(
+                    self.dataplane.probe_delay,
+                    out_interface=tunnel,
+                    destination=destination,
+                    count=TUNNEL_DELAY_ECHO_NUMBER,
+                    timeout=self.sample_interval
+                )
+            probes.append((tunnel, probe))
+        self.running = dict(
+            (tunnel, probe) for tunnel, probe in probes if not probe.done()
+        )
+        deadline = time.time() + self.sample_interval
+        for tunnel, probe in probes:
+            key = (TUNNEL_DELAY, tunnel, 'delay')
+            try:
+                values[key] = probe.result(
+                    max(deadline - time.time(), 0)
+                )
+            except futures.TimeoutError:
+                logger.warning('Probe of the tunnel %s timed out', tunnel)
+                metrics.inc('telemetry_probe_timeouts')
+                if key in self.values:
+                    values[key] = self.values[key]
+            except Exception as e:
+                logger.warning('Cannot probe the tunnel %s: %s', tunnel, e)
+                metrics.inc('telemetry_sample_errors')
+                if key in self.values:
+                    values[key] = self.values[key]
+        return values
+
+    def deltas(self):
+        # Return the changed counters and the removed counters
+        values = self.sample()
+        changed = dict(
+            (key, value) for key, value in values.items()
+            if key not in self.values or self.values[key] != value
+        )
+        removed = [key for key in self.values if key not in values]
+        self.values = values
+        return changed, removed
+
+    def updates(self, is_active, stop_event=None):
+        # Generate the deltas every sample interval, until the client
+        # disconnects or the server is stopped
+        if stop_event is None:
+            stop_event = threading.Event()
+        metrics.inc('telemetry_subscriptions')
+        try:
+            while is_active() and not stop_event.is_set():
+                start = time.time()
+                changed, removed = self.deltas()
+                metrics.inc('telemetry_samples')
+                if changed or removed:
+                    yield start, changed, removed
+                # Keep the sampling period regardless of the sampling time
+                stop_event.wait(
+                    max(self.sample_interval - (time.time() - start), 0)
+                )
+        finally:
+            self.close()
+
+    def close(self):
+        if self.probes is not None:
+            self.probes.shutdown(wait=False)
+            self.probes = None
+            self.running = {}
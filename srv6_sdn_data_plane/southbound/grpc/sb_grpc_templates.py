@@ -0,0 +1,203 @@
+#!/usr/bin/python
+
+# Tunnel templates for the SRv6 gRPC Southbound
+#
+# A template holds the parameters shared by a family of tunnels (e.g. all
+# the GRE tunnels towards a hub: kind, local endpoint, ttl, key, ...).
+# Controllers register the template once; then each tunnel is created
+# from the template name, the interface name and the remote endpoint.
+# The shared parameters are validated only when the template is
+# registered, each tunnel only checks its remote endpoint.
+#
+
+from __future__ import absolute_import, division, print_function
+
+# General imports
+import threading
+from socket import AF_INET, AF_INET6, htons
+
+from .sb_grpc_utils import InvalidTunnelTemplateError, getAddressFamily
+
+# IP protocols carried by the IP-in-IP tunnels
+IPPROTO_IPIP = 4
+IPPROTO_IPV6 = 41
+
+# Tunnel kinds: prefix of the link() arguments, family of the endpoints
+# (None if both the families are supported) and supported modes, mapped
+# on the protocol carried by the tunnel
+TUNNEL_KINDS = {
+    'gre': ('gre', AF_INET, {}),
+    'ip6gre': ('ip6gre', AF_INET6, {}),
+    'sit': ('sit', AF_INET, {'ipip': IPPROTO_IPIP, 'ip6ip': IPPROTO_IPV6}),
+    'ip6tnl': (
+        'ip6tnl', AF_INET6, {'ipip6': IPPROTO_IPIP, 'ip6ip6': IPPROTO_IPV6}
+    ),
+    'vxlan': ('vxlan', None, {})
+}
+
+# Largest GRE key and VXLAN VNI
+MAX_GRE_KEY = 0xffffffff
+MAX_VNI = 0xffffff
+
+# The key is carried in the GRE header only if the GRE_KEY flag is set
+GRE_KEY = 0x2000
+# Value of the GRE flags, by kind: pyroute2 encodes the ip6gre flags in
+# host order while the kernel reads them in network order
+GRE_KEY_FLAGS = {'gre': GRE_KEY, 'ip6gre': htons(GRE_KEY)}
+
+
+# Raise InvalidTunnelTemplateError if a key is out of the range of a kind
+def _check_key(kind, key):
+    if kind == 'vxlan':
+        max_key = MAX_VNI
+    elif kind in GRE_KEY_FLAGS:
+        max_key = MAX_GRE_KEY
+    else:
+        raise InvalidTunnelTemplateError(
+            '%s tunnels do not support a key' % kind
+        )
+    if not 0 <= key <= max_key:
+        raise InvalidTunnelTemplateError(
+            'Invalid key %s for %s tunnels' % (key, kind)
+        )
+
+
+class TunnelTemplate(object):
+    '''Parameters shared by the tunnels created from the template
+
+    key is the GRE key or the VXLAN VNI (None to leave it unset, it can
+    also be given for each tunnel); link is the name of the underlay
+    interface of the VXLAN tunnels. The local endpoint of a VXLAN template
+    sets the family of its tunnels.
+    '''
+
+    __slots__ = ('name', 'kind', 'local', 'ttl', 'key', 'mode', 'link',
+                 'port')
+
+    def __init__(self, name, kind, local=None, ttl=None, key=None,
+                 mode=None, link=None, port=None):
+        if kind not in TUNNEL_KINDS:
+            raise InvalidTunnelTemplateError('Unknown tunnel kind %s' % kind)
+        _, family, modes = TUNNEL_KINDS[kind]
+        if local is not None and (
+            getAddressFamily(local) is None
+            or family not in (None, getAddressFamily(local))
+        ):
+            raise InvalidTunnelTemplateError(
+                'Invalid local endpoint %s for %s tunnels' % (local, kind)
+            )
+        if ttl is not None and not 0 <= ttl <= 255:
+            raise InvalidTunnelTemplateError('Invalid ttl %s' % ttl)
+        if modes and mode not in modes or not modes and mode is not None:
+            raise InvalidTunnelTemplateError(
+                'Invalid mode %s for %s tunnels' % (mode, kind)
+            )
+        if key is not None:
+            _check_key(kind, key)
+        if kind == 'vxlan' and (link is None or port is None):
+            raise InvalidTunnelTemplateError(
+                'VXLAN templates require the link and the port'
+            )
+        self.name = name
+        self.kind = kind
+        self.local = local
+        self.ttl = ttl
+        self.key = key
+        self.mode = mode
+        self.link = link
+        self.port = port
+
+    # Return the (ifname, kind, params) of a tunnel, as accepted by the
+    # tunnel_batch() of the backends; vxlan_link is the ifindex of the
+    # link of the template
+    def instantiate(self, ifname, remote, key=None, vxlan_link=None):
+        prefix, family, modes = TUNNEL_KINDS[self.kind]
+        remote_family = getAddressFamily(remote)
+        if self.local is not None:
+            # The endpoints of a VXLAN tunnel are in the same family
+            family = getAddressFamily(self.local)
+        if remote_family is None or family not in (None, remote_family):
+            raise InvalidTunnelTemplateError(
+                'Invalid remote endpoint %s for template %s'
+                % (remote, self.name)
+            )
+        if key is not None:
+            _check_key(self.kind, key)
+        key = key if key is not None else self.key
+        params = {}
+        if self.kind == 'vxlan':
+            if key is None:
+                raise InvalidTunnelTemplateError(
+                    'Missing VNI for template %s' % self.name
+                )
+            params['vxlan_link'] = vxlan_link
+            params['vxlan_id'] = key
+            params['vxlan_port'] = self.port
+            params['vxlan_port_range'] = {
+                'low': self.port, 'high': self.port + 1
+            }
+            if remote_family == AF_INET:
+                params['vxlan_group'] = remote
+            else:
+                params['vxlan_group6'] = remote
+            if self.local is not None:
+                if remote_family == AF_INET:
+                    params['vxlan_local'] = self.local
+                else:
+                    params['vxlan_local6'] = self.local
+        else:
+            params['%s_remote' % prefix] = remote
+            if self.mode is not None:
+                params['%s_proto' % prefix] = modes[self.mode]
+            if key is not None:
+                # Same key in both the directions, as "ip link ... key"
+                params['%s_ikey' % prefix] = key
+                params['%s_okey' % prefix] = key
+                params['%s_iflags' % prefix] = GRE_KEY_FLAGS[self.kind]
+                params['%s_oflags' % prefix] = GRE_KEY_FLAGS[self.kind]
+            if self.local is not None:
+                params['%s_local' % prefix] = self.local
+        if self.ttl is not None:
+            params['%s_ttl' % prefix] = self.ttl
+        return (ifname, self.kind, params)
+
+    def __repr__(self):
+        return 'TunnelTemplate(%s)' % ', '.join(
+            '%s=%r' % (attr, getattr(self, attr))
+            for attr in self.__slots__
+            if getattr(self, attr) is not None
+        )
+
+
+class TunnelTemplateRegistry(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> TunnelTemplate
+        self.templates = {}
+
+    def register(self, template, replace=False):
+        with self.lock:
+            if not replace and template.name in self.templates:
+                raise InvalidTunnelTemplateError(
+                    'Template %s already exists' % template.name
+                )
+            self.templates[template.name] = template
+
+    def unregister(self, name):
+        with self.lock:
+            if self.templates.pop(name, None) is None:
+                raise InvalidTunnelTemplateError(
+                    'Unknown template %s' % name
+                )
+
+    def get(self, name):
+        with self.lock:
+            template = self.templates.get(name)
+        if template is None:
+            raise InvalidTunnelTemplateError('Unknown template %s' % name)
+        return template
+
+    def list(self):
+        with self.lock:
+            return list(self.templates.values())
@@ -25,6 +25,10 @@
 
 from __future__ import absolute_import, division, print_function
 
+import importlib
+import logging
+import threading
+import time
 from ipaddress import IPv4Interface, IPv6Interface
 from ipaddress import AddressValueError
 from socket import AF_INET, AF_INET6
@@ -75,6 +79,55 @@ def getAddressFamily(ip):
         return None
 
 
+# Module proxy importing the real module on first attribute access
+class LazyModule(object):
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                start = time.time()
+                module = importlib.import_module(self._name)
+                logging.info(
+                    'Loaded module %s in %.1f ms',
+                    self._name, (time.time() - start) * 1000
+                )
+                self.__dict__['_module'] = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+
+# Collect the duration of the startup phases and log a report
+class StartupTimer(object):
+
+    def __init__(self):
+        self.start = time.time()
+        self.last = self.start
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.time()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        logging.info('*** Startup timing report')
+        for phase, duration in self.phases:
+            logging.info('***   %-30s %8.1f ms', phase, duration * 1000)
+        logging.info(
+            '***   %-30s %8.1f ms', 'total', (self.last - self.start) * 1000
+        )
+
+
 class SouthboundGRPCError(Exception):
     pass
 
@@ -84,4 +137,28 @@ class InvalidAddressFamilyError(SouthboundGRPCError):
 
 
 class InvalidIPTablesRequestError(SouthboundGRPCError):
-    pass
\ No newline at end of file
+    pass
+
+
+class InvalidFirewallRuleError(InvalidIPTablesRequestError):
+    pass
+
+
+class NftablesError(SouthboundGRPCError):
+    pass
+
+
+class InvalidLoadBalancerError(SouthboundGRPCError):
+    pass
+
+
+class InvalidTunnelTemplateError(SouthboundGRPCError):
+    pass
+
+
+class JobQueueFullError(SouthboundGRPCError):
+    pass
+
+
+class AdmissionRejectedError(SouthboundGRPCError):
+    pass
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+
+# Tests of the queue of the asynchronous jobs
+
+from __future__ import absolute_import, division, print_function
+
+import threading
+import unittest
+
+from srv6_sdn_data_plane.southbound.grpc.sb_grpc_jobs import (
+    DEFAULT_JOB_WORKERS, DEFAULT_MAX_FINISHED_JOBS, DEFAULT_MAX_PENDING_JOBS,
+    JOB_DONE, JOB_FAILED, JOB_RUNNING, JobQueue
+)
+from srv6_sdn_data_plane.southbound.grpc.sb_grpc_utils import (
+    JobQueueFullError
+)
+
+SUCCESS = 'ok'
+
+# Maximum time (in seconds) waited for a job
+TIMEOUT = 10
+
+
+# Execute the steps as (op, status): the status is returned as is, the
+# steps wait until the gate is open
+class Executor(object):
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.gate.set()
+        self.steps = []
+
+    def __call__(self, op, status, client):
+        self.steps.append((op, status, client))
+        self.gate.wait()
+        return status, '%s:%s' % (op, status)
+
+
+# Wait until a job is finished, following its progress
+def watch(job):
+    progress = []
+    done = None
+    while not job.is_finished():
+        if not job.wait(done, TIMEOUT):
+            raise AssertionError('Job %s stuck' % job.id)
+        if job.done != done:
+            done = job.done
+            progress.append(done)
+    return progress
+
+
+class JobQueueTest(unittest.TestCase):
+
+    def test_submit_watch(self):
+        execute = Executor()
+        jobs = JobQueue(execute, SUCCESS)
+        job = jobs.submit(
+            [('add', SUCCESS), ('change', SUCCESS), ('del', SUCCESS)],
+            client='ctrl1'
+        )
+        self.assertIs(jobs.get(job.id), job)
+        self.assertEqual(watch(job)[-1], 3)
+        self.assertEqual(job.state, JOB_DONE)
+        self.assertEqual(job.errors, [])
+        self.assertEqual(
+            job.replies, ['add:ok', 'change:ok', 'del:ok']
+        )
+        # The steps are executed on behalf of the client of the job
+        self.assertEqual(
+            set(client for _, _, client in execute.steps), set(['ctrl1'])
+        )
+        with self.assertRaises(KeyError):
+            jobs.get('unknown')
+
+    def test_failed_steps(self):
+        jobs = JobQueue(Executor(), SUCCESS)
+        job = jobs.submit([('add', 'error'), ('del', SUCCESS)])
+        watch(job)
+        self.assertEqual(job.state, JOB_FAILED)
+        self.assertEqual(job.done, 2)
+        self.assertEqual(job.errors, [(0, 'error', '')])
+        # The job stops at the first failed step
+        job = jobs.submit(
+            [('add', 'error'), ('del', SUCCESS)], stop_on_error=True
+        )
+        watch(job)
+        self.assertEqual(job.state, JOB_FAILED)
+        self.assertEqual(job.done, 1)
+
+    def test_max_pending_jobs(self):
+        execute = Executor()
+        execute.gate.clear()
+        self.addCleanup(execute.gate.set)
+        jobs = JobQueue(execute, SUCCESS)
+        # The workers take a job each and block on it
+        running = [
+            jobs.submit([('add', SUCCESS)])
+            for _ in range(DEFAULT_JOB_WORKERS)
+        ]
+        for job in running:
+            while job.state != JOB_RUNNING:
+                job.wait(0, 0.01)
+        pending = [
+            jobs.submit([('add', SUCCESS)])
+            for _ in range(DEFAULT_MAX_PENDING_JOBS)
+        ]
+        with self.assertRaises(JobQueueFullError):
+            jobs.submit([('add', SUCCESS)])
+        # The queue drains when the steps complete
+        execute.gate.set()
+        for job in running + pending:
+            watch(job)
+            self.assertEqual(job.state, JOB_DONE)
+        watch(jobs.submit([('add', SUCCESS)]))
+
+    def test_max_finished_jobs(self):
+        jobs = JobQueue(Executor(), SUCCESS)
+        finished = []
+        for _ in range(DEFAULT_MAX_FINISHED_JOBS + 10):
+            job = jobs.submit([('add', SUCCESS)])
+            watch(job)
+            finished.append(job)
+        # The oldest finished jobs are forgotten when a job is submitted
+        last = jobs.submit([('add', SUCCESS)])
+        watch(last)
+        for job in finished[:10]:
+            with self.assertRaises(KeyError):
+                jobs.get(job.id)
+        for job in finished[10:]:
+            self.assertIs(jobs.get(job.id), job)
+        self.assertIs(jobs.get(last.id), last)
+
+
+if __name__ == '__main__':
+    unittest.main()
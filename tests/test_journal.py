@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+# Tests of the journal of the applied operations
+
+from __future__ import absolute_import, division, print_function
+
+import shutil
+import tempfile
+import unittest
+
+from srv6_sdn_data_plane.southbound.grpc.sb_grpc_journal import Journal
+
+
+# Payloads are b'<route>=<gateway>': the object is the route
+def object_keys(payload):
+    return 'route', set([payload.split(b'=')[0]])
+
+
+# Replay the records on a routing table, with the semantics of the
+# handlers: add creates a missing route, change replaces (or creates) the
+# route, del removes the route
+def replay(entries):
+    routes = {}
+    for _, op, payload in entries:
+        route, gateway = payload.split(b'=')
+        if op == 'add':
+            routes.setdefault(route, gateway)
+        elif op == 'change':
+            routes[route] = gateway
+        elif op == 'del':
+            routes.pop(route, None)
+    return routes
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def open(self, **kwargs):
+        journal = Journal(
+            self.path, fsync_interval=1, object_keys=object_keys, **kwargs
+        )
+        journal.open()
+        self.addCleanup(journal.close)
+        return journal
+
+    def test_add_del_cancelled(self):
+        journal = self.open()
+        journal.append('add', b'r1=gw1')
+        journal.append('add', b'r2=gw1')
+        journal.append('del', b'r1=gw1')
+        self.assertEqual(journal.entries(), [(2, 'add', b'r2=gw1')])
+        self.assertEqual(journal.version, 3)
+
+    def test_del_cancels_by_object(self):
+        journal = self.open()
+        journal.append('add', b'r1=gw1')
+        journal.append('change', b'r1=gw2')
+        journal.append('add', b'r2=gw1')
+        # The del has a different payload, the object is the same
+        journal.append('del', b'r1=gw3')
+        self.assertEqual(journal.entries(), [(3, 'add', b'r2=gw1')])
+
+    def test_del_of_object_not_added_kept(self):
+        journal = self.open()
+        # The route existed before the change (e.g. added by the kernel):
+        # the del is needed to remove it after a restart
+        journal.append('change', b'r1=gw2')
+        journal.append('del', b'r1=gw2')
+        self.assertEqual(journal.entries(), [(2, 'del', b'r1=gw2')])
+        journal.close()
+        self.assertEqual(self.open().entries(), [(2, 'del', b'r1=gw2')])
+
+    def test_add_change_del_replay(self):
+        journal = self.open()
+        journal.append('add', b'r1=gw1')
+        journal.append('change', b'r1=gw2')
+        journal.append('del', b'r1=gw1')
+        # The del cancels the change as well, which would create the
+        # route again
+        self.assertEqual(replay(journal.entries()), {})
+        journal.close()
+        # Same state after a restart
+        self.assertEqual(replay(self.open().entries()), {})
+
+    def test_add_change_del_replay_compacted(self):
+        journal = self.open(compact_threshold=1)
+        journal.append('add', b'r1=gw1')
+        journal.append('change', b'r1=gw2')
+        journal.append('del', b'r1=gw1')
+        journal.append('add', b'r2=gw1')
+        journal.close()
+        journal = self.open()
+        self.assertEqual(journal.version, 4)
+        self.assertEqual(replay(journal.entries()), {b'r2': b'gw1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
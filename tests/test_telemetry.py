@@ -0,0 +1,135 @@
+#!/usr/bin/python
+
+# Tests of the streaming telemetry subscriptions
+
+from __future__ import absolute_import, division, print_function
+
+import threading
+import unittest
+
+from srv6_sdn_data_plane.southbound.grpc.sb_grpc_telemetry import (
+    IPTABLES_RULES, LINK_STATS, TUNNEL_DELAY, TelemetrySubscription
+)
+
+
+class Link(dict):
+
+    def __init__(self, index, ifname, **counters):
+        dict.__init__(self, index=index)
+        self.attrs = {'IFLA_IFNAME': ifname, 'IFLA_STATS64': counters}
+
+    def get_attr(self, name):
+        return self.attrs.get(name)
+
+
+# Backend returning the counters set by the tests; the probes of the
+# blocked tunnels wait until the tunnels are unblocked
+class FakeBackend(object):
+
+    def __init__(self):
+        self.links = []
+        self.rules = []
+        self.delays = {}
+        self.blocked = {}
+        self.probed = []
+
+    def get_links(self):
+        return list(self.links)
+
+    def firewall_stats(self, table, chain):
+        if isinstance(self.rules, Exception):
+            raise self.rules
+        return list(self.rules)
+
+    def probe_delay(self, out_interface, destination, count, timeout):
+        self.probed.append(out_interface)
+        if out_interface in self.blocked:
+            self.blocked[out_interface].wait()
+        return self.delays[out_interface]
+
+
+class TelemetryTest(unittest.TestCase):
+
+    def subscribe(self, backend, counter_sets, **kwargs):
+        subscription = TelemetrySubscription(
+            backend, counter_sets, sample_interval=100, **kwargs
+        )
+        self.addCleanup(subscription.close)
+        return subscription
+
+    def test_deltas_only(self):
+        backend = FakeBackend()
+        backend.links = [
+            Link(1, 'gre1', rx_packets=1, tx_packets=2),
+            Link(2, 'gre2', rx_packets=3)
+        ]
+        subscription = self.subscribe(
+            backend, [LINK_STATS], interfaces=['gre1', 'gre2']
+        )
+        # The first sample reports all the counters
+        changed, removed = subscription.deltas()
+        self.assertEqual(changed[(LINK_STATS, 'gre1', 'tx_packets')], 2)
+        self.assertEqual(len(changed), 16)
+        self.assertEqual(removed, [])
+        # Nothing changed
+        self.assertEqual(subscription.deltas(), ({}, []))
+        # Only the changed counter is reported
+        backend.links[0] = Link(1, 'gre1', rx_packets=1, tx_packets=5)
+        self.assertEqual(
+            subscription.deltas(),
+            ({(LINK_STATS, 'gre1', 'tx_packets'): 5}, [])
+        )
+        # The counters of a deleted interface are reported as removed
+        del backend.links[1]
+        changed, removed = subscription.deltas()
+        self.assertEqual(changed, {})
+        self.assertEqual(len(removed), 8)
+        self.assertTrue(all(key[1] == 'gre2' for key in removed))
+
+    def test_failed_counter_set_keeps_values(self):
+        backend = FakeBackend()
+        backend.links = [Link(1, 'gre1', rx_packets=1)]
+        backend.rules = [{'out_interface': 1, 'packets': 10, 'bytes': 100}]
+        subscription = self.subscribe(
+            backend, [LINK_STATS, IPTABLES_RULES], interfaces=['gre1']
+        )
+        subscription.deltas()
+        backend.rules = OSError('iptables failure')
+        backend.links = [Link(1, 'gre1', rx_packets=2)]
+        # The rule counters are not reported as removed, the link
+        # statistics are still streamed
+        self.assertEqual(
+            subscription.deltas(),
+            ({(LINK_STATS, 'gre1', 'rx_packets'): 2}, [])
+        )
+
+    def test_probe_timeout(self):
+        backend = FakeBackend()
+        backend.delays = {'tun1': 1.5, 'tun2': 2.5}
+        subscription = self.subscribe(
+            backend, [TUNNEL_DELAY],
+            tunnels=[('tun1', 'fd00::1'), ('tun2', 'fd00::2')]
+        )
+        changed, _ = subscription.deltas()
+        self.assertEqual(changed[(TUNNEL_DELAY, 'tun1', 'delay')], 1.5)
+        # The probe of tun1 does not reply within the sample interval: the
+        # previous delay is kept and tun2 is still sampled
+        backend.blocked['tun1'] = threading.Event()
+        self.addCleanup(backend.blocked['tun1'].set)
+        backend.delays = {'tun1': 3.5, 'tun2': 4.5}
+        self.assertEqual(
+            subscription.deltas(),
+            ({(TUNNEL_DELAY, 'tun2', 'delay'): 4.5}, [])
+        )
+        # The running probe of tun1 is not submitted again
+        subscription.deltas()
+        self.assertEqual(backend.probed.count('tun1'), 2)
+        self.assertEqual(backend.probed.count('tun2'), 3)
+        # The delay is reported when the probe replies
+        backend.blocked['tun1'].set()
+        changed, _ = subscription.deltas()
+        self.assertEqual(changed, {(TUNNEL_DELAY, 'tun1', 'delay'): 3.5})
+
+
+if __name__ == '__main__':
+    unittest.main()